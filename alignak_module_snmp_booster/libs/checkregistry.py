@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2012-2014:
+#    Thibault Cohen, thibault.cohen@savoirfairelinux.com
+#
+# This file is part of SNMP Booster Shinken Module.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with SNMP Booster Shinken Module.
+# If not, see <http://www.gnu.org/licenses/>.
+
+
+""" This module contains the registry of the checks handled by the poller """
+
+
+from collections import deque
+from Queue import Empty, Queue
+
+
+class CheckRegistry(object):
+    """ Checks handled by a poller worker, indexed by state:
+
+    * queued: received from the poller, waiting to be launched
+    * launched: launched, waiting for their result
+    * done: completion queue of the checks which got their result.
+      Checks are pushed on it by the code which marks them as received
+      or done, from any thread
+
+    Each operation costs O(1) per check changing state, whatever the
+    number of checks in the registry.
+    """
+    def __init__(self, done_queue=None):
+        self.queued = deque()
+        self.launched = {}
+        # Launched checks, oldest first, to find timed out checks
+        # without browsing all launched checks
+        self.launch_order = deque()
+        self.done = done_queue if done_queue is not None else Queue()
+
+    def __len__(self):
+        return len(self.queued) + len(self.launched)
+
+    def add(self, check):
+        """ Add a new check to launch """
+        self.queued.append(check)
+
+    def pop_queued(self):
+        """ Get checks to launch, oldest first """
+        while self.queued:
+            yield self.queued.popleft()
+
+    def set_launched(self, check):
+        """ Mark a check as launched """
+        self.launched[id(check)] = check
+        self.launch_order.append(check)
+
+    def keep_launched(self, check):
+        """ Put back a check taken from the completion queue too early """
+        self.launched[id(check)] = check
+
+    def is_launched(self, check):
+        """ Return True if the check is launched and not returned yet """
+        return self.launched.get(id(check)) is check
+
+    def set_done(self, check):
+        """ Push a check on the completion queue """
+        self.done.put(check)
+
+    def pop_done(self):
+        """ Get the checks of the completion queue
+
+        A check pushed several times is only returned once
+        """
+        while True:
+            try:
+                check = self.done.get(block=False)
+            except Empty:
+                break
+            if self.is_launched(check):
+                del self.launched[id(check)]
+                yield check
+
+    def pop_timed_out(self, now, timeout):
+        """ Get launched checks older than timeout seconds
+
+        Returned checks are still launched: the caller has to set them done
+        """
+        while self.launch_order:
+            check = self.launch_order[0]
+            if not self.is_launched(check):
+                # Already returned
+                self.launch_order.popleft()
+            elif now > check.check_time + timeout:
+                self.launch_order.popleft()
+                yield check
+            else:
+                # Next checks are younger
+                break
@@ -23,31 +23,39 @@
 """ This module contains two functions:
 * check_cache: Get data from cache
 * check_snmp: Get data from SNMP request
+and the functions they use to send SNMP requests
 """
 
 
 import time
 from functools import partial
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 import logging
 
 logger = logging.getLogger(__name__)  # pylint: disable=C0103
 
-try:
-    from pysnmp.entity.rfc3413.oneliner import cmdgen
-except ImportError as exp:
-    logger.error("[SnmpBooster] [code 0201] Import error. Pysnmp is missing")
-    raise ImportError(exp)
-
 from snmpworker import callback_mapping_next, callback_mapping_bulk
-from snmpworker import callback_get
+from snmpworker import callback_get, callback_mapping_state, callback_table
+from snmpworker import callback_probe
+from snmpworker import mapping_cache_is_valid
+from snmpworker import SYSUPTIME_OID, IFTABLELASTCHANGE_OID
+from utils import oid_to_tuple, get_usm_user
 
 
 __all__ = ("check_cache", "check_snmp")
 
 
-def check_cache(check, arguments, db_client):
-    """ Get data from database """
+# End of the datasource oids collected by table
+INSTANCE_SUFFIX = ".%(instance)s"
+# Number of times the missing oids of a failed GET request are requested
+# again, before the deadline of the check
+GET_RETRIES = 2
+# Timeout (in seconds) of the checks without one
+CHECK_TIMEOUT = 60
+
+
+def prepare_check_result(check, arguments, db_client):
+    """ Get data from database and set the check result """
     start_time = time.time()
     # Get current service
     current_service = db_client.get_service(arguments.get('host'),
@@ -77,6 +85,8 @@ def check_cache(check, arguments, db_client):
                    'exit_code': 3,
                    'start_time': start_time,
                    'state': 'received',
+                   'deadline': start_time + getattr(check, 'timeout',
+                                                    CHECK_TIMEOUT),
                    'output': None,
                    'db_data': current_service,
                    }
@@ -87,16 +97,44 @@ def check_cache(check, arguments, db_client):
     return current_service
 
 
-def check_snmp(check, arguments, db_client, task_queue, result_queue):
-    """ Prepare snmp requests """
+def check_cache(check, arguments, db_client, done_queue):
+    """ Get data from database
+    The check is pushed on done_queue once its result is received
+    """
+    current_service = prepare_check_result(check, arguments, db_client)
+    done_queue.put(check)
+    return current_service
+
+
+def check_snmp(check, arguments, db_client, task_queue, result_queue,
+               done_queue, target_cache, group_sizes=None, host_breakers=None,
+               preflight_requests=0):
+    """ Prepare snmp requests
+
+    When instances need to be mapped, the check is parked (its result
+    state is 'mapping') while the mapping tables are walked. The walk
+    callbacks then save the instances, send the GET requests and push
+    the check on done_queue, so the poller never waits for the walk.
+
+    When the circuit breaker of the host is open, only a probe request
+    is sent and the check gives an UNKNOWN result.
+    """
     # Get current service
-    current_service = check_cache(check, arguments, db_client)
+    current_service = prepare_check_result(check, arguments, db_client)
 
     if current_service is None:
+        done_queue.put(check)
         return None
 
-    # Get check_interval
-    check_interval = current_service.get('check_interval')
+    if host_breakers is not None and host_breakers.is_open(arguments.get('address')):
+        check.result['error'] = ("SNMP polling suspended: the host does not "
+                                 "answer")
+        if host_breakers.start_probe(arguments.get('address'),
+                                     current_service['timeout']):
+            send_probe_task(check.result, arguments, current_service,
+                            task_queue, target_cache)
+        done_queue.put(check)
+        return None
 
     # Get all services with this host and check_interval
     services = db_client.get_services(arguments.get('host'),
@@ -110,122 +148,498 @@ def check_snmp(check, arguments, db_client, task_queue, result_queue):
     # len(mappings) == nb of map missing
     if len(mappings) > 0:
         # WE NEED MAPPING !
-        # Prepare mapping order
-        snmp_info = namedtuple("snmp_info",
-                               ['community',
-                                'address',
-                                'port',
-                                'mapping',
-                                'use_getbulk'])
-        snmp_infos = list(set([snmp_info(serv['community'],
-                                         serv['address'],
-                                         serv['port'],
-                                         serv['mapping'],
-                                         serv['use_getbulk']
-                                         )
-                               for serv in mappings]))
-        # Launch one requests for each mapping table
-        for snmp_info in snmp_infos:
-            result = {}
-            result['data'] = dict([(serv['instance_name'], None)
-                                   for serv in mappings])
-            result['finished'] = False
-
-            mapping_task = {}
-            # Add address
-            mapping_task['host'] = snmp_info.address
-            # Get concurrency
-            mapping_task['no_concurrency'] = serv.get('no_concurrency', False)
-            mapping_task['data'] = {"authData": cmdgen.CommunityData(snmp_info.community),
-                                    "transportTarget": cmdgen.UdpTransportTarget((snmp_info.address,
-                                                                                  snmp_info.port),
-                                                                                 timeout=serv['timeout'],
-                                                                                 retries=0,
-                                                                                 ),
-                                    "varNames": (str(snmp_info.mapping[1:]), ),
-                                    }
-            if snmp_info.use_getbulk:
-                # Add snmp request type
-                mapping_task['type'] = 'bulk'
-                mapping_task['data']["nonRepeaters"] = 0
-                mapping_task['data']["maxRepetitions"] = serv.get('max_rep_map',
-                                                                  64)
-                mapping_task['data']['cbInfo'] = (callback_mapping_bulk,
-                                                  (serv['mapping'],
-                                                   check.result,
-                                                   result))
-            else:
-                # Add snmp request type
-                mapping_task['type'] = 'next'
-                mapping_task['data']['cbInfo'] = (callback_mapping_next,
-                                                  (serv['mapping'],
-                                                   check.result,
-                                                   result))
-            task_queue.put(mapping_task, block=False)
-
-        # Handle result
-        counter = 0
-        # Waiting mapping snmp requests
-        while not result['finished'] and counter < (5 + serv['timeout'] * 10):
-            # Wait mapping completed or timeout (100 * 0.1 second)
-            counter += 1
-            time.sleep(0.1)
-
-        # Todo: What if there is the same iname for 2 serv => override one, not good
-        map_inst_serv = dict([(serv['instance_name'], serv['service']) for serv in mappings])
+        # Park the check until the mapping is done
+        check.result['state'] = 'mapping'
+        mapping = {'check': check,
+                   'check_result': check.result,
+                   'arguments': arguments,
+                   'db_client': db_client,
+                   'task_queue': task_queue,
+                   'target_cache': target_cache,
+                   'group_sizes': group_sizes,
+                   'preflight_requests': preflight_requests,
+                   'result_queue': result_queue,
+                   'done_queue': done_queue,
+                   'current_service': current_service,
+                   'services': mappings,
+                   'tables': [],
+                   }
+        send_mapping_tasks(mapping)
+        return None
+
+    send_get_tasks(check.result, arguments, current_service, services,
+                   task_queue, result_queue, target_cache, db_client,
+                   group_sizes, preflight_requests)
+    done_queue.put(check)
+
+
+def send_probe_task(check_result, arguments, current_service, task_queue,
+                    target_cache):
+    """ Send a GET request of sysUpTime to a host with its circuit breaker
+    open, the worker closes the breaker when it is answered
+    """
+    probe_task = prepare_task(current_service, arguments.get('address'),
+                              arguments.get('port'), arguments.get('community'),
+                              get_usm_user(arguments), target_cache)
+    probe_task['type'] = 'get'
+    probe_task['data']["varNames"] = [SYSUPTIME_OID[1:]]
+    probe_task['data']['cbInfo'] = (callback_probe, (check_result,))
+    task_queue.put(probe_task, block=False)
+
+
+def send_mapping_tasks(mapping):
+    """ Map the instances of each mapping table needed by the services
+
+    The mapping cache of a table is shared by all the services of the
+    host. A GET of the device state (sysUpTime and ifTableLastChange) is
+    sent first: tables found in a valid cache are mapped from it, the
+    others are walked (see callback_mapping_state)
+    """
+    # Prepare mapping order
+    snmp_info = namedtuple("snmp_info",
+                           ['community',
+                            'address',
+                            'port',
+                            'mapping',
+                            'use_getbulk'])
+    tables = {}
+    for serv in mapping['services']:
+        tables.setdefault(snmp_info(serv['community'],
+                                    serv['address'],
+                                    serv['port'],
+                                    serv['mapping'],
+                                    serv['use_getbulk'],
+                                    ),
+                          []).append(serv)
+    # Count walks to wait for
+    mapping['pending'] = len(tables)
+    # Tables of each device
+    targets = {}
+    for snmp_info, table_services in tables.items():
+        result = {}
+        result['data'] = dict([(table_serv['instance_name'], None)
+                               for table_serv in table_services])
+        result['finished'] = False
+        # Names not found yet
+        result['remaining'] = len(result['data'])
+        # Only names of these lengths can match
+        result['name_lengths'] = frozenset([len(name) for name in result['data']])
+        result['mapping_oid'] = oid_to_tuple(snmp_info.mapping)
+        result['snmp_info'] = snmp_info
+        result['services'] = table_services
+        # Called when the walk is finished
+        result['on_finished'] = partial(mapping_table_done, mapping)
+        # Mapping cache of the table and device state
+        result['cache'] = mapping['db_client'].get_mapping(mapping['arguments'].get('host'),
+                                                           snmp_info.mapping)
+        result['state'] = None
+        result['from_cache'] = False
+        mapping['tables'].append(result)
+        targets.setdefault((snmp_info.address, snmp_info.port,
+                            snmp_info.community), []).append(result)
+
+    # Launch one device state request for each device
+    for (address, port, community), results in targets.items():
+        state_task = prepare_task(results[0]['services'][0], address, port,
+                                  community,
+                                  get_usm_user(mapping['arguments']),
+                                  mapping['target_cache'])
+        state_task['type'] = 'get'
+        state_task['data']["varNames"] = [SYSUPTIME_OID[1:],
+                                          IFTABLELASTCHANGE_OID[1:]]
+        state_task['data']['cbInfo'] = (callback_mapping_state,
+                                        (results,
+                                         mapping['check_result'],
+                                         partial(send_mapping_walks, mapping)))
+        mapping['task_queue'].put(state_task, block=False)
+
+
+def send_mapping_walks(mapping, results):
+    """ Send one walk of the mapping tables of results for each device
+
+    The tables of a device are walked together, one column for each
+    table, and each table is finished on its own (see map_instances)
+    """
+    walks = {}
+    for result in results:
+        snmp_info = result['snmp_info']
+        walks.setdefault((snmp_info.address, snmp_info.port,
+                          snmp_info.community, snmp_info.use_getbulk),
+                         []).append(result)
+    for (address, port, community, use_getbulk), walk_results in walks.items():
+        # Settings are the same for all the services of the device
+        serv = walk_results[0]['services'][0]
+        mapping_task = prepare_task(serv, address, port, community,
+                                    get_usm_user(mapping['arguments']),
+                                    mapping['target_cache'])
+        mapping_task['data']["varNames"] = [str(result['snmp_info'].mapping[1:])
+                                            for result in walk_results]
+        if use_getbulk:
+            # Add snmp request type
+            mapping_task['type'] = 'bulk'
+            mapping_task['data']["nonRepeaters"] = 0
+            # Responses keep the size of the walk of one table
+            mapping_task['data']["maxRepetitions"] = max(1, serv.get('max_rep_map', 64) //
+                                                         len(walk_results))
+            callback = callback_mapping_bulk
+        else:
+            # Add snmp request type
+            mapping_task['type'] = 'next'
+            callback = callback_mapping_next
+        mapping_task['data']['cbInfo'] = (callback,
+                                          (mapping_task['data']["varNames"],
+                                           mapping['check_result'],
+                                           walk_results))
+        mapping['task_queue'].put(mapping_task, block=False)
+
+
+def prepare_task(serv, address, port, community, usm_user, target_cache):
+    """ Return an SNMP task for a device, with the settings of serv
+
+    usm_user is the SNMP v3 user of the check arguments (see
+    get_usm_user): the keys are not saved with the services
+    """
+    task = {}
+    # Add address
+    task['host'] = address
+    # Get concurrency
+    task['no_concurrency'] = serv.get('no_concurrency', False)
+    # Get timeout
+    task['timeout'] = serv['timeout']
+    # Get SNMP version
+    task['version'] = serv.get('version')
+    auth_data, transport_target = target_cache.get_target(address,
+                                                          port,
+                                                          community,
+                                                          serv.get('version'),
+                                                          serv['timeout'],
+                                                          usm_user)
+    task['data'] = {"authData": auth_data,
+                    "transportTarget": transport_target,
+                    }
+    return task
 
+
+def update_mapping_cache(db_client, host, result, mapping_oid):
+    """ Save the instances found by the walk of a mapping table in its
+    cache, with the device state read before the walk
+    """
+    state = result['state']
+    if result['from_cache'] or state is None:
+        # Nothing new, or the device did not answer
+        return
+    instances = dict([(name, instance)
+                      for name, instance in result['data'].items()
+                      if instance is not None])
+    cache = result['cache']
+    if mapping_cache_is_valid(cache, state, result['mapping_oid']):
+        # The device did not change, other services found other names
+        cache['instances'].update(instances)
+        instances = cache['instances']
+    elif not instances:
+        return
+    db_client.update_mapping(host, mapping_oid,
+                             {'instances': instances,
+                              'uptime': state['uptime'],
+                              'last_change': state['last_change'],
+                              'check_time': time.time(),
+                              })
+
+
+def mapping_table_done(mapping):
+    """ Called (in the SNMP worker thread) when the walk of a mapping table
+    is finished. Once all tables are walked, save found instances, send
+    the GET requests and release the parked check
+    """
+    mapping['pending'] -= 1
+    if mapping['pending'] > 0:
+        # Waiting for other tables
+        return
+    check = mapping['check']
+    check_result = mapping['check_result']
+    arguments = mapping['arguments']
+    db_client = mapping['db_client']
+    current_service = mapping['current_service']
+    try:
         # Write to database
-        for instance_name, instance in result['data'].items():
-            if instance is None:
-                # Don't save instances which are not mapped
-                continue
-            service = map_inst_serv[instance_name]
-            db_client.update_service(arguments.get('host'), service, {"instance": instance})
+        for result in mapping['tables']:
+            # Todo: What if there is the same iname for 2 serv => override one, not good
+            map_inst_serv = dict([(serv['instance_name'], serv['service'])
+                                  for serv in result['services']])
+            for instance_name, instance in result['data'].items():
+                if instance is None:
+                    # Don't save instances which are not mapped
+                    continue
+                service = map_inst_serv[instance_name]
+                db_client.update_service(arguments.get('host'), service, {"instance": instance})
+            update_mapping_cache(db_client, arguments.get('host'), result,
+                                 result['services'][0]['mapping'])
         # refresh all services list
-        # NOTE Is this refresh mandatory ????
         services = db_client.get_services(arguments.get('host'),
                                           current_service.get('check_interval'))
         # MAPPING DONE
+        send_get_tasks(check_result, arguments, current_service, services,
+                       mapping['task_queue'], mapping['result_queue'],
+                       mapping['target_cache'], db_client,
+                       mapping.get('group_sizes'),
+                       mapping.get('preflight_requests', 0))
+        # The check shows the instance found
+        current_service = db_client.get_service(arguments.get('host'),
+                                                arguments.get('service'))
+        if current_service is not None:
+            check_result['db_data'] = current_service
+    except Exception as exp:
+        logger.error("[SnmpBooster] [code 0203] [%s, %s] Mapping error: "
+                     "%s" % (arguments.get('host'),
+                             arguments.get('service'),
+                             str(exp)))
+    finally:
+        # Release the check
+        check_result['execution_time'] = time.time() - check_result['start_time']
+        check_result['state'] = 'received'
+        mapping['done_queue'].put(check)
+
+
+def send_get_tasks(check_result, arguments, current_service, services,
+                   task_queue, result_queue, target_cache, db_client,
+                   group_sizes=None, preflight_requests=0):
+    """ Send grouped GET requests for the oids of all services
 
+    The name of each mapped instance is also requested, to find the
+    services whose mapping changed on the device (see callback_get).
+    The oids are grouped by the size learned for the host when
+    group_sizes is given, by the request_group_size of the service
+    otherwise.
+    When the poll needs at least preflight_requests requests, the first
+    GET request is sent alone: the others are only sent once the device
+    answers it
+    """
     # Prepare oids
     # TODO CHANGE all serv for current_service
     serv = current_service
+    group_size = serv.get('request_group_size', 64)
+    if group_sizes is not None:
+        group_size = group_sizes.get_group_size(arguments.get('address'),
+                                                group_size)
 
     fnc = partial(prepare_oids,
-                  group_size=serv.get('request_group_size', 64))
+                  group_size=group_size)
     splitted_oids_list = reduce(fnc, services, [{}, ])
 
+    # Put all oid in the same list
+    oids_list = {}
+    # Merge oids lists in one list
+    _ = [oids_list.update(oid_list) for oid_list in splitted_oids_list]
+
+    # Index of the oid list for the callbacks:
+    # * oids: results by oid tuple, to find the result of a varbind
+    #   without building its dotted oid
+    # * outstanding: number of results without value nor error
+    # * service_results: results of the checked service
+    # * mapping_checks: instance names to check by oid tuple
+    # * held_requests: (send function, oids) of the requests waiting for
+    #   the answer of the first one, see preflight_requests
+    oids_index = {'oids': {},
+                  'outstanding': 0,
+                  'service_results': [],
+                  'mapping_checks': {},
+                  'db_client': db_client,
+                  }
+    for oid, result in oids_list.items():
+        try:
+            oids_index['oids'][oid_to_tuple(oid)] = result
+        except ValueError:
+            logger.error("[SnmpBooster] [code 0204] [%s, %s] Bad oid: "
+                         "%s" % (result['key']['host'],
+                                 result['key']['service'],
+                                 oid))
+            del oids_list[oid]
+            continue
+        oids_index['outstanding'] += 1
+        if (result['key']['host'] == check_result['host'] and
+                result['key']['service'] == check_result['service']):
+            oids_index['service_results'].append(result)
+
+    # Oids collected by walking their table columns: {column_oid: [oid]}
+    table_columns = OrderedDict()
+    if arguments.get('version') != '1':
+        table_columns = prepare_table_columns(services, oids_list)
+    table_oids = set()
+    for oids in table_columns.values():
+        table_oids.update(oids)
+
+    var_names_list = [[str(oid[1:]) for oid in oids.keys()
+                       if oid in oids_list and oid not in table_oids]
+                      for oids in splitted_oids_list]
+    # Add the instance names to their mapping column or to the last groups
+    for oid, mapping_check in prepare_mapping_checks(services).items():
+        try:
+            oid_tuple = oid_to_tuple(oid)
+        except ValueError:
+            # Bad instance, its datasources are not requested either
+            continue
+        oids_index['mapping_checks'][oid_tuple] = mapping_check
+        oids_index['outstanding'] += 1
+        if oid_tuple in oids_index['oids']:
+            # A datasource of the instance name, already requested
+            continue
+        if table_columns and mapping_check['table_collect']:
+            table_columns.setdefault(mapping_check['mapping'].rstrip('.'),
+                                     []).append(oid)
+            continue
+        if len(var_names_list[-1]) >= group_size:
+            var_names_list.append([])
+        var_names_list[-1].append(str(oid[1:]))
+
+    columns = []
+    for column_oid, oids in table_columns.items():
+        oid_tuples = [oid_to_tuple(oid) for oid in oids]
+        columns.append({'name': column_oid,
+                        'oid': oid_to_tuple(column_oid),
+                        'length': len(oid_to_tuple(column_oid)),
+                        'last': max(oid_tuples),
+                        'oids': zip(oids, oid_tuples),
+                        'finished': False,
+                        })
+
+    auth_data, transport_target = target_cache.get_target(arguments.get('address'),
+                                                          arguments.get('port'),
+                                                          arguments.get('community'),
+                                                          arguments.get('version'),
+                                                          serv['timeout'],
+                                                          get_usm_user(arguments))
     # Prepare get task
-    for oids in splitted_oids_list:
-        get_task = {}
-        # Add community, address, port and oids
-        get_task['data'] = {"authData": cmdgen.CommunityData(arguments.get('community')),
-                            "transportTarget": cmdgen.UdpTransportTarget((arguments.get('address'),
-                                                                          arguments.get('port')),
-                                                                          timeout=serv['timeout'],
-                                                                          retries=0,
-                                                                          ),
-                            "varNames": [str(oid[1:]) for oid in oids.keys()],
-                            }
-        # Add snmp request type
-        get_task['type'] = 'get'
-        # Get concurrency
-        get_task['no_concurrency'] = arguments.get('no_concurrency', False)
-        # Add address
-        get_task['host'] = arguments.get('address')
-        # Put all oid in the same list
-        oids_list = {}
-        # Merge oids lists in one list
-        _ = [oids_list.update(oid_list) for oid_list in splitted_oids_list]
-        # Add Callback and callback args
-        get_task['data']['cbInfo'] = (callback_get,
-                                      (oids_list,
-                                       check.result,
-                                       result_queue))
-        task_queue.put(get_task, block=False)
-
-    # NOTE Is it useful ?
-    del services
+    get_task = {}
+    # Add community, address and port
+    get_task['data'] = {"authData": auth_data,
+                        "transportTarget": transport_target,
+                        }
+    # Add snmp request type
+    get_task['type'] = 'get'
+    # Number of oids of the full requests
+    get_task['group_size'] = group_size
+    # Get concurrency
+    get_task['no_concurrency'] = arguments.get('no_concurrency', False)
+    # Get timeout
+    get_task['timeout'] = serv['timeout']
+    # Get SNMP version
+    get_task['version'] = arguments.get('version')
+    # Add address
+    get_task['host'] = arguments.get('address')
+    # The oids of a failed request are sent again by callback_get
+    oids_index['send_get'] = partial(send_get_task, task_queue, get_task,
+                                     (oids_list,
+                                      check_result,
+                                      result_queue,
+                                      oids_index))
+    oids_index['timeout'] = serv['timeout']
+    oids_index['deadline'] = check_result['deadline']
+    # Requests of the poll, with the oids they collect
+    requests = [(partial(oids_index['send_get'], var_names, GET_RETRIES),
+                 var_names)
+                for var_names in var_names_list if var_names]
+
+    if columns:
+        # One GETBULK walk of all the columns
+        table_task = {}
+        table_task['data'] = {"authData": auth_data,
+                              "transportTarget": transport_target,
+                              "varNames": [str(column['name'][1:])
+                                           for column in columns],
+                              "nonRepeaters": 0,
+                              "maxRepetitions": serv.get('max_rep_table', 100),
+                              }
+        table_task['type'] = 'bulk'
+        table_task['no_concurrency'] = arguments.get('no_concurrency', False)
+        table_task['timeout'] = serv['timeout']
+        table_task['version'] = arguments.get('version')
+        table_task['host'] = arguments.get('address')
+        table_task['data']['cbInfo'] = (callback_table,
+                                        (oids_list,
+                                         check_result,
+                                         result_queue,
+                                         oids_index,
+                                         columns))
+        requests.append((partial(task_queue.put, table_task, block=False),
+                         [oid for column in columns
+                          for oid, _ in column['oids']]))
+
+    if preflight_requests and len(requests) >= preflight_requests:
+        # Released or failed by callback_get
+        oids_index['held_requests'] = requests[1:]
+        requests = requests[:1]
+    for send_request, _ in requests:
+        send_request()
+
+
+def send_get_task(task_queue, get_task, cb_args, var_names, retries):
+    """ Send a GET request of var_names, with the target of get_task
+
+    retries is the number of times the oids still missing after a
+    failure of this request can be requested again
+    """
+    task = dict(get_task)
+    task['data'] = dict(get_task['data'])
+    task['data']['varNames'] = var_names
+    # Add Callback and callback args
+    task['data']['cbInfo'] = (callback_get, cb_args + (var_names, retries))
+    task_queue.put(task, block=False)
+
+
+def prepare_table_columns(services, oids_list):
+    """ Return the table columns to walk for the services collected by
+    table (DSTEMPLATE option table_collect): {column_oid: [oid]}
+
+    Only the oids of oids_list which are an instance of their column
+    (oid ending with the instance) are collected by table, others are
+    requested by GET
+    """
+    columns = OrderedDict()
+    collected = set()
+    for service in services:
+        if not service.get('table_collect') or service.get('instance') is None:
+            continue
+        for ds_data in service['ds'].values():
+            for oid_type in ['ds_oid', 'ds_min_oid', 'ds_max_oid']:
+                oid_template = ds_data.get(oid_type)
+                if oid_template is None or not oid_template.endswith(INSTANCE_SUFFIX):
+                    continue
+                oid = oid_template % service
+                if oid not in oids_list or oid in collected:
+                    continue
+                collected.add(oid)
+                column_oid = oid_template[:-len(INSTANCE_SUFFIX)] % service
+                columns.setdefault(column_oid, []).append(oid)
+    return columns
+
+
+def prepare_mapping_checks(services):
+    """ Return the instance name oid of each mapped service:
+    {oid: {'host', 'mapping', 'names': {instance_name: [service]},
+    'checked', 'changed', 'table_collect'}}
+
+    Services of the same instance share their oid
+    """
+    mapping_checks = {}
+    for service in services:
+        if service.get('mapping') is None or service.get('instance') is None:
+            continue
+        oid = ".".join((service['mapping'].rstrip('.'),
+                        str(service['instance'])))
+        mapping_check = mapping_checks.setdefault(oid,
+                                                  {'host': service['host'],
+                                                   'mapping': service['mapping'],
+                                                   'names': {},
+                                                   'checked': False,
+                                                   'changed': [],
+                                                   'table_collect': False,
+                                                   })
+        mapping_check['names'].setdefault(service['instance_name'],
+                                          []).append(service['service'])
+        if service.get('table_collect'):
+            # The name is walked with the table of the service
+            mapping_check['table_collect'] = True
+    return mapping_checks
 
 
 def prepare_oids(ret, service, group_size=64):
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2012-2014:
+#    Thibault Cohen, thibault.cohen@savoirfairelinux.com
+#
+# This file is part of SNMP Booster Shinken Module.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with SNMP Booster Shinken Module.
+# If not, see <http://www.gnu.org/licenses/>.
+
+
+""" This module contains the cache of the parsed check command lines """
+
+
+import shlex
+from collections import OrderedDict
+
+from utils import parse_args
+
+
+class CommandCache(object):
+    """ Bounded LRU cache of the arguments parsed from check command lines
+
+    The same command lines come back at each check interval, so they are
+    split and parsed only once. Command lines which can not be parsed are
+    not cached: the parsing error is raised each time.
+    """
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self.commands = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.commands)
+
+    def get_args(self, command):
+        """ Return the arguments dict of a command line
+
+        The returned dict is a copy, the caller can modify it
+        """
+        args = self.commands.pop(command, None)
+        if args is None:
+            self.misses += 1
+            # shlex want str only
+            clean_command = shlex.split(command.encode('utf8', 'ignore'))
+            # we do not want the first member, check_snmp thing
+            args = parse_args(clean_command[1:])
+        else:
+            self.hits += 1
+        # Most recently used command lines are at the end
+        self.commands[command] = args
+        while len(self.commands) > self.max_size:
+            # Forget the least recently used command line
+            self.commands.popitem(last=False)
+        return args.copy()
+
+    def get_stats(self):
+        """ Return cache statistics """
+        return {'size': len(self.commands),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                }
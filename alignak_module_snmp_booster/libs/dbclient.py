@@ -117,6 +117,39 @@ class DBClient(object):
 
         return (None, self.handle_error(mongo_res, mongo_filter))
 
+    def update_services(self, services):
+        """ This function updates/inserts several services at once
+        It is used by Poller to put the data collected by a request
+        in the database
+        services is a dict: {(host, service): data}
+        All services are written in one bulk operation
+
+        Return
+        * query_result: None
+        * error: bool
+        """
+        if not services:
+            return (None, False)
+        bulk = getattr(self.db_conn,
+                       self.db_name).services.initialize_unordered_bulk_op()
+        for (host, service), data in services.items():
+            # Prepare mongo Filter
+            mongo_filter = {"host": host,
+                            "service": service}
+            # Flatten dict serv
+            bulk.find(mongo_filter).upsert().update({"$set": flatten_dict(data)})
+        # Save in mongo
+        try:
+            bulk.execute()
+        except Exception as exp:
+            logger.error("[SnmpBooster] [code 1209] [%s] "
+                         "%s" % (", ".join([":".join(key)
+                                            for key in services]),
+                                 str(exp)))
+            return (None, True)
+
+        return (None, False)
+
     def update_service_instance(self, host, instance_name, instance):
         """ This function update a instance from SNMP mapping requests
         Return
@@ -186,3 +219,136 @@ class DBClient(object):
             return None
 
         return [s for s in services]
+
+    def get_mapping(self, host, mapping):
+        """ This function gets the mapping cache of a host for a mapping
+        table, shared by all its services
+        Return
+        :query_result: dict {'instances': {instance_name: instance},
+                             'uptime': int, 'last_change': int,
+                             'check_time': float} or None
+        """
+        # Prepare mongo Filter
+        mongo_filter = {"host": host,
+                        "mapping": mapping}
+        # Get mapping
+        try:
+            data = getattr(self.db_conn,
+                           self.db_name).mappings.find_one(mongo_filter,
+                                                           {"_id": False})
+        except Exception as exp:
+            logger.error("[SnmpBooster] [code 1210] [%s, %s] "
+                         "%s" % (host,
+                                 mapping,
+                                 str(exp)))
+            return None
+
+        if data is None:
+            return None
+        # Instance names can contain dots, they are saved as a list
+        data['instances'] = dict(data['instances'])
+        return data
+
+    def update_mapping(self, host, mapping, data):
+        """ This function replaces the mapping cache of a host for a
+        mapping table
+        Return
+        * query_result: None
+        * error: bool
+        """
+        # Prepare mongo Filter
+        mongo_filter = {"host": host,
+                        "mapping": mapping}
+        data = dict(data)
+        data['instances'] = data['instances'].items()
+        data.update(mongo_filter)
+        # Save in mongo
+        try:
+            mongo_res = getattr(self.db_conn,
+                                self.db_name).mappings.update(mongo_filter,
+                                                              data,
+                                                              upsert=True)
+        except Exception as exp:
+            logger.error("[SnmpBooster] [code 1211] [%s, %s] "
+                         "%s" % (host,
+                                 mapping,
+                                 str(exp)))
+            return (None, True)
+
+        return (None, self.handle_error(mongo_res, mongo_filter))
+
+    def get_group_sizes(self):
+        """ This function gets the learned number of oids of the GET
+        requests of each host
+        Return
+        :query_result: dict {host: {'size': int, 'ceiling': int}}
+        """
+        try:
+            data = getattr(self.db_conn,
+                           self.db_name).group_sizes.find({}, {"_id": False})
+            return dict([(entry.pop('host'), entry) for entry in data])
+        except Exception as exp:
+            logger.error("[SnmpBooster] [code 1212] %s" % str(exp))
+            return {}
+
+    def update_group_sizes(self, sizes):
+        """ This function saves the learned number of oids of the GET
+        requests of each host
+        Return
+        * query_result: None
+        * error: bool
+        """
+        error = False
+        for host, size in sizes.items():
+            mongo_filter = {"host": host}
+            data = dict(size)
+            data.update(mongo_filter)
+            try:
+                mongo_res = getattr(self.db_conn,
+                                    self.db_name).group_sizes.update(mongo_filter,
+                                                                     data,
+                                                                     upsert=True)
+            except Exception as exp:
+                logger.error("[SnmpBooster] [code 1213] [%s] "
+                             "%s" % (host, str(exp)))
+                return (None, True)
+            error = self.handle_error(mongo_res, mongo_filter) or error
+
+        return (None, error)
+
+    def get_host_breakers(self):
+        """ This function gets the circuit breakers of the hosts
+        Return
+        :query_result: dict {host: {'state': str, 'timeouts': int, ...}}
+        """
+        try:
+            data = getattr(self.db_conn,
+                           self.db_name).breakers.find({}, {"_id": False})
+            return dict([(entry.pop('host'), entry) for entry in data])
+        except Exception as exp:
+            logger.error("[SnmpBooster] [code 1214] %s" % str(exp))
+            return {}
+
+    def update_host_breakers(self, breakers):
+        """ This function saves the circuit breakers of the hosts
+        Return
+        * query_result: None
+        * error: bool
+        """
+        error = False
+        for host, breaker in breakers.items():
+            mongo_filter = {"host": host}
+            data = dict(breaker)
+            data.update(mongo_filter)
+            try:
+                mongo_res = getattr(self.db_conn,
+                                    self.db_name).breakers.update(mongo_filter,
+                                                                  data,
+                                                                  upsert=True)
+            except Exception as exp:
+                logger.error("[SnmpBooster] [code 1215] [%s] "
+                             "%s" % (host, str(exp)))
+                return (None, True)
+            error = self.handle_error(mongo_res, mongo_filter) or error
+
+        return (None, error)
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2012-2014:
+#    Thibault Cohen, thibault.cohen@savoirfairelinux.com
+#
+# This file is part of SNMP Booster Shinken Module.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with SNMP Booster Shinken Module.
+# If not, see <http://www.gnu.org/licenses/>.
+
+
+""" This module contains the adaptive number of oids of the GET requests
+of each host
+"""
+
+import time
+
+
+# Bounds of the learned number of oids of a GET request
+GROUP_SIZE_MIN = 4
+GROUP_SIZE_MAX = 200
+# Oids added after a request answered quickly with a full group
+GROUP_SIZE_STEP = 4
+# A response slower than this part of the request timeout is too slow:
+# the group is too big for the device
+SLOW_RESPONSE_RATIO = 0.3
+# Size factor applied on slow responses
+DECREASE_FACTOR = 0.75
+# Delay (in seconds) after which larger requests are tried again
+CEILING_TIMEOUT = 86400
+
+
+class GroupSizes(object):
+    """ Number of oids of the GET requests (request_group_size) learned
+    for each host from the outcome of its requests:
+
+    * a tooBig response sets the size to half the oids of the request
+    * a timeout while the host answers other requests sent after it (the
+      device drops large requests) does the same
+    * a slow response decreases it by DECREASE_FACTOR
+    * a full request answered quickly increases it by GROUP_SIZE_STEP,
+      up to the size of the requests which were too big (for
+      CEILING_TIMEOUT)
+
+    The size given by the check command is used until the host is known.
+    The sizes are shared by the poller and its SNMP workers, and saved
+    in the database.
+    """
+    def __init__(self):
+        # {host: {'size': int, 'ceiling': int, 'ceiling_time': time,
+        #         'last_answer': time}}
+        self.hosts = {}
+        # Hosts whose size or ceiling changed since the last save
+        self.changed = set()
+
+    def get_group_size(self, host, default):
+        """ Return the number of oids of a GET request for host """
+        state = self.hosts.get(host)
+        if state is None:
+            return default
+        return state['size']
+
+    def request_done(self, host, nb_oids, group_size, sent_time,
+                     response_time, timeout, failed, too_big):
+        """ Adapt the size of host to the outcome of a GET request of
+        nb_oids oids, built with groups of group_size oids
+        """
+        state = self.hosts.get(host)
+        # Size and ceiling before this request, None for a new host
+        previous = None
+        if state is None:
+            state = {'size': max(GROUP_SIZE_MIN, min(GROUP_SIZE_MAX, group_size)),
+                     'ceiling': GROUP_SIZE_MAX,
+                     'ceiling_time': 0,
+                     'last_answer': 0,
+                     }
+            self.hosts[host] = state
+        else:
+            previous = (state['size'], state['ceiling'])
+            if sent_time > state['ceiling_time'] + CEILING_TIMEOUT:
+                state['ceiling'] = GROUP_SIZE_MAX
+        size = state['size']
+        if too_big or (failed and state['last_answer'] > sent_time):
+            # The request is too big for the device (for a timeout: the
+            # host answered a request sent after this one)
+            state['ceiling'] = min(state['ceiling'], nb_oids - 1)
+            state['ceiling_time'] = sent_time
+            size = min(size, nb_oids // 2)
+        elif failed:
+            # The host does not answer
+            pass
+        elif response_time > timeout * SLOW_RESPONSE_RATIO:
+            size = min(size, int(nb_oids * DECREASE_FACTOR))
+        elif nb_oids >= size:
+            size += GROUP_SIZE_STEP
+        if not failed:
+            state['last_answer'] = sent_time + response_time
+        size = max(GROUP_SIZE_MIN, min(state['ceiling'], size))
+        if (size, state['ceiling']) != previous:
+            self.changed.add(host)
+        state['size'] = size
+
+    def get_sizes(self):
+        """ Return the learned size and ceiling of each host:
+        {host: {'size': int, 'ceiling': int}}
+        """
+        return dict([(host, {'size': state['size'],
+                             'ceiling': state['ceiling']})
+                     for host, state in self.hosts.items()])
+
+    def pop_changed_sizes(self):
+        """ Return the learned size and ceiling of the hosts changed since
+        the previous call, like get_sizes
+        """
+        sizes = {}
+        for host in list(self.changed):
+            # Discarded first: a host changed again by a worker is saved
+            # again next time
+            self.changed.discard(host)
+            state = self.hosts.get(host)
+            if state is not None:
+                sizes[host] = {'size': state['size'],
+                               'ceiling': state['ceiling']}
+        return sizes
+
+    def set_sizes(self, sizes):
+        """ Set the learned sizes and ceilings, saved in the database """
+        now = time.time()
+        for host, saved in sizes.items():
+            ceiling = max(GROUP_SIZE_MIN, min(GROUP_SIZE_MAX,
+                                              int(saved['ceiling'])))
+            self.hosts[host] = {'size': max(GROUP_SIZE_MIN,
+                                            min(ceiling, int(saved['size']))),
+                                'ceiling': ceiling,
+                                'ceiling_time': now,
+                                'last_answer': 0,
+                                }
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2012-2014:
+#    Thibault Cohen, thibault.cohen@savoirfairelinux.com
+#
+# This file is part of SNMP Booster Shinken Module.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with SNMP Booster Shinken Module.
+# If not, see <http://www.gnu.org/licenses/>.
+
+
+""" This module contains the circuit breakers of the hosts which do not
+answer to SNMP requests
+"""
+
+import time
+from threading import Lock
+import logging
+
+logger = logging.getLogger(__name__)  # pylint: disable=C0103
+
+
+# Delay (as a number of request timeouts) after which a probe without
+# answer is considered as lost
+PROBE_TIMEOUT_FACTOR = 2
+
+
+class HostBreakers(object):
+    """ Circuit breaker of each host
+
+    After max_timeouts requests without answer in a row, the breaker of
+    the host opens: its real checks only send one probe request and give
+    the cached results. The first answered request closes it.
+    The breakers are updated by the SNMP workers and read by the poller
+    main loop
+    """
+    def __init__(self, max_timeouts):
+        self.max_timeouts = max_timeouts
+        # {host: {'state': 'closed' or 'open', 'timeouts': int,
+        #         'trips': int, 'probes': int, 'skipped': int,
+        #         'opened': time, 'probe_time': time}}
+        self.hosts = {}
+        # Hosts whose breaker changed since the last save
+        self.changed = set()
+        self.lock = Lock()
+
+    def get_state(self, host):
+        """ Return the breaker of host, created closed. The lock must be
+        held
+        """
+        state = self.hosts.get(host)
+        if state is None:
+            state = {'state': 'closed',
+                     'timeouts': 0,
+                     'trips': 0,
+                     'probes': 0,
+                     'skipped': 0,
+                     'opened': None,
+                     'probe_time': 0,
+                     }
+            self.hosts[host] = state
+        return state
+
+    def is_open(self, host):
+        """ Return True if the SNMP polling of host is suspended """
+        state = self.hosts.get(host)
+        return state is not None and state['state'] == 'open'
+
+    def request_done(self, host, failed):
+        """ Count the requests of host without answer in a row, and open
+        or close its breaker
+        """
+        with self.lock:
+            state = self.get_state(host)
+            if not failed:
+                if state['timeouts'] == 0 and state['state'] == 'closed':
+                    # Nothing new
+                    return
+                self.changed.add(host)
+                state['timeouts'] = 0
+                state['probe_time'] = 0
+                if state['state'] == 'open':
+                    state['state'] = 'closed'
+                    logger.info("[SnmpBooster] [code 1801] [%s] Host answers "
+                                "again, SNMP polling resumed" % host)
+                return
+            self.changed.add(host)
+            state['timeouts'] += 1
+            if state['state'] == 'closed' and state['timeouts'] >= self.max_timeouts:
+                state['state'] = 'open'
+                state['trips'] += 1
+                state['opened'] = time.time()
+                logger.warning("[SnmpBooster] [code 1802] [%s] %d SNMP requests "
+                               "without answer, SNMP polling suspended until "
+                               "the host answers" % (host, state['timeouts']))
+
+    def start_probe(self, host, timeout):
+        """ Count a real check of host not polled because its breaker is
+        open, and return True if it must send a probe: only one probe is
+        in flight at the same time
+        """
+        with self.lock:
+            state = self.get_state(host)
+            self.changed.add(host)
+            state['skipped'] += 1
+            now = time.time()
+            if now < state['probe_time'] + timeout * PROBE_TIMEOUT_FACTOR:
+                return False
+            state['probe_time'] = now
+            state['probes'] += 1
+            return True
+
+    def get_states(self):
+        """ Return the breaker of each host, for the database """
+        with self.lock:
+            return dict([(host, dict(state))
+                         for host, state in self.hosts.items()])
+
+    def pop_changed_states(self):
+        """ Return the breaker of the hosts changed since the previous
+        call, for the database
+        """
+        with self.lock:
+            states = dict([(host, dict(self.hosts[host]))
+                           for host in self.changed])
+            self.changed = set()
+            return states
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2012-2014:
+#    Thibault Cohen, thibault.cohen@savoirfairelinux.com
+#
+# This file is part of SNMP Booster Shinken Module.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with SNMP Booster Shinken Module.
+# If not, see <http://www.gnu.org/licenses/>.
+
+
+""" This module contains the adaptive limits of SNMP requests in flight
+for each host
+"""
+
+
+import time
+
+
+# Max requests in flight for a host, unless the initial limit is higher
+HOST_MAX_LIMIT = 32
+# A response slower than this part of the request timeout is handled
+# like a timeout: the host is overloaded
+SLOW_RESPONSE_RATIO = 0.5
+# Limit factor applied on timeouts and slow responses
+DECREASE_FACTOR = 0.5
+# Weight of the last response time in the host response time
+RESPONSE_TIME_WEIGHT = 0.2
+
+
+class HostLimits(object):
+    """ Limits of SNMP requests in flight for each host, adapted with AIMD
+    (additive increase, multiplicative decrease):
+
+    * each request answered in time increases the limit of its host by
+      1/limit, so about one more request for each limit answers
+    * a timeout or a slow response divides it by 2, at most once for all
+      the requests sent before the previous decrease
+
+    Hosts with the no_concurrency flag are always limited to 1 request.
+    """
+    def __init__(self, initial_limit):
+        # Requests in flight allowed for a host we know nothing about yet
+        self.initial_limit = max(1, initial_limit)
+        self.max_limit = max(HOST_MAX_LIMIT, self.initial_limit)
+        # {host: {'limit': float, 'response_time': float,
+        #          'last_decrease': time, 'last_use': time}}
+        self.hosts = {}
+
+    def get_limit(self, host, no_concurrency=False):
+        """ Return the number of requests host can have in flight """
+        if no_concurrency:
+            return 1
+        state = self.hosts.get(host)
+        if state is None:
+            return self.initial_limit
+        return int(state['limit'])
+
+    def request_done(self, host, sent_time, timeout, failed):
+        """ Adapt the limit of host to the outcome of a request """
+        now = time.time()
+        response_time = now - sent_time
+        state = self.hosts.get(host)
+        if state is None:
+            state = {'limit': float(self.initial_limit),
+                     'response_time': response_time,
+                     'last_decrease': 0,
+                     }
+            self.hosts[host] = state
+        state['last_use'] = now
+        if failed or response_time > timeout * SLOW_RESPONSE_RATIO:
+            # Requests sent before the previous decrease saw the
+            # same overload
+            if sent_time > state['last_decrease']:
+                state['limit'] = max(1.0, state['limit'] * DECREASE_FACTOR)
+                state['last_decrease'] = now
+        else:
+            state['limit'] = min(float(self.max_limit),
+                                 state['limit'] + 1.0 / state['limit'])
+        if not failed:
+            state['response_time'] = ((1 - RESPONSE_TIME_WEIGHT) * state['response_time'] +
+                                      RESPONSE_TIME_WEIGHT * response_time)
+
+    def forget_idle_hosts(self, before):
+        """ Forget the limits of the hosts without request since before """
+        for host, state in self.hosts.items():
+            if state['last_use'] < before:
+                del self.hosts[host]
+
+    def get_limits(self):
+        """ Return the learned limit and response time (in seconds)
+        of each host
+        """
+        return dict([(host, {'limit': int(state['limit']),
+                             'response_time': state['response_time'],
+                             })
+                     for host, state in self.hosts.items()])
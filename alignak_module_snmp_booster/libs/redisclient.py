@@ -39,6 +39,14 @@ except ImportError as exp:
 from utils import merge_dicts
 
 
+# Internal keys (mapping caches, group sizes) start with a character which
+# can not be in a host name, so they are not taken for services
+INTERNAL_KEY_PREFIX = "~"
+MAPPING_KEY_PREFIX = INTERNAL_KEY_PREFIX + "mapping"
+GROUP_SIZES_KEY = INTERNAL_KEY_PREFIX + "group_sizes"
+HOST_BREAKERS_KEY = INTERNAL_KEY_PREFIX + "breakers"
+
+
 class DBClient(object):
     """ Class used to abstract the use of the database/cache """
 
@@ -70,6 +78,15 @@ class DBClient(object):
         """
         return ":".join((str(part1), str(part2)))
 
+    @staticmethod
+    def build_mapping_key(host, mapping):
+        """ Build Redis key of a mapping cache
+
+        >>> build_mapping_key("host", ".1.3.6.1.2.1.2.2.1.2")
+        '~mapping:host:.1.3.6.1.2.1.2.2.1.2'
+        """
+        return ":".join((MAPPING_KEY_PREFIX, str(host), str(mapping)))
+
     def update_service_init(self, host, service, data):
         """ Insert/Update/Upsert service information in Redis by Arbiter """
         # We need to generate key for redis :
@@ -125,6 +142,42 @@ class DBClient(object):
 
         return (None, False)
 
+    def update_services(self, services):
+        """ This function updates/inserts several services at once
+        It is used by Poller to put the data collected by a request
+        in the database
+        services is a dict: {(host, service): data}
+        Like in update_service, data are merged with the data in the
+        database, but all services are read in one round trip and
+        written in one pipeline
+
+        Return
+        * query_result: None
+        * error: bool
+        """
+        if not services:
+            return (None, False)
+        services = services.items()
+        keys = [self.build_key(host, service)
+                for (host, service), _ in services]
+        try:
+            old_dicts = self.db_conn.mget(keys)
+            pipe = self.db_conn.pipeline(transaction=False)
+            for key, old_dict, (_, data) in zip(keys, old_dicts, services):
+                if old_dict is not None:
+                    old_dict = eval(old_dict)
+                # Merge old data and new data
+                data = merge_dicts(old_dict, data)
+                pipe.set(key, data)
+            pipe.execute()
+        except Exception as exp:
+            logger.error("[SnmpBooster] [code 1309] [%s] "
+                         "%s" % (", ".join(keys),
+                                 str(exp)))
+            return (None, True)
+
+        return (None, False)
+
     def get_service(self, host, service):
         """ This function gets one service from the database
 
@@ -183,6 +236,134 @@ class DBClient(object):
                                      str(exp)))
         return dict_list
 
+    def get_mapping(self, host, mapping):
+        """ This function gets the mapping cache of a host for a mapping
+        table, shared by all its services
+
+        Return
+        :query_result: dict {'instances': {instance_name: instance},
+                             'uptime': int, 'last_change': int,
+                             'check_time': float} or None
+        """
+        key = self.build_mapping_key(host, mapping)
+        try:
+            data = self.db_conn.get(key)
+        except Exception as exp:
+            logger.error("[SnmpBooster] [code 1310] [%s, %s] "
+                         "%s" % (host,
+                                 mapping,
+                                 str(exp)))
+            return None
+        return eval(data) if data is not None else None
+
+    def update_mapping(self, host, mapping, data):
+        """ This function replaces the mapping cache of a host for a
+        mapping table
+
+        Return
+        * query_result: None
+        * error: bool
+        """
+        key = self.build_mapping_key(host, mapping)
+        try:
+            self.db_conn.set(key, data)
+        except Exception as exp:
+            logger.error("[SnmpBooster] [code 1311] [%s, %s] "
+                         "%s" % (host,
+                                 mapping,
+                                 str(exp)))
+            return (None, True)
+
+        return (None, False)
+
+    def delete_mapping(self, host, mapping):
+        """ This function deletes the mapping cache of a host for a
+        mapping table
+
+        Return
+        * nb_del: number of keys deleted
+        """
+        key = self.build_mapping_key(host, mapping)
+        try:
+            return self.db_conn.delete(key)
+        except Exception as exp:
+            logger.error("[SnmpBooster] [code 1316] [%s, %s] "
+                         "%s" % (host,
+                                 mapping,
+                                 str(exp)))
+            return 0
+
+    def get_group_sizes(self):
+        """ This function gets the learned number of oids of the GET
+        requests of each host
+
+        Return
+        :query_result: dict {host: {'size': int, 'ceiling': int}}
+        """
+        try:
+            data = self.db_conn.hgetall(GROUP_SIZES_KEY)
+        except Exception as exp:
+            logger.error("[SnmpBooster] [code 1312] %s" % str(exp))
+            return {}
+        return dict([(host, eval(size)) for host, size in data.items()])
+
+    def update_group_sizes(self, sizes):
+        """ This function saves the learned number of oids of the GET
+        requests of the hosts of sizes, one hash field by host: the sizes
+        saved by the other pollers are kept
+
+        Return
+        * query_result: None
+        * error: bool
+        """
+        if not sizes:
+            return (None, False)
+        try:
+            pipe = self.db_conn.pipeline(transaction=False)
+            for host, size in sizes.items():
+                pipe.hset(GROUP_SIZES_KEY, host, size)
+            pipe.execute()
+        except Exception as exp:
+            logger.error("[SnmpBooster] [code 1313] %s" % str(exp))
+            return (None, True)
+
+        return (None, False)
+
+    def get_host_breakers(self):
+        """ This function gets the circuit breakers of the hosts
+
+        Return
+        :query_result: dict {host: {'state': str, 'timeouts': int, ...}}
+        """
+        try:
+            data = self.db_conn.hgetall(HOST_BREAKERS_KEY)
+        except Exception as exp:
+            logger.error("[SnmpBooster] [code 1314] %s" % str(exp))
+            return {}
+        return dict([(host, eval(breaker)) for host, breaker in data.items()])
+
+    def update_host_breakers(self, breakers):
+        """ This function saves the circuit breakers of the hosts of
+        breakers, one hash field by host: the breakers saved by the other
+        pollers are kept
+
+        Return
+        * query_result: None
+        * error: bool
+        """
+        if not breakers:
+            return (None, False)
+        try:
+            pipe = self.db_conn.pipeline(transaction=False)
+            for host, breaker in breakers.items():
+                pipe.hset(HOST_BREAKERS_KEY, host, breaker)
+            pipe.execute()
+        except Exception as exp:
+            logger.error("[SnmpBooster] [code 1315] %s" % str(exp))
+            return (None, True)
+
+        return (None, False)
+
     def show_keys(self):
         """ Get all database keys """
         return self.db_conn.keys()
@@ -191,6 +372,9 @@ class DBClient(object):
         """ List hosts with a service which match with the pattern """
         results = []
         for key in self.db_conn.keys():
+            if key.startswith(INTERNAL_KEY_PREFIX):
+                # we skip mapping caches, group sizes and breakers
+                continue
             if re.search(":.*"+service, key) is None:
                 # Look for service
                 continue
@@ -208,6 +392,9 @@ class DBClient(object):
             if re.search(":[0-9]+$", key) is not None:
                 # we skip host:interval
                 continue
+            if key.startswith(INTERNAL_KEY_PREFIX):
+                # we skip mapping caches, group sizes and breakers
+                continue
             results.append(eval(self.db_conn.get(key)))
 
         return results
@@ -220,6 +407,9 @@ class DBClient(object):
         """ List all services """
         results = []
         for key in self.db_conn.keys():
+            if key.startswith(INTERNAL_KEY_PREFIX):
+                # we skip mapping caches, group sizes and breakers
+                continue
             if re.search(":[0-9]*$", key) is None:
                 host, service = key.split(":", 1)
                 results.append(self.get_service(host, service))
@@ -247,7 +437,7 @@ class DBClient(object):
         return nb_del
 
     def delete_host(self, host):
-        """ Delete all services in the specified host """
+        """ Delete all services and mapping caches in the specified host """
         to_del = []
         for key in self.db_conn.keys():
             if re.search(host+":", key) is not None:
@@ -45,6 +45,11 @@ def set_output_and_status(check_result):
         output = "No Data found in cache"
         exit_code = 3
 
+    # Check if the host was not polled
+    elif check_result.get('error') is not None:
+        output = check_result['error']
+        exit_code = 3
+
     # Check if all oids in the current service have an error
     elif all([ds_data.get('error')
               for ds_data in check_result['db_data']['ds'].values()]):
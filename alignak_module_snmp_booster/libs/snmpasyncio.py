@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2012-2014:
+#    Thibault Cohen, thibault.cohen@savoirfairelinux.com
+#
+# This file is part of SNMP Booster Shinken Module.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with SNMP Booster Shinken Module.
+# If not, see <http://www.gnu.org/licenses/>.
+
+
+""" This module contains an SNMP worker based on the asyncio API of pysnmp:
+each SNMP task runs as a coroutine
+
+"""
+
+import socket
+import logging
+
+logger = logging.getLogger(__name__)  # pylint: disable=C0103
+
+try:
+    import trollius as asyncio
+    from trollius import From
+except ImportError as exp:
+    logger.error("[SnmpBooster] [code 1501] Import error. Trollius is "
+                 "missing, the asyncio SNMP backend is not available")
+    raise ImportError(exp)
+
+try:
+    from pysnmp.hlapi.asyncio import (SnmpEngine, ContextData,
+                                      UdpTransportTarget,
+                                      getCmd, nextCmd, bulkCmd)
+    from pysnmp.entity.rfc3413.cmdgen import getNextVarBinds
+    from pysnmp.proto.rfc1902 import Null
+except ImportError as exp:
+    logger.error("[SnmpBooster] [code 1502] Import error. Pysnmp is missing")
+    raise ImportError(exp)
+
+from snmpworker import SNMPWorker, DISPATCHER_TICK, REQUEST_TIMEOUT_MARGIN
+
+
+class AsyncioSNMPWorker(SNMPWorker):
+    """ SNMP worker running its requests as asyncio coroutines
+
+    Tasks, callbacks, limits and queues are the same as the SNMPWorker
+    ones. Each task runs in a coroutine which sends the request, waits
+    for its answer with its own deadline, calls the task callback and,
+    for a walk, sends the next request while the callback asks for it.
+    """
+    def __init__(self, mapping_queue, max_inflight_tasks):
+        SNMPWorker.__init__(self, mapping_queue, max_inflight_tasks)
+        self.loop = None
+        # Set by the coroutines when a request is finished
+        self.request_done = None
+        # asyncio transport of each target {(address, timeout, retries): target}
+        self.transport_targets = {}
+        self.context_data = ContextData()
+
+    def create_engine(self):
+        """ Create the event loop and the SNMP engine of the worker """
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.request_done = asyncio.Event(loop=self.loop)
+        return SnmpEngine()
+
+    def get_transport_target(self, transport_target):
+        """ Return the asyncio transport of a target
+
+        The address of the target given by the checks is already resolved
+        """
+        key = (transport_target.transportAddr,
+               transport_target.timeout,
+               transport_target.retries)
+        target = self.transport_targets.get(key)
+        if target is None:
+            target = UdpTransportTarget(transport_target.transportAddr,
+                                        timeout=transport_target.timeout,
+                                        retries=transport_target.retries)
+            self.transport_targets[key] = target
+        return target
+
+    def send_request(self, snmp_task):
+        """ Start the coroutine of a task """
+        self.loop.create_task(self.run_task(snmp_task))
+
+    @asyncio.coroutine
+    def run_task(self, snmp_task):
+        """ Send the requests of a task and give their answers to its
+        callback
+        """
+        data = snmp_task['data']
+        cb_fun, cb_ctx = data['cbInfo']
+        transport_target = self.get_transport_target(data['transportTarget'])
+        var_binds = [(oid, Null('')) for oid in data['varNames']]
+        timeout = data['transportTarget'].timeout + REQUEST_TIMEOUT_MARGIN
+        while True:
+            if snmp_task['type'] == 'get':
+                request = getCmd(self.snmp_engine, data['authData'],
+                                 transport_target, self.context_data,
+                                 *var_binds, lookupMib=False)
+            elif snmp_task['type'] == 'next':
+                request = nextCmd(self.snmp_engine, data['authData'],
+                                  transport_target, self.context_data,
+                                  *var_binds, lookupMib=False)
+            else:
+                request = bulkCmd(self.snmp_engine, data['authData'],
+                                  transport_target, self.context_data,
+                                  data['nonRepeaters'], data['maxRepetitions'],
+                                  *var_binds, lookupMib=False)
+            try:
+                response = yield From(asyncio.wait_for(request, timeout,
+                                                       loop=self.loop))
+            except asyncio.TimeoutError:
+                response = ("No SNMP response received before timeout",
+                            0, 0, [])
+            except socket.error as exp:
+                response = ("Can not send SNMP request: %s" % str(exp),
+                            0, 0, [])
+            except Exception as exp:
+                response = (str(exp), 0, 0, [])
+            error_indication, error_status, error_index, var_bind_table = response
+            walk_again = cb_fun(None, error_indication, error_status,
+                                error_index, var_bind_table, cb_ctx)
+            self.request_done.set()
+            if (not walk_again or snmp_task['type'] == 'get' or
+                    error_indication or not var_bind_table):
+                break
+            # The walk goes on from the last received oids
+            error_indication, var_binds = getNextVarBinds(var_bind_table[-1])
+            if error_indication or not var_binds:
+                # End of the walk
+                break
+        task_id = cb_ctx[0]
+        if task_id in self.inflight_tasks:
+            # The walk ended while the callback still wanted more
+            self.release_task(task_id)
+
+    def run_dispatcher_once(self):
+        """ Run the coroutines until a request is finished, for at most
+        DISPATCHER_TICK
+        """
+        try:
+            self.loop.run_until_complete(asyncio.wait_for(self.request_done.wait(),
+                                                          DISPATCHER_TICK,
+                                                          loop=self.loop))
+        except asyncio.TimeoutError:
+            pass
+        self.request_done.clear()
+
+    def reclaim_idle_targets(self):
+        """ Also forget the asyncio transports of the idle targets """
+        SNMPWorker.reclaim_idle_targets(self)
+        for key in self.transport_targets.keys():
+            if key[0] not in self.targets_last_use:
+                del self.transport_targets[key]
+
+    def real_run(self):
+        """ Process SNMP tasks in the event loop of the worker """
+        try:
+            SNMPWorker.real_run(self)
+        finally:
+            if self.loop is not None:
+                self.loop.close()
@@ -0,0 +1,500 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2012-2014:
+#    Thibault Cohen, thibault.cohen@savoirfairelinux.com
+#
+# This file is part of SNMP Booster Shinken Module.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with SNMP Booster Shinken Module.
+# If not, see <http://www.gnu.org/licenses/>.
+
+
+""" This module contains a minimal BER encoder and decoder of the SNMP v2c
+and v3 messages used by SNMP Booster: GET, GETNEXT and GETBULK requests and
+their responses
+
+"""
+
+from binascii import hexlify
+from struct import pack
+import logging
+
+logger = logging.getLogger(__name__)  # pylint: disable=C0103
+
+try:
+    from pysnmp.smi.exval import noSuchObject, noSuchInstance, endOfMibView
+    from pysnmp.proto.rfc1902 import Null
+except ImportError as exp:
+    logger.error("[SnmpBooster] [code 1601] Import error. Pysnmp is missing")
+    raise ImportError(exp)
+
+
+# SNMP message versions
+VERSION_2C = 1
+VERSION_3 = 3
+# Request ids of this range are always encoded on 4 octets, so they can
+# be patched in a request template
+REQUEST_ID_MIN = 0x800000
+REQUEST_ID_MAX = 0x7fffffff
+
+# PDU tags
+GET_REQUEST = 0xa0
+GETNEXT_REQUEST = 0xa1
+RESPONSE = 0xa2
+GETBULK_REQUEST = 0xa5
+REPORT = 0xa8
+
+# Value tags
+INTEGER = 0x02
+OCTET_STRING = 0x04
+NULL = 0x05
+OBJECT_IDENTIFIER = 0x06
+SEQUENCE = 0x30
+IP_ADDRESS = 0x40
+COUNTER32 = 0x41
+GAUGE32 = 0x42
+TIMETICKS = 0x43
+OPAQUE = 0x44
+COUNTER64 = 0x46
+NO_SUCH_OBJECT = 0x80
+NO_SUCH_INSTANCE = 0x81
+END_OF_MIB_VIEW = 0x82
+
+UNSIGNED_TAGS = frozenset([COUNTER32, GAUGE32, TIMETICKS, COUNTER64])
+# Values without content, the same pysnmp objects are used so the
+# callbacks can compare them
+EXCEPTION_VALUES = {NULL: Null(''),
+                    NO_SUCH_OBJECT: noSuchObject,
+                    NO_SUCH_INSTANCE: noSuchInstance,
+                    END_OF_MIB_VIEW: endOfMibView,
+                    }
+NULL_VALUE = '\x05\x00'
+
+# SNMP v3 message flags
+FLAG_AUTH = 0x01
+FLAG_PRIV = 0x02
+FLAG_REPORTABLE = 0x04
+# User-based Security Model
+USM_SECURITY_MODEL = 3
+# Max size of the responses, sent in the v3 requests
+V3_MAX_MESSAGE_SIZE = 65507
+# Size of the authentication parameters of HMAC-MD5-96 and HMAC-SHA-96
+AUTH_PARAMETERS_SIZE = 12
+
+
+class SNMPCodecError(ValueError):
+    """ Raised when a message can not be decoded """
+    pass
+
+
+class ObjectName(tuple):
+    """ OID of a decoded variable binding, as the tuple of its arcs
+
+    asTuple() and prettyPrint() return the OID like the pysnmp ObjectName
+    does, so the callbacks handle both
+    """
+    __slots__ = ()
+
+    def asTuple(self):  # pylint: disable=C0103
+        """ Return the tuple of arcs """
+        return self
+
+    def prettyPrint(self):  # pylint: disable=C0103
+        """ Return the dotted OID, without leading dot """
+        return '.'.join([str(arc) for arc in self])
+
+    __str__ = prettyPrint
+
+
+def encode_length(length):
+    """ Return the BER encoded length """
+    if length < 0x80:
+        return chr(length)
+    octets = ''
+    while length:
+        octets = chr(length & 0xff) + octets
+        length >>= 8
+    return chr(0x80 | len(octets)) + octets
+
+
+def encode_tlv(tag, value):
+    """ Return the BER encoded tag, length and value """
+    return chr(tag) + encode_length(len(value)) + value
+
+
+def encode_integer(value):
+    """ Return the BER encoded INTEGER """
+    octets = ''
+    while True:
+        octets = chr(value & 0xff) + octets
+        if -0x80 <= value < 0x80:
+            break
+        value >>= 8
+    return encode_tlv(INTEGER, octets)
+
+
+def encode_oid(oid):
+    """ Return the BER encoded OBJECT IDENTIFIER of a dotted OID or of a
+    tuple of arcs
+    """
+    if isinstance(oid, tuple):
+        arcs = oid
+    else:
+        arcs = [int(arc) for arc in oid.strip('.').split('.')]
+    if len(arcs) < 2:
+        raise SNMPCodecError("Bad OID: %s" % oid)
+    octets = []
+    for arc in [arcs[0] * 40 + arcs[1]] + list(arcs[2:]):
+        chunk = chr(arc & 0x7f)
+        arc >>= 7
+        while arc:
+            chunk = chr(0x80 | (arc & 0x7f)) + chunk
+            arc >>= 7
+        octets.append(chunk)
+    return encode_tlv(OBJECT_IDENTIFIER, ''.join(octets))
+
+
+def encode_var_binds(oids):
+    """ Return the BER encoded variable bindings of a request for oids """
+    return encode_tlv(SEQUENCE,
+                      ''.join([encode_tlv(SEQUENCE, encode_oid(oid) + NULL_VALUE)
+                               for oid in oids]))
+
+
+def encode_pdu(pdu_type, request_id, oids, non_repeaters=0, max_repetitions=0):
+    """ Return the PDU of a request for oids
+
+    non_repeaters and max_repetitions are only used by GETBULK requests,
+    they take the place of the error status and index of the other PDUs
+    """
+    return encode_tlv(pdu_type,
+                      encode_integer(request_id) +
+                      encode_integer(non_repeaters) +
+                      encode_integer(max_repetitions) +
+                      encode_var_binds(oids))
+
+
+def encode_request(pdu_type, request_id, community, oids,
+                   non_repeaters=0, max_repetitions=0):
+    """ Return the v2c message of a request for oids """
+    return encode_tlv(SEQUENCE,
+                      encode_integer(VERSION_2C) +
+                      encode_tlv(OCTET_STRING, community) +
+                      encode_pdu(pdu_type, request_id, oids,
+                                 non_repeaters, max_repetitions))
+
+
+def encode_pdu_template(pdu_type, oids, non_repeaters=0, max_repetitions=0):
+    """ Return the PDU of a request for oids as a (prefix, suffix)
+    template, around the 4 octets of its request id
+
+    See fill_request_template()
+    """
+    suffix = (encode_integer(non_repeaters) +
+              encode_integer(max_repetitions) +
+              encode_var_binds(oids))
+    # The request id INTEGER takes 6 octets
+    prefix = (chr(pdu_type) + encode_length(6 + len(suffix)) +
+              chr(INTEGER) + chr(4))
+    return prefix, suffix
+
+
+def encode_request_template(pdu_type, community, oids,
+                            non_repeaters=0, max_repetitions=0):
+    """ Return the v2c message of a request for oids as a (prefix, suffix)
+    template, around the 4 octets of its request id
+
+    See fill_request_template()
+    """
+    pdu_prefix, suffix = encode_pdu_template(pdu_type, oids, non_repeaters,
+                                             max_repetitions)
+    header = (encode_integer(VERSION_2C) +
+              encode_tlv(OCTET_STRING, community) +
+              pdu_prefix)
+    prefix = (chr(SEQUENCE) + encode_length(len(header) + 4 + len(suffix)) +
+              header)
+    return prefix, suffix
+
+
+def fill_request_template(template, request_id):
+    """ Return the message (or the PDU) of a request template with its
+    request id, between REQUEST_ID_MIN and REQUEST_ID_MAX
+    """
+    return template[0] + pack('>I', request_id) + template[1]
+
+
+def encode_scoped_pdu(context_engine_id, pdu, context_name=''):
+    """ Return the scoped PDU of a v3 message """
+    return encode_tlv(SEQUENCE,
+                      encode_tlv(OCTET_STRING, context_engine_id) +
+                      encode_tlv(OCTET_STRING, context_name) +
+                      pdu)
+
+
+def encode_v3_message(msg_id, flags, engine_id, engine_boots, engine_time,
+                      user_name, priv_parameters, msg_data):
+    """ Return a v3 message of the User-based Security Model and the offset
+    of its authentication parameters
+
+    msg_data is the encoded scoped PDU, or the OCTET STRING of the
+    encrypted one. When the message is authenticated (FLAG_AUTH), its
+    authentication parameters are zeros, to be replaced by its digest
+    """
+    auth_parameters = ''
+    if flags & FLAG_AUTH:
+        auth_parameters = '\x00' * AUTH_PARAMETERS_SIZE
+    global_data = encode_tlv(SEQUENCE,
+                             encode_integer(msg_id) +
+                             encode_integer(V3_MAX_MESSAGE_SIZE) +
+                             encode_tlv(OCTET_STRING, chr(flags)) +
+                             encode_integer(USM_SECURITY_MODEL))
+    # Everything after the authentication parameters
+    tail = encode_tlv(OCTET_STRING, priv_parameters)
+    security_parameters = encode_tlv(SEQUENCE,
+                                     encode_tlv(OCTET_STRING, engine_id) +
+                                     encode_integer(engine_boots) +
+                                     encode_integer(engine_time) +
+                                     encode_tlv(OCTET_STRING, user_name) +
+                                     encode_tlv(OCTET_STRING, auth_parameters) +
+                                     tail)
+    tail += msg_data
+    message = encode_tlv(SEQUENCE,
+                         encode_integer(VERSION_3) +
+                         global_data +
+                         encode_tlv(OCTET_STRING, security_parameters) +
+                         msg_data)
+    return message, len(message) - len(tail) - len(auth_parameters)
+
+
+def decode_header(octets, pos, end):
+    """ Return the tag, the start and the end of the value at pos """
+    if pos + 2 > end:
+        raise SNMPCodecError("Truncated message")
+    tag = octets[pos]
+    length = octets[pos + 1]
+    pos += 2
+    if length & 0x80:
+        size = length & 0x7f
+        if size == 0 or size > 4 or pos + size > end:
+            raise SNMPCodecError("Bad length")
+        length = 0
+        for octet in octets[pos:pos + size]:
+            length = (length << 8) | octet
+        pos += size
+    if pos + length > end:
+        raise SNMPCodecError("Truncated message")
+    return tag, pos, pos + length
+
+
+def decode_integer(data, start, end, signed=True):
+    """ Return the INTEGER (or unsigned type) value of data[start:end] """
+    if start == end:
+        return 0
+    value = int(hexlify(data[start:end]), 16)
+    if signed and ord(data[start]) & 0x80:
+        value -= 1 << (8 * (end - start))
+    return value
+
+
+def decode_arcs(octets, start, end):
+    """ Return the list of arcs of the OID in octets[start:end] """
+    arcs = []
+    arc = 0
+    for octet in octets[start:end]:
+        if octet & 0x80:
+            arc = (arc | (octet & 0x7f)) << 7
+        else:
+            arcs.append(arc | octet)
+            arc = 0
+    if not arcs:
+        raise SNMPCodecError("Empty OID")
+    first = arcs[0]
+    if first < 80:
+        arcs[0:1] = [first // 40, first % 40]
+    else:
+        arcs[0:1] = [2, first - 80]
+    return arcs
+
+
+def decode_value(data, octets, tag, start, end):
+    """ Return the python value of a decoded variable binding
+
+    * INTEGER, Counter32, Gauge32, TimeTicks and Counter64 give an int
+    * OBJECT IDENTIFIER gives a dotted OID
+    * NULL and the exceptions give the pysnmp objects
+    * other types (OCTET STRING, IpAddress, Opaque...) give their raw content
+    """
+    if tag == INTEGER:
+        return decode_integer(data, start, end)
+    if tag in UNSIGNED_TAGS:
+        return decode_integer(data, start, end, signed=False)
+    if tag in EXCEPTION_VALUES:
+        return EXCEPTION_VALUES[tag]
+    if tag == OBJECT_IDENTIFIER:
+        return '.'.join([str(arc) for arc in decode_arcs(octets, start, end)])
+    return data[start:end]
+
+
+def decode_pdu(data, octets, pos, end):
+    """ Decode the PDU at pos
+
+    Return (pdu_type, request_id, error_status, error_index, var_binds)
+    where var_binds is a list of (ObjectName, value)
+    """
+    pdu_type, pos, end = decode_header(octets, pos, end)
+    header = []
+    for _ in range(3):
+        tag, start, pos = decode_header(octets, pos, end)
+        if tag != INTEGER:
+            raise SNMPCodecError("Bad PDU header")
+        header.append(decode_integer(data, start, pos))
+    request_id, error_status, error_index = header
+    tag, pos, end = decode_header(octets, pos, end)
+    if tag != SEQUENCE:
+        raise SNMPCodecError("Bad variable bindings")
+    var_binds = []
+    while pos < end:
+        tag, pos, var_bind_end = decode_header(octets, pos, end)
+        if tag != SEQUENCE:
+            raise SNMPCodecError("Bad variable binding")
+        tag, start, pos = decode_header(octets, pos, var_bind_end)
+        if tag != OBJECT_IDENTIFIER:
+            raise SNMPCodecError("Bad variable binding name")
+        oid = ObjectName(decode_arcs(octets, start, pos))
+        tag, start, pos = decode_header(octets, pos, var_bind_end)
+        var_binds.append((oid, decode_value(data, octets, tag, start, pos)))
+        pos = var_bind_end
+    return pdu_type, request_id, error_status, error_index, var_binds
+
+
+def decode_version(data):
+    """ Return the version of an SNMP message, from its first octets """
+    octets = bytearray(data[:9])
+    if len(octets) < 2 or octets[0] != SEQUENCE:
+        raise SNMPCodecError("Not an SNMP message")
+    pos = 2
+    if octets[1] & 0x80:
+        pos += octets[1] & 0x7f
+    if pos + 3 > len(octets) or octets[pos] != INTEGER or octets[pos + 1] != 1:
+        raise SNMPCodecError("Not an SNMP message")
+    return octets[pos + 2]
+
+
+def decode_response(data):
+    """ Decode a v2c response message
+
+    Return (community, request_id, error_status, error_index, var_binds)
+    where var_binds is a list of (ObjectName, value)
+    Raise SNMPCodecError if the message is not a v2c response
+    """
+    octets = bytearray(data)
+    tag, pos, end = decode_header(octets, 0, len(octets))
+    if tag != SEQUENCE:
+        raise SNMPCodecError("Not an SNMP message")
+    tag, start, pos = decode_header(octets, pos, end)
+    if tag != INTEGER or decode_integer(data, start, pos) != VERSION_2C:
+        raise SNMPCodecError("Not an SNMP v2c message")
+    tag, start, pos = decode_header(octets, pos, end)
+    if tag != OCTET_STRING:
+        raise SNMPCodecError("Bad community")
+    community = data[start:pos]
+    (pdu_type, request_id, error_status,
+     error_index, var_binds) = decode_pdu(data, octets, pos, end)
+    if pdu_type != RESPONSE:
+        raise SNMPCodecError("Not a response PDU")
+    return community, request_id, error_status, error_index, var_binds
+
+
+def decode_v3_message(data):
+    """ Decode the header of a v3 message of the User-based Security Model
+
+    Return a dict with its msg_id, flags, engine_id, engine_boots,
+    engine_time, user_name, auth_parameters, priv_parameters, the
+    auth_offset of its authentication parameters and its msg_data:
+    the scoped PDU, or the encrypted one when FLAG_PRIV is set
+    Raise SNMPCodecError if the message is not a v3 USM message
+    """
+    octets = bytearray(data)
+    tag, pos, end = decode_header(octets, 0, len(octets))
+    if tag != SEQUENCE:
+        raise SNMPCodecError("Not an SNMP message")
+    tag, start, pos = decode_header(octets, pos, end)
+    if tag != INTEGER or decode_integer(data, start, pos) != VERSION_3:
+        raise SNMPCodecError("Not an SNMP v3 message")
+    tag, pos, global_end = decode_header(octets, pos, end)
+    if tag != SEQUENCE:
+        raise SNMPCodecError("Bad message header")
+    values = []
+    for expected_tag in (INTEGER, INTEGER, OCTET_STRING, INTEGER):
+        tag, start, pos = decode_header(octets, pos, global_end)
+        if tag != expected_tag:
+            raise SNMPCodecError("Bad message header")
+        values.append((start, pos))
+    if (values[2][1] - values[2][0] != 1 or
+            decode_integer(data, *values[3]) != USM_SECURITY_MODEL):
+        raise SNMPCodecError("Not a USM message")
+    message = {'msg_id': decode_integer(data, *values[0]),
+               'flags': octets[values[2][0]],
+               }
+    tag, pos, security_end = decode_header(octets, global_end, end)
+    if tag != OCTET_STRING:
+        raise SNMPCodecError("Bad security parameters")
+    tag, pos, security_end = decode_header(octets, pos, security_end)
+    if tag != SEQUENCE:
+        raise SNMPCodecError("Bad security parameters")
+    for name, expected_tag in (('engine_id', OCTET_STRING),
+                               ('engine_boots', INTEGER),
+                               ('engine_time', INTEGER),
+                               ('user_name', OCTET_STRING),
+                               ('auth_parameters', OCTET_STRING),
+                               ('priv_parameters', OCTET_STRING)):
+        tag, start, pos = decode_header(octets, pos, security_end)
+        if tag != expected_tag:
+            raise SNMPCodecError("Bad security parameters")
+        if name == 'auth_parameters':
+            message['auth_offset'] = start
+        if tag == INTEGER:
+            message[name] = decode_integer(data, start, pos)
+        else:
+            message[name] = data[start:pos]
+    tag, start, pos = decode_header(octets, security_end, end)
+    if message['flags'] & FLAG_PRIV:
+        if tag != OCTET_STRING:
+            raise SNMPCodecError("Bad encrypted PDU")
+        message['msg_data'] = data[start:pos]
+    else:
+        if tag != SEQUENCE:
+            raise SNMPCodecError("Bad scoped PDU")
+        message['msg_data'] = data[security_end:pos]
+    return message
+
+
+def decode_scoped_pdu(data):
+    """ Decode a scoped PDU, decrypted ones can end with padding
+
+    Return (context_engine_id, pdu_type, request_id, error_status,
+    error_index, var_binds)
+    """
+    octets = bytearray(data)
+    tag, pos, end = decode_header(octets, 0, len(octets))
+    if tag != SEQUENCE:
+        raise SNMPCodecError("Bad scoped PDU")
+    tag, start, pos = decode_header(octets, pos, end)
+    if tag != OCTET_STRING:
+        raise SNMPCodecError("Bad context engine id")
+    context_engine_id = data[start:pos]
+    tag, _, pos = decode_header(octets, pos, end)
+    if tag != OCTET_STRING:
+        raise SNMPCodecError("Bad context name")
+    return (context_engine_id,) + decode_pdu(data, octets, pos, end)
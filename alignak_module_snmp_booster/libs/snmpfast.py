@@ -0,0 +1,552 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2012-2014:
+#    Thibault Cohen, thibault.cohen@savoirfairelinux.com
+#
+# This file is part of SNMP Booster Shinken Module.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with SNMP Booster Shinken Module.
+# If not, see <http://www.gnu.org/licenses/>.
+
+
+""" This module contains an SNMP worker which sends the v2c and v3 requests
+itself, with the minimal codec of snmpcodec, on a non-blocking UDP socket
+
+"""
+
+from collections import OrderedDict
+from itertools import count
+from random import randint
+import asyncore
+import errno
+import socket
+import time
+import logging
+
+logger = logging.getLogger(__name__)  # pylint: disable=C0103
+
+try:
+    from pysnmp.carrier.asyncore.dgram import udp
+except ImportError as exp:
+    logger.error("[SnmpBooster] [code 1701] Import error. Pysnmp is missing")
+    raise ImportError(exp)
+
+from snmpcodec import (encode_request, encode_request_template,
+                       encode_pdu, encode_pdu_template, encode_scoped_pdu,
+                       encode_v3_message, encode_tlv,
+                       fill_request_template, decode_response, decode_version,
+                       decode_v3_message, decode_scoped_pdu, SNMPCodecError,
+                       REQUEST_ID_MIN, REQUEST_ID_MAX, VERSION_3, OCTET_STRING,
+                       GET_REQUEST, GETNEXT_REQUEST, GETBULK_REQUEST,
+                       RESPONSE, REPORT, FLAG_AUTH, FLAG_PRIV, FLAG_REPORTABLE,
+                       noSuchObject, noSuchInstance, endOfMibView)
+from snmpusm import (UsmEngineCache, SNMPUsmError, is_supported,
+                     get_security_flags, REPORTS)
+from snmpworker import SNMPWorker, DISPATCHER_TICK
+from utils import oid_to_tuple
+
+
+# PDU type of each task type
+PDU_TYPES = {'get': GET_REQUEST,
+             'next': GETNEXT_REQUEST,
+             'bulk': GETBULK_REQUEST,
+             }
+# Max size of a received SNMP message
+MAX_MESSAGE_SIZE = 65535
+# Receive buffer of the socket: many responses can come between two
+# dispatcher ticks
+RECEIVE_BUFFER_SIZE = 4 * 1024 * 1024
+# Max number of encoded requests kept by a worker
+TEMPLATE_CACHE_SIZE = 10000
+
+
+class UdpTransport(asyncore.dispatcher):
+    """ Non-blocking UDP socket of a FastSNMPWorker """
+    def __init__(self, worker, socket_map):
+        asyncore.dispatcher.__init__(self, map=socket_map)
+        self.worker = worker
+        self.create_socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                                   RECEIVE_BUFFER_SIZE)
+        except socket.error:
+            # Keep the system default
+            pass
+
+    def writable(self):
+        """ Requests are sent directly, we only wait for responses """
+        return False
+
+    def handle_read(self):
+        """ Give the received responses to the worker """
+        self.worker.receive_responses()
+
+    def handle_error(self):
+        """ Keep the socket open on unexpected errors """
+        logger.exception("[SnmpBooster] [code 1702] SNMP socket error")
+
+
+def is_exception_value(value):
+    """ Return True if value is noSuchObject, noSuchInstance or
+    endOfMibView
+    """
+    return (value is noSuchObject or value is noSuchInstance or
+            value is endOfMibView)
+
+
+def get_next_oids(var_binds, previous_oids):
+    """ Return the error indication and the OIDs of the next request of
+    a walk, from the last row of a response
+
+    Like the pysnmp command generator, the walk stops when all the
+    columns are ended and fails when an OID does not increase
+    """
+    error_indication = None
+    next_oids = []
+    not_ended = 0
+    for (oid, value), previous_oid in zip(var_binds, previous_oids):
+        if not is_exception_value(value):
+            not_ended += 1
+            if not isinstance(previous_oid, tuple):
+                # OID of the first request
+                previous_oid = oid_to_tuple(previous_oid)
+            if previous_oid >= oid.asTuple():
+                error_indication = "OID not increasing"
+        next_oids.append(oid)
+    if not not_ended:
+        next_oids = []
+    return error_indication, next_oids
+
+
+class FastSNMPWorker(SNMPWorker):
+    """ SNMP worker sending v2c and v3 GET, GETNEXT and GETBULK requests
+    itself
+
+    Requests are encoded and responses decoded by the snmpcodec module,
+    and go through one non-blocking UDP socket: the pysnmp engine
+    (message processing, security and MIB layers) is skipped.
+    The v3 messages are secured with the localized keys and the engines
+    cached by the snmpusm module.
+    Tasks of other SNMP versions (and v3 users of unsupported protocols)
+    are sent by the pysnmp engine of the worker, like in SNMPWorker.
+    """
+    def __init__(self, mapping_queue, max_inflight_tasks):
+        SNMPWorker.__init__(self, mapping_queue, max_inflight_tasks)
+        self.transport = None
+        self.socket_map = {}
+        self.request_ids = count(randint(0, REQUEST_ID_MAX - REQUEST_ID_MIN))
+        # Encoded first request of the tasks, LRU
+        # {(type, community, max_repetitions, oids): template}
+        self.request_templates = OrderedDict()
+        # Requests sent and not answered yet, with the PDU of the v3 ones
+        # {request_id: [snmp_task, oids, expiry, retries, message, pdu,
+        #               resent]}
+        self.pending_requests = {}
+        # SNMP v3 engines and localized keys
+        self.usm_engines = UsmEngineCache()
+        # Engine discoveries, with the v3 requests waiting for them
+        # {request_id: [transport_target, expiry, retries, message,
+        #               [(snmp_task, oids, pdu)]]}
+        self.discoveries = {}
+        # {transport address: request_id of its discovery}
+        self.discovering = {}
+
+    def create_engine(self):
+        """ Create the UDP socket of the worker, and the SNMP engine used
+        for the other SNMP versions
+        """
+        snmp_engine = SNMPWorker.create_engine(self)
+        self.transport = UdpTransport(self, self.socket_map)
+        return snmp_engine
+
+    @staticmethod
+    def use_codec(snmp_task):
+        """ Return True if the request of the task can be sent with the
+        codec: SNMP v2c or v3 (with supported protocols) over UDP/IPv4,
+        without non repeaters
+        """
+        data = snmp_task['data']
+        version = snmp_task.get('version')
+        return ((version == '2c' or
+                 (version == '3' and is_supported(data['authData']))) and
+                data['transportTarget'].transportDomain == udp.domainName and
+                not data.get('nonRepeaters', 0))
+
+    def send_request(self, snmp_task):
+        """ Send the SNMP request of a task """
+        if not self.use_codec(snmp_task):
+            SNMPWorker.send_request(self, snmp_task)
+            return
+        self.send_pdu(snmp_task, snmp_task['data']['varNames'],
+                      self.get_request_template(snmp_task))
+
+    def get_request_template(self, snmp_task):
+        """ Return the encoded first request of a task
+
+        Hosts are polled at each check interval with the same groups of
+        oids, so their requests are encoded once and only get a new
+        request id. A group changes with the mapping or the services of
+        its host: the new one gets its own template and the old one is
+        forgotten when it is the least recently used.
+        The template of a v3 request is only its PDU, secured when sent
+        """
+        data = snmp_task['data']
+        # SNMP v3 users have no community
+        key = (snmp_task['type'], getattr(data['authData'], 'communityName', None),
+               data.get('maxRepetitions', 0), tuple(data['varNames']))
+        template = self.request_templates.pop(key, None)
+        if template is None and key[1] is None:
+            template = encode_pdu_template(PDU_TYPES[snmp_task['type']],
+                                           key[3], 0, key[2])
+        elif template is None:
+            template = encode_request_template(PDU_TYPES[snmp_task['type']],
+                                               key[1], key[3], 0, key[2])
+        # Most recently used templates are at the end
+        self.request_templates[key] = template
+        if len(self.request_templates) > TEMPLATE_CACHE_SIZE:
+            self.request_templates.popitem(last=False)
+        return template
+
+    def get_request_id(self):
+        """ Return a new request id, always encoded on 4 octets """
+        return (REQUEST_ID_MIN +
+                next(self.request_ids) % (REQUEST_ID_MAX - REQUEST_ID_MIN + 1))
+
+    def send_pdu(self, snmp_task, oids, template=None):
+        """ Send a request of the task for oids, from its template if
+        given
+        """
+        data = snmp_task['data']
+        request_id = self.get_request_id()
+        community = getattr(data['authData'], 'communityName', None)
+        if community is None:
+            # SNMP v3: the PDU is secured in a message
+            if template is not None:
+                pdu = fill_request_template(template, request_id)
+            else:
+                pdu = encode_pdu(PDU_TYPES[snmp_task['type']], request_id,
+                                 oids, 0, data.get('maxRepetitions', 0))
+            self.send_v3_pdu(snmp_task, oids, pdu)
+            return
+        if template is not None:
+            message = fill_request_template(template, request_id)
+        else:
+            message = encode_request(PDU_TYPES[snmp_task['type']], request_id,
+                                     community, oids,
+                                     0, data.get('maxRepetitions', 0))
+        self.send_message(snmp_task, oids, request_id, message)
+
+    def send_message(self, snmp_task, oids, request_id, message, pdu=None,
+                     resent=False):
+        """ Send the message of a request and wait for its response """
+        transport_target = snmp_task['data']['transportTarget']
+        self.transport.socket.sendto(message, transport_target.transportAddr)
+        self.pending_requests[request_id] = [snmp_task, oids,
+                                             time.time() + transport_target.timeout,
+                                             transport_target.retries,
+                                             message, pdu, resent]
+
+    def send_v3_pdu(self, snmp_task, oids, pdu, resent=False):
+        """ Send the PDU of a v3 request, once the engine of its agent is
+        known
+        """
+        data = snmp_task['data']
+        engine_id = self.usm_engines.get_engine_id(data['transportTarget'].transportAddr)
+        if engine_id is None:
+            self.discover_engine(snmp_task, oids, pdu)
+            return
+        # The message id is the key of the pending requests
+        request_id = self.get_request_id()
+        message = self.secure_pdu(request_id, engine_id, data['authData'], pdu)
+        self.send_message(snmp_task, oids, request_id, message, pdu, resent)
+
+    def secure_pdu(self, request_id, engine_id, auth_data, pdu):
+        """ Return the v3 message of a PDU, encrypted and authenticated
+        with the localized keys of its user
+        """
+        flags = get_security_flags(auth_data)
+        engine_boots, engine_time = self.usm_engines.get_engine_time(engine_id)
+        msg_data = encode_scoped_pdu(engine_id, pdu)
+        priv_parameters = ''
+        keys = None
+        if flags & FLAG_AUTH:
+            keys = self.usm_engines.get_keys(engine_id, auth_data)
+        if flags & FLAG_PRIV:
+            encrypted, priv_parameters = keys.encrypt(msg_data, engine_boots,
+                                                      engine_time)
+            msg_data = encode_tlv(OCTET_STRING, encrypted)
+        message, auth_offset = encode_v3_message(request_id, flags, engine_id,
+                                                 engine_boots, engine_time,
+                                                 auth_data.userName,
+                                                 priv_parameters, msg_data)
+        if keys is not None:
+            message = keys.sign(message, auth_offset)
+        return message
+
+    def discover_engine(self, snmp_task, oids, pdu):
+        """ Ask the engine id, boots and time of an agent, with an empty
+        unauthenticated request, and keep the request of the task until
+        the agent answers with its engine in a report
+        """
+        transport_target = snmp_task['data']['transportTarget']
+        address = transport_target.transportAddr
+        request_id = self.discovering.get(address)
+        if request_id is not None:
+            # Already asked
+            self.discoveries[request_id][4].append((snmp_task, oids, pdu))
+            return
+        request_id = self.get_request_id()
+        message, _ = encode_v3_message(request_id, FLAG_REPORTABLE, '', 0, 0,
+                                       '', '',
+                                       encode_scoped_pdu('', encode_pdu(GET_REQUEST,
+                                                                        request_id,
+                                                                        [])))
+        self.transport.socket.sendto(message, address)
+        self.discovering[address] = request_id
+        self.discoveries[request_id] = [transport_target,
+                                        time.time() + transport_target.timeout,
+                                        transport_target.retries,
+                                        message,
+                                        [(snmp_task, oids, pdu)]]
+
+    def receive_responses(self):
+        """ Handle all the responses waiting in the socket """
+        while True:
+            try:
+                message = self.transport.socket.recv(MAX_MESSAGE_SIZE)
+            except socket.error as exp:
+                if exp.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    logger.error("[SnmpBooster] [code 1703] Can not receive "
+                                 "SNMP response: %s" % str(exp))
+                return
+            try:
+                if decode_version(message) == VERSION_3:
+                    self.receive_v3_message(message)
+                    continue
+                (_, request_id, error_status,
+                 error_index, var_binds) = decode_response(message)
+            except SNMPCodecError as exp:
+                logger.warning("[SnmpBooster] [code 1704] Bad SNMP response "
+                               "dropped: %s" % str(exp))
+                continue
+            pending_request = self.pending_requests.pop(request_id, None)
+            if pending_request is None:
+                # Late response of a timed out request
+                continue
+            self.handle_response(pending_request[0], pending_request[1],
+                                 error_status, error_index, var_binds)
+
+    def receive_v3_message(self, message):
+        """ Handle a v3 response: check its digest, decrypt it and give it
+        to its task, or handle the report of its agent
+        """
+        header = decode_v3_message(message)
+        request_id = header['msg_id']
+        discovery = self.discoveries.pop(request_id, None)
+        if discovery is not None:
+            self.engine_discovered(discovery, header)
+            return
+        pending_request = self.pending_requests.get(request_id)
+        if pending_request is None:
+            # Late response of a timed out request
+            return
+        snmp_task = pending_request[0]
+        engine_id = header['engine_id']
+        msg_data = header['msg_data']
+        auth_data = snmp_task['data']['authData']
+        authenticated = False
+        try:
+            if header['flags'] & FLAG_AUTH:
+                keys = self.usm_engines.get_keys(engine_id, auth_data)
+                authenticated = keys.verify(message, header['auth_offset'],
+                                            header['auth_parameters'])
+                if authenticated:
+                    self.usm_engines.update_engine_time(engine_id,
+                                                        header['engine_boots'],
+                                                        header['engine_time'])
+            if header['flags'] & FLAG_PRIV:
+                if not authenticated:
+                    raise SNMPUsmError("Wrong digest")
+                msg_data = keys.decrypt(msg_data, header['priv_parameters'],
+                                        header['engine_boots'],
+                                        header['engine_time'])
+            (_, pdu_type, _, error_status,
+             error_index, var_binds) = decode_scoped_pdu(msg_data)
+            if (pdu_type != REPORT and not authenticated and
+                    get_security_flags(auth_data) & FLAG_AUTH):
+                # Only the reports can come without a right digest, when
+                # the keys of the user are wrong
+                raise SNMPUsmError("Wrong digest")
+        except (SNMPCodecError, SNMPUsmError) as exp:
+            logger.warning("[SnmpBooster] [code 1706] [%s] Bad SNMP v3 "
+                           "response dropped: %s" % (snmp_task['host'],
+                                                     str(exp)))
+            return
+        del self.pending_requests[request_id]
+        if pdu_type == REPORT:
+            self.handle_report(pending_request, header, var_binds)
+        elif pdu_type == RESPONSE:
+            self.handle_response(snmp_task, pending_request[1],
+                                 error_status, error_index, var_binds)
+        else:
+            self.fail_request(snmp_task, "Not a response PDU")
+
+    def engine_discovered(self, discovery, header):
+        """ Send the v3 requests which were waiting for the engine of their
+        agent
+        """
+        transport_target, _, _, _, waiting = discovery
+        address = transport_target.transportAddr
+        del self.discovering[address]
+        if header['engine_id']:
+            self.usm_engines.set_engine(address, header['engine_id'],
+                                        header['engine_boots'],
+                                        header['engine_time'])
+        for snmp_task, oids, pdu in waiting:
+            if not header['engine_id']:
+                self.fail_request(snmp_task, "SNMP engine discovery failed")
+                continue
+            try:
+                self.send_v3_pdu(snmp_task, oids, pdu)
+            except socket.error as exp:
+                self.fail_request(snmp_task, "Can not send SNMP request: "
+                                             "%s" % str(exp))
+
+    def handle_report(self, pending_request, header, var_binds):
+        """ Send a v3 request again when its agent reports an unknown
+        engine id (the agent changed) or a time out of its window (the
+        agent rebooted), else fail it with the report
+        """
+        snmp_task, oids, _, _, _, pdu, resent = pending_request
+        report = None
+        if var_binds:
+            report = REPORTS.get(var_binds[0][0].asTuple(),
+                                 str(var_binds[0][0]))
+        if (report in ('unknownEngineIDs', 'notInTimeWindows') and
+                not resent and header['engine_id']):
+            self.usm_engines.set_engine(snmp_task['data']['transportTarget'].transportAddr,
+                                        header['engine_id'],
+                                        header['engine_boots'],
+                                        header['engine_time'])
+            try:
+                self.send_v3_pdu(snmp_task, oids, pdu, resent=True)
+                return
+            except socket.error:
+                pass
+        self.fail_request(snmp_task, "SNMP v3 report: %s" % report)
+
+    @staticmethod
+    def fail_request(snmp_task, error_indication):
+        """ Give the error of a request to its task callback """
+        cb_fun, cb_ctx = snmp_task['data']['cbInfo']
+        cb_fun(None, error_indication, 0, 0, [], cb_ctx)
+
+    def handle_response(self, snmp_task, oids, error_status, error_index,
+                        var_binds):
+        """ Give a response to the task callback and, for a walk, send the
+        next request while the callback asks for it
+        """
+        cb_fun, cb_ctx = snmp_task['data']['cbInfo']
+        if snmp_task['type'] == 'get':
+            cb_fun(None, None, error_status, error_index, var_binds, cb_ctx)
+            return
+        # One row for each repetition of the requested oids. An agent
+        # truncates the GETBULK responses which are too big: the partial
+        # last row is requested again
+        width = len(oids)
+        var_bind_table = [var_binds[index:index + width]
+                          for index in range(0, len(var_binds) - width + 1, width)]
+        if error_status:
+            error_indication, next_oids = None, []
+        elif not var_bind_table:
+            error_indication, next_oids = "Empty SNMP response message", []
+        else:
+            error_indication, next_oids = get_next_oids(var_bind_table[-1], oids)
+        if not cb_fun(None, error_indication, error_status, error_index,
+                      var_bind_table, cb_ctx):
+            return
+        if next_oids:
+            try:
+                self.send_pdu(snmp_task, next_oids)
+                return
+            except socket.error as exp:
+                logger.error("[SnmpBooster] [code 1705] [%s] Can not send "
+                             "SNMP request: %s" % (snmp_task['host'],
+                                                   str(exp)))
+        # The walk ended while the callback still wanted more
+        task_id = cb_ctx[0]
+        if task_id in self.inflight_tasks:
+            self.release_task(task_id)
+
+    def expire_requests(self):
+        """ Send again or time out the requests without response """
+        now = time.time()
+        for request_id, discovery in self.discoveries.items():
+            transport_target, expiry, retries, message, waiting = discovery
+            if expiry > now:
+                continue
+            if retries > 0:
+                try:
+                    self.transport.socket.sendto(message,
+                                                 transport_target.transportAddr)
+                    discovery[1] = now + transport_target.timeout
+                    discovery[2] = retries - 1
+                    continue
+                except socket.error:
+                    pass
+            del self.discoveries[request_id]
+            del self.discovering[transport_target.transportAddr]
+            for snmp_task, _, _ in waiting:
+                self.fail_request(snmp_task,
+                                  "No SNMP response received before timeout")
+        for request_id, pending_request in self.pending_requests.items():
+            snmp_task, _, expiry, retries, message = pending_request[:5]
+            if expiry > now:
+                continue
+            transport_target = snmp_task['data']['transportTarget']
+            if retries > 0:
+                try:
+                    self.transport.socket.sendto(message,
+                                                 transport_target.transportAddr)
+                    pending_request[2] = now + transport_target.timeout
+                    pending_request[3] = retries - 1
+                    continue
+                except socket.error:
+                    pass
+            del self.pending_requests[request_id]
+            self.fail_request(snmp_task,
+                              "No SNMP response received before timeout")
+
+    def run_dispatcher_once(self):
+        """ Handle SNMP responses and timeouts for at most DISPATCHER_TICK,
+        for both the socket of the worker and the pysnmp engine
+        """
+        dispatcher = self.snmp_engine.transportDispatcher
+        if dispatcher is None:
+            socket_map = self.socket_map
+        else:
+            socket_map = dict(dispatcher.getSocketMap())
+            socket_map.update(self.socket_map)
+        asyncore.loop(DISPATCHER_TICK, use_poll=True, map=socket_map, count=1)
+        if dispatcher is not None:
+            dispatcher.handleTimerTick(time.time())
+        self.expire_requests()
+
+    def real_run(self):
+        """ Process SNMP tasks and close the socket of the worker """
+        try:
+            SNMPWorker.real_run(self)
+        finally:
+            if self.transport is not None:
+                self.transport.close()
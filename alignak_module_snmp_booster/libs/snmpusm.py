@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2012-2014:
+#    Thibault Cohen, thibault.cohen@savoirfairelinux.com
+#
+# This file is part of SNMP Booster Shinken Module.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with SNMP Booster Shinken Module.
+# If not, see <http://www.gnu.org/licenses/>.
+
+
+
+""" This module contains the User-based Security Model of the SNMP v3
+requests sent by the fast SNMP workers: key localization, message
+authentication and encryption, and the cache of the agent engines
+
+"""
+
+from collections import OrderedDict
+from hashlib import md5, sha1
+from itertools import count
+from random import randint
+from struct import pack
+import hmac
+import time
+import logging
+
+logger = logging.getLogger(__name__)  # pylint: disable=C0103
+
+try:
+    from pysnmp.entity import config
+except ImportError as exp:
+    logger.error("[SnmpBooster] [code 1901] Import error. Pysnmp is missing")
+    raise ImportError(exp)
+
+try:
+    from Cryptodome.Cipher import AES, DES
+except ImportError:
+    # Like pysnmp, the privacy protocols need pycryptodomex
+    AES = DES = None
+
+from snmpcodec import (AUTH_PARAMETERS_SIZE, FLAG_AUTH, FLAG_PRIV,
+                       FLAG_REPORTABLE)
+
+
+# Hash function of each authentication protocol
+AUTH_HASHES = {config.usmHMACMD5AuthProtocol: md5,
+               config.usmHMACSHAAuthProtocol: sha1,
+               }
+PRIV_PROTOCOLS = (config.usmDESPrivProtocol, config.usmAesCfb128Protocol)
+# Size of the expanded pass phrase hashed into a key (RFC 3414 A.2)
+PASSPHRASE_EXPANSION_SIZE = 1048576
+# Max number of engines and of localized keys kept by a cache
+ENGINE_CACHE_SIZE = 10000
+
+# Reports of the agents (usmStats counters)
+REPORTS = {(1, 3, 6, 1, 6, 3, 15, 1, 1, 1, 0): 'unsupportedSecLevels',
+           (1, 3, 6, 1, 6, 3, 15, 1, 1, 2, 0): 'notInTimeWindows',
+           (1, 3, 6, 1, 6, 3, 15, 1, 1, 3, 0): 'unknownUserNames',
+           (1, 3, 6, 1, 6, 3, 15, 1, 1, 4, 0): 'unknownEngineIDs',
+           (1, 3, 6, 1, 6, 3, 15, 1, 1, 5, 0): 'wrongDigests',
+           (1, 3, 6, 1, 6, 3, 15, 1, 1, 6, 0): 'decryptionErrors',
+           }
+
+# Salts of the encrypted messages: they must not repeat with a key
+SALTS = count(randint(0, 0xffffffff))
+
+
+class SNMPUsmError(ValueError):
+    """ Raised when a v3 message can not be secured or read """
+    pass
+
+
+def is_supported(auth_data):
+    """ Return True if the requests of a v3 user can be sent by the
+    fast SNMP workers
+    """
+    if auth_data.authProtocol == config.usmNoAuthProtocol:
+        return auth_data.privProtocol == config.usmNoPrivProtocol
+    if auth_data.authProtocol not in AUTH_HASHES:
+        return False
+    if auth_data.privProtocol == config.usmNoPrivProtocol:
+        return True
+    return auth_data.privProtocol in PRIV_PROTOCOLS and AES is not None
+
+
+def get_security_flags(auth_data):
+    """ Return the message flags of the security level of a v3 user """
+    flags = FLAG_REPORTABLE
+    if auth_data.authProtocol != config.usmNoAuthProtocol:
+        flags |= FLAG_AUTH
+    if auth_data.privProtocol != config.usmNoPrivProtocol:
+        flags |= FLAG_PRIV
+    return flags
+
+
+def password_to_key(passphrase, hash_function):
+    """ Return the key of a pass phrase, independent of the engines: the
+    hash of the pass phrase repeated on 1 MB
+    """
+    if not passphrase:
+        raise SNMPUsmError("Empty pass phrase")
+    expanded = passphrase * (PASSPHRASE_EXPANSION_SIZE // len(passphrase) + 1)
+    return hash_function(expanded[:PASSPHRASE_EXPANSION_SIZE]).digest()
+
+
+def localize_key(key, engine_id, hash_function):
+    """ Return the key of a pass phrase for an engine """
+    return hash_function(key + engine_id + key).digest()
+
+
+class UsmKeys(object):
+    """ Localized keys of a user for an engine, used to authenticate and
+    encrypt its messages
+    """
+    def __init__(self, hash_function, auth_key, priv_protocol, priv_key):
+        # The digest of each message is computed from a copy
+        self.hmac = hmac.new(auth_key, digestmod=hash_function)
+        self.priv_protocol = priv_protocol
+        self.priv_key = priv_key
+
+    def sign(self, message, auth_offset):
+        """ Return the message with its digest, in place of the zeros of
+        its authentication parameters
+        """
+        digest = self.get_digest(message)
+        return (message[:auth_offset] + digest +
+                message[auth_offset + AUTH_PARAMETERS_SIZE:])
+
+    def verify(self, message, auth_offset, auth_parameters):
+        """ Return True if the digest of a received message is right """
+        unsigned = (message[:auth_offset] + '\x00' * AUTH_PARAMETERS_SIZE +
+                    message[auth_offset + AUTH_PARAMETERS_SIZE:])
+        return hmac.compare_digest(self.get_digest(unsigned), auth_parameters)
+
+    def get_digest(self, message):
+        """ Return the HMAC-96 digest of a message """
+        digest = self.hmac.copy()
+        digest.update(message)
+        return digest.digest()[:AUTH_PARAMETERS_SIZE]
+
+    def encrypt(self, data, engine_boots, engine_time):
+        """ Return the encrypted data and its privacy parameters (salt) """
+        salt = pack('>II', engine_boots & 0xffffffff,
+                    next(SALTS) & 0xffffffff)
+        if self.priv_protocol == config.usmDESPrivProtocol:
+            if len(data) % 8:
+                # CBC works on blocks of 8 octets
+                data += '\x00' * (8 - len(data) % 8)
+        return self.get_cipher(salt, engine_boots, engine_time).encrypt(data), salt
+
+    def decrypt(self, data, salt, engine_boots, engine_time):
+        """ Return the decrypted data of a received message """
+        if len(salt) != 8:
+            raise SNMPUsmError("Bad privacy parameters")
+        if self.priv_protocol == config.usmDESPrivProtocol and len(data) % 8:
+            raise SNMPUsmError("Bad encrypted data length")
+        return self.get_cipher(salt, engine_boots, engine_time).decrypt(data)
+
+    def get_cipher(self, salt, engine_boots, engine_time):
+        """ Return the cipher of a message, from its salt and, for AES, the
+        engine boots and time it was sent with
+        """
+        if self.priv_protocol == config.usmDESPrivProtocol:
+            # The IV is the last 8 octets of the key XOR the salt
+            init_vector = ''.join([chr(ord(key_octet) ^ ord(salt_octet))
+                                   for key_octet, salt_octet
+                                   in zip(self.priv_key[8:16], salt)])
+            return DES.new(self.priv_key[:8], DES.MODE_CBC, init_vector)
+        init_vector = pack('>II', engine_boots, engine_time) + salt
+        return AES.new(self.priv_key[:16], AES.MODE_CFB, init_vector,
+                       segment_size=128)
+
+
+class UsmEngineCache(object):
+    """ Bounded LRU cache of the SNMP v3 agent engines: the engine id found
+    at each address, the boots and time of each engine and the localized
+    keys of each user for each engine
+
+    The first request to an address discovers its engine, then the
+    following requests are sent with the cached engine id, boots and an
+    engine time computed from the local clock: there is no more discovery
+    round trip. The 1 MB hash of each pass phrase is done once, and its
+    localization once by engine.
+    """
+    def __init__(self, max_size=ENGINE_CACHE_SIZE):
+        self.max_size = max_size
+        # {transport address: engine id}
+        self.addresses = OrderedDict()
+        # {engine id: (engine boots, engine time, local time)}
+        self.engines = OrderedDict()
+        # {(hash function, pass phrase): key}
+        self.keys = OrderedDict()
+        # {(engine id, auth protocol, auth key, priv protocol, priv key):
+        #  UsmKeys}
+        self.localized_keys = OrderedDict()
+
+    @staticmethod
+    def use(cache, key, value=None):
+        """ Return the value of key in an LRU dict, set it if value is
+        given
+        """
+        if value is None:
+            value = cache.pop(key, None)
+            if value is None:
+                return None
+        else:
+            cache.pop(key, None)
+        # Most recently used entries are at the end
+        cache[key] = value
+        return value
+
+    def trim(self, cache):
+        """ Forget the least recently used entries of an LRU dict """
+        while len(cache) > self.max_size:
+            cache.popitem(last=False)
+
+    def get_engine_id(self, address):
+        """ Return the engine id of the agent at address, None if it is not
+        discovered yet
+        """
+        return self.use(self.addresses, address)
+
+    def get_engine_time(self, engine_id):
+        """ Return the engine boots and the current engine time of an
+        engine
+        """
+        engine = self.engines.get(engine_id)
+        if engine is None:
+            return 0, 0
+        engine_boots, engine_time, local_time = engine
+        return engine_boots, engine_time + int(time.time() - local_time)
+
+    def set_engine(self, address, engine_id, engine_boots, engine_time):
+        """ Save the engine found at address, with its boots and time """
+        if self.addresses.get(address) != engine_id:
+            logger.info("[SnmpBooster] [code 1902] [%s] SNMP engine "
+                        "discovered: %s" % (address[0], engine_id.encode('hex')))
+        self.use(self.addresses, address, engine_id)
+        self.trim(self.addresses)
+        self.use(self.engines, engine_id,
+                 (engine_boots, engine_time, time.time()))
+        self.trim(self.engines)
+
+    def update_engine_time(self, engine_id, engine_boots, engine_time):
+        """ Synchronize the time of an engine with an authenticated
+        message, if it is more recent
+        """
+        engine = self.engines.get(engine_id)
+        if engine is None or (engine_boots, engine_time) > self.get_engine_time(engine_id):
+            self.engines[engine_id] = (engine_boots, engine_time, time.time())
+
+    def get_keys(self, engine_id, auth_data):
+        """ Return the UsmKeys of a user (an UsmUserData) for an engine """
+        cache_key = (engine_id, auth_data.authProtocol, auth_data.authKey,
+                     auth_data.privProtocol, auth_data.privKey)
+        keys = self.use(self.localized_keys, cache_key)
+        if keys is None:
+            hash_function = AUTH_HASHES[auth_data.authProtocol]
+            auth_key = localize_key(self.get_key(auth_data.authKey,
+                                                 hash_function),
+                                    engine_id, hash_function)
+            priv_key = None
+            if auth_data.privProtocol != config.usmNoPrivProtocol:
+                # The privacy key is made with the authentication hash
+                priv_key = localize_key(self.get_key(auth_data.privKey,
+                                                     hash_function),
+                                        engine_id, hash_function)
+            keys = UsmKeys(hash_function, auth_key, auth_data.privProtocol,
+                           priv_key)
+            self.use(self.localized_keys, cache_key, keys)
+            self.trim(self.localized_keys)
+        return keys
+
+    def get_key(self, passphrase, hash_function):
+        """ Return the key of a pass phrase, hashed once """
+        key = self.use(self.keys, (hash_function, passphrase))
+        if key is None:
+            key = password_to_key(passphrase, hash_function)
+            self.use(self.keys, (hash_function, passphrase), key)
+            self.trim(self.keys)
+        return key
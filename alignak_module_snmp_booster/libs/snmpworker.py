@@ -26,41 +26,129 @@ and handle answers with callbacks
 """
 
 from threading import Thread
-import re
+from Queue import Empty, Queue
+from collections import deque
+from zlib import crc32
+from itertools import count
+import asyncore
+import string
 import time
 import logging
 
+from hostlimits import HostLimits
+from utils import oid_to_tuple
+
 logger = logging.getLogger(__name__)  # pylint: disable=C0103
 
 
 try:
     from pysnmp.entity.rfc3413.oneliner import cmdgen
+    from pysnmp.entity import config
+    from pysnmp.proto.rfc1905 import EndOfMibView, NoSuchInstance, NoSuchObject
     from pysnmp.smi.exval import noSuchInstance
 except ImportError as exp:
     logger.error("[SnmpBooster] [code 0601] Import error. Pysnmp is missing")
     raise ImportError(exp)
 
 
+# Max time (in seconds) spent waiting for SNMP responses before
+# looking for new tasks
+DISPATCHER_TICK = 0.05
+# Max time (in seconds) spent waiting for a new task when nothing is in flight
+IDLE_WAIT = 0.1
+# Extra delay (in seconds) given to a request after its SNMP timeout
+# before we consider it lost
+REQUEST_TIMEOUT_MARGIN = 2
+# Delay (in seconds) after which an unused target is removed from the
+# SNMP engine configuration
+TARGET_IDLE_TIMEOUT = 600
+# Delay (in seconds) between two removals of unused targets
+TARGET_RECLAIM_INTERVAL = 60
+# Characters of the mapped instance names replaced by '_'
+CLEAN_NAME_TABLE = string.maketrans(",:/ ", "____")
+# Device state read before a mapping: the mapping cache of a host is
+# used while the device did not restart nor change its interface table
+SYSUPTIME_OID = ".1.3.6.1.2.1.1.3.0"
+IFTABLELASTCHANGE_OID = ".1.3.6.1.2.1.31.1.5.0"
+SYSUPTIME_TUPLE = oid_to_tuple(SYSUPTIME_OID)
+IFTABLELASTCHANGE_TUPLE = oid_to_tuple(IFTABLELASTCHANGE_OID)
+# Clock drift (in seconds) allowed between the uptime of a device and
+# the time of the poller, before the device is deemed restarted
+UPTIME_TOLERANCE = 60
+# Tables whose changes are tracked by ifTableLastChange (ifTable, ifXTable)
+IF_MIB_TABLE_TUPLES = (oid_to_tuple(".1.3.6.1.2.1.2.2"),
+                       oid_to_tuple(".1.3.6.1.2.1.31.1.1"))
+# Error indications of the requests which did not reach their host or
+# got no answer, the other ones come from an answer
+NO_RESPONSE_ERRORS = ("No SNMP response received before timeout",
+                      "Can not send SNMP request")
+# Error status of an SNMP response which would be too big
+TOO_BIG_ERROR_STATUS = 1
+
+
 class SNMPWorker(Thread):
     """ Thread which execute all SNMP tasks/requests """
-    def __init__(self, mapping_queue, max_prepared_tasks):
+    def __init__(self, mapping_queue, max_inflight_tasks):
         Thread.__init__(self)
         self.cmdgen = None # will be cmdgen.AsynCommandGenerator()
+        self.snmp_engine = None
         self.mapping_queue = mapping_queue
-        self.max_prepared_tasks = max_prepared_tasks
+        self.max_inflight_tasks = max_inflight_tasks
         self.must_run = False
-        self.task_prepared = 0
+        # Requests sent and not finished yet {task_id: snmp_task}
+        self.inflight_tasks = {}
+        # Number of requests in flight for each host
+        self.inflight_hosts = {}
+        # Adaptive limit of requests in flight for each host (HostLimits),
+        # None when the hosts have no limit
+        self.host_limits = None
+        # Adaptive number of oids of the GET requests of each host,
+        # shared by the workers of a pool
+        self.group_sizes = None
+        # Circuit breakers of the hosts, shared by the workers of a pool
+        self.host_breakers = None
+        # Tasks waiting to be sent, in a FIFO queue for each host
+        self.host_queues = {}
+        # Hosts with waiting tasks and under their limit, sent in turn
+        self.ready_hosts = deque()
+        # Hosts with waiting tasks but at their limit
+        self.busy_hosts = set()
+        self.waiting_tasks = 0
+        # Last time a request was sent to each target address
+        self.targets_last_use = {}
+        self.next_targets_reclaim = 0
+        self.task_ids = count()
+        # Number of requests sent and finished by this worker
+        self.tasks_sent = 0
+        self.tasks_done = 0
 
     def append_task_to_dispatcher(self, snmp_task):
+        """ Send the SNMP request of the task and mark it as in flight """
         if snmp_task['type'] in ['bulk', 'next', 'get']:
-            # Append snmp requests
-            snmp_command_name = ("async" +
-                                 snmp_task['type'].capitalize() +
-                                 "Cmd")
-            getattr(self.cmdgen, snmp_command_name)(**snmp_task['data'])
-            # Mark task as done
-            self.mapping_queue.task_done()
-            self.task_prepared += 1
+            task_id = next(self.task_ids)
+            # Wrap the task callback to know when the request is finished
+            snmp_task['data']['cbInfo'] = (self.callback_task,
+                                           (task_id,
+                                            snmp_task['data']['cbInfo']))
+            snmp_task['sent_time'] = time.time()
+            snmp_task['deadline'] = snmp_task['sent_time'] + self.get_task_timeout(snmp_task)
+            self.inflight_tasks[task_id] = snmp_task
+            self.inflight_hosts[snmp_task['host']] = self.inflight_hosts.get(snmp_task['host'], 0) + 1
+            self.targets_last_use[snmp_task['data']['transportTarget'].transportAddr] = time.time()
+            self.tasks_sent += 1
+            try:
+                self.send_request(snmp_task)
+            except Exception as exp:
+                logger.error("[SnmpBooster] [code 0608] [%s] Can not send "
+                             "SNMP request: %s" % (snmp_task['host'],
+                                                   str(exp)))
+                # Let the task callback handle it like a request without
+                # answer, so its check is released
+                self.callback_task(None, "Can not send SNMP request: "
+                                   "%s" % str(exp), 0, 0, [],
+                                   snmp_task['data']['cbInfo'][1])
+                if task_id in self.inflight_tasks:
+                    self.release_task(task_id)
         else:
             # If the request is not handled
             error_message = ("Bad SNMP requets type: '%s'. Must be "
@@ -69,6 +157,220 @@ class SNMPWorker(Thread):
                          "%s" % (snmp_task['host'],
                                  error_message))
 
+    def send_request(self, snmp_task):
+        """ Send the SNMP request of a task """
+        # Append snmp requests
+        snmp_command_name = ("async" +
+                             snmp_task['type'].capitalize() +
+                             "Cmd")
+        getattr(self.cmdgen, snmp_command_name)(**snmp_task['data'])
+
+    @staticmethod
+    def get_task_timeout(snmp_task):
+        """ Return the delay after which an unanswered task is lost """
+        return snmp_task.get('timeout', 5) + REQUEST_TIMEOUT_MARGIN
+
+    def callback_task(self, send_request_handle, error_indication,
+                      error_status, error_index, var_binds, cb_ctx):
+        """ Call the task callback and free the in flight slot
+        of the task when its request is finished
+        """
+        task_id, (cb_fun, cb_args) = cb_ctx
+        snmp_task = self.inflight_tasks.get(task_id)
+        if snmp_task is None:
+            # The task was considered as lost and already called back
+            return False
+        if 'group_size' in snmp_task and self.group_sizes is not None:
+            # A GET request of the oids of a poll
+            self.group_size_done(snmp_task, error_indication, error_status)
+        if self.host_breakers is not None:
+            # A host which answers with errors (unknown SNMP v3 user...)
+            # is misconfigured, not down
+            self.host_breakers.request_done(snmp_task['host'],
+                                            is_no_response(error_indication))
+        try:
+            walk_again = cb_fun(send_request_handle, error_indication,
+                                error_status, error_index, var_binds,
+                                cb_args)
+        except Exception as exp:
+            logger.error("[SnmpBooster] [code 0609] Error in SNMP "
+                         "callback: %s" % str(exp))
+            walk_again = False
+
+        if self.host_limits is not None:
+            self.host_limits.request_done(snmp_task['host'],
+                                          snmp_task['sent_time'],
+                                          snmp_task.get('timeout', 5),
+                                          error_indication is not None)
+        if walk_again and snmp_task['type'] != 'get':
+            # The walk goes on with a new request
+            snmp_task['sent_time'] = time.time()
+            snmp_task['deadline'] = snmp_task['sent_time'] + self.get_task_timeout(snmp_task)
+        else:
+            self.release_task(task_id)
+        return walk_again
+
+    def group_size_done(self, snmp_task, error_indication, error_status):
+        """ Adapt the group size of the host to the outcome of a GET
+        request
+        """
+        var_names = snmp_task['data']['varNames']
+        too_big = (error_indication is None and error_status is not None and
+                   int(error_status) == TOO_BIG_ERROR_STATUS)
+        self.group_sizes.request_done(snmp_task['host'], len(var_names),
+                                      snmp_task['group_size'],
+                                      snmp_task['sent_time'],
+                                      time.time() - snmp_task['sent_time'],
+                                      snmp_task.get('timeout', 5),
+                                      error_indication is not None,
+                                      too_big)
+
+    def release_task(self, task_id):
+        """ Remove a finished task from in flight tasks """
+        snmp_task = self.inflight_tasks.pop(task_id)
+        self.tasks_done += 1
+        host = snmp_task['host']
+        self.inflight_hosts[host] -= 1
+        if self.inflight_hosts[host] <= 0:
+            del self.inflight_hosts[host]
+        if host in self.busy_hosts and self.host_is_free(host):
+            # The host can get its next task
+            self.busy_hosts.remove(host)
+            self.ready_hosts.append(host)
+
+    def reclaim_expired_tasks(self):
+        """ Free the slots of requests which never finished """
+        now = time.time()
+        for task_id, snmp_task in self.inflight_tasks.items():
+            if snmp_task['deadline'] < now:
+                logger.warning("[SnmpBooster] [code 0610] [%s] SNMP request "
+                               "lost, freeing its slot" % snmp_task['host'])
+                # Let the task callback handle it like a timeout
+                self.callback_task(None, "No SNMP response received before "
+                                   "timeout", 0, 0, [],
+                                   snmp_task['data']['cbInfo'][1])
+
+    def host_is_free(self, host):
+        """ Return True if the next waiting task of host can be sent """
+        no_concurrency = self.host_queues[host][0]['no_concurrency']
+        if self.host_limits is None:
+            return not no_concurrency or not self.inflight_hosts.get(host, 0)
+        host_limit = self.host_limits.get_limit(host, no_concurrency)
+        return self.inflight_hosts.get(host, 0) < host_limit
+
+    def queue_task(self, snmp_task):
+        """ Put the task at the end of the queue of its host """
+        host = snmp_task['host']
+        host_queue = self.host_queues.get(host)
+        if host_queue is None:
+            host_queue = self.host_queues[host] = deque()
+            host_queue.append(snmp_task)
+            if self.host_is_free(host):
+                self.ready_hosts.append(host)
+            else:
+                self.busy_hosts.add(host)
+        else:
+            # The host is already ready or busy
+            host_queue.append(snmp_task)
+        self.waiting_tasks += 1
+
+    def admit_tasks(self):
+        """ Send new tasks while the in flight cap is not reached
+
+        Hosts send their tasks in turn, one task each, so a host with
+        many waiting tasks does not delay the others
+        """
+        # Get new tasks
+        # Wait a little for a new task if we have nothing else to do
+        block = not self.inflight_tasks and not self.ready_hosts
+        while True:
+            try:
+                snmp_task = self.mapping_queue.get(block=block,
+                                                   timeout=IDLE_WAIT)
+            except Empty:
+                break
+            block = False
+            # Mark task as done
+            self.mapping_queue.task_done()
+            self.queue_task(snmp_task)
+        # Send tasks
+        while self.ready_hosts and len(self.inflight_tasks) < self.max_inflight_tasks:
+            host = self.ready_hosts.popleft()
+            host_queue = self.host_queues[host]
+            if not self.host_is_free(host):
+                # Its limit went down
+                self.busy_hosts.add(host)
+                continue
+            snmp_task = host_queue.popleft()
+            self.waiting_tasks -= 1
+            self.append_task_to_dispatcher(snmp_task)
+            if not host_queue:
+                del self.host_queues[host]
+            elif self.host_is_free(host):
+                # Back at the end of the turn
+                self.ready_hosts.append(host)
+            else:
+                self.busy_hosts.add(host)
+
+    def get_host_queue_depths(self):
+        """ Return the number of waiting tasks of each host """
+        return dict([(host, len(host_queue))
+                     for host, host_queue in self.host_queues.items()])
+
+    def run_dispatcher_once(self):
+        """ Handle SNMP responses and timeouts for at most DISPATCHER_TICK
+
+        Unlike runDispatcher(), this does not wait for all the requests
+        to be finished, so new requests can be sent while others are
+        in flight
+        """
+        dispatcher = self.snmp_engine.transportDispatcher
+        if dispatcher is None:
+            time.sleep(DISPATCHER_TICK)
+            return
+        asyncore.loop(DISPATCHER_TICK, use_poll=True,
+                      map=dispatcher.getSocketMap(), count=1)
+        dispatcher.handleTimerTick(time.time())
+
+    def create_engine(self):
+        """ Create the SNMP engine of the worker """
+        self.cmdgen = cmdgen.AsynCommandGenerator()
+        return self.cmdgen.snmpEngine
+
+    def reclaim_idle_targets(self):
+        """ Remove the targets not used for TARGET_IDLE_TIMEOUT from the
+        SNMP engine configuration
+
+        The engine keeps a configuration entry for each target it sent
+        a request to, so without this its memory would grow with the
+        number of hosts ever polled
+        """
+        now = time.time()
+        if now < self.next_targets_reclaim:
+            return
+        self.next_targets_reclaim = now + TARGET_RECLAIM_INTERVAL
+        if self.host_limits is not None:
+            self.host_limits.forget_idle_hosts(now - TARGET_IDLE_TIMEOUT)
+        idle_addresses = set([address for address, last_use
+                              in self.targets_last_use.items()
+                              if last_use < now - TARGET_IDLE_TIMEOUT])
+        if not idle_addresses:
+            return
+        snmp_engine = self.snmp_engine
+        try:
+            # Target addresses configured by the command generator
+            # key: (params, domain, address, timeout, retries, tags, iface)
+            cache = cmdgen.AsynCommandGenerator.lcd._getCache(snmp_engine)  # pylint: disable=W0212
+            for target_key, (target_name, _) in cache['addr'].items():
+                if target_key[2] in idle_addresses:
+                    config.delTargetAddr(snmp_engine, target_name)
+                    del cache['addr'][target_key]
+        except Exception as exp:
+            logger.error("[SnmpBooster] [code 0611] Can not remove unused "
+                         "SNMP targets: %s" % str(exp))
+        for address in idle_addresses:
+            del self.targets_last_use[address]
+
     def run(self):
         try:
             self.real_run()
@@ -77,7 +379,9 @@ class SNMPWorker(Thread):
 
     def real_run(self):
         """ Process SNMP tasks
-        SNMP task is a dict:
+        SNMP task is a dict with the target 'host', its 'no_concurrency'
+        flag, the request 'timeout', the SNMP 'version', the request 'type'
+        and its 'data':
         - For a bulk request ::
 
             {"authData": cmdgen.CommunityData('public')
@@ -103,52 +407,24 @@ class SNMPWorker(Thread):
              "varNames": ['1.3.6.1.2.1.2.2.1.2.0', '...']
              "cbInfo:: (cbFun, (arg1, arg2, ...))
             }
+
+        Tasks are sent as soon as a slot is free: up to max_inflight_tasks
+        requests are in flight at the same time, and a slow or dead host
+        only holds its own slots. Each host is also limited to a number of
+        requests in flight, adapted to its timeouts and response times.
         """
         self.must_run = True
         logger.info("[SnmpBooster] [code 0602] is starting")
-        slow_host_waiting = []
+        # The same SNMP engine (MIB, transport socket, targets) is used
+        # during the whole life of the worker
+        self.snmp_engine = self.create_engine()
         while self.must_run:
-            # Prevent memory leak
-            del self.cmdgen
-            self.cmdgen = cmdgen.AsynCommandGenerator()
-            # End prevent memory leak
-            self.task_prepared = 0
-            # slow host
-            slow_host_prepared = []
-            # Process slow hosts tasks
-            for index, snmp_task in enumerate(slow_host_waiting):
-                # Check if we have our max prepared tasks
-                if self.task_prepared > self.max_prepared_tasks:
-                    break
-                # Handle slow hosts
-                if snmp_task['no_concurrency']:
-                    if snmp_task['host'] in slow_host_prepared:
-                        continue
-                    else:
-                        slow_host_prepared.append(snmp_task['host'])
-                # Add task dispatcher
-                slow_host_waiting.pop(index)
-                self.append_task_to_dispatcher(snmp_task)
-            # Process normal tasks
-            while (not self.mapping_queue.empty()) and self.task_prepared <= self.max_prepared_tasks:
-                # Get task
-                snmp_task = self.mapping_queue.get()
-                # Handle slow hosts
-                if snmp_task['no_concurrency']:
-                    if snmp_task['host'] in slow_host_prepared:
-                        slow_host_waiting.append(snmp_task)
-                        continue
-                    else:
-                        slow_host_prepared.append(snmp_task['host'])
-                # Add task dispatcher
-                self.append_task_to_dispatcher(snmp_task)
-
-            if self.task_prepared > 0:
-                # Launch SNMP requests
-                self.cmdgen.snmpEngine.transportDispatcher.runDispatcher()
-            else:
-                # Sleep
-                time.sleep(0.1)
+            self.admit_tasks()
+            if self.inflight_tasks:
+                # Handle SNMP responses
+                self.run_dispatcher_once()
+                self.reclaim_expired_tasks()
+            self.reclaim_idle_targets()
 
         logger.info("[SnmpBooster] [code 0604] is stopped")
 
@@ -158,14 +434,145 @@ class SNMPWorker(Thread):
         self.must_run = False
 
 
+class SNMPWorkerPool(object):
+    """ Pool of SNMP workers, each one with its own SNMP engine and task
+    queue
+
+    Tasks are routed by a stable hash of their host, so all the requests
+    of a host go through the same worker, which handles its limit of
+    requests in flight
+    """
+    def __init__(self, nb_workers, max_inflight_tasks, worker_class=SNMPWorker,
+                 group_sizes=None, host_breakers=None, host_initial_limit=0):
+        self.worker_class = worker_class
+        # Requests in flight a host starts with, adapted by the workers
+        # (HostLimits), 0 to not limit the hosts
+        self.host_initial_limit = host_initial_limit
+        # Adaptive number of oids of the GET requests of each host
+        # (GroupSizes), also read by the poller to group the oids
+        self.group_sizes = group_sizes
+        # Circuit breakers of the hosts (HostBreakers), also read by the
+        # poller to suspend the polling of the hosts which do not answer
+        self.host_breakers = host_breakers
+        self.nb_workers = max(1, nb_workers)
+        # max_inflight_tasks is shared between the workers
+        self.max_inflight_tasks = max(1, -(-max_inflight_tasks // self.nb_workers))
+        self.task_queues = [Queue() for _ in range(self.nb_workers)]
+        self.workers = [None] * self.nb_workers
+        # Requests finished by the previous workers, which were respawned
+        self.previous_tasks_done = [0] * self.nb_workers
+        self.last_stats = (time.time(), [0] * self.nb_workers)
+
+    def get_worker_index(self, host):
+        """ Return the index of the worker handling the requests of host """
+        return (crc32(str(host)) & 0xffffffff) % self.nb_workers
+
+    def put(self, snmp_task, block=True, timeout=None):
+        """ Send a task to the worker of its host """
+        index = self.get_worker_index(snmp_task.get('host'))
+        self.task_queues[index].put(snmp_task, block, timeout)
+
+    def start_workers(self):
+        """ Start the workers, or respawn the ones which died """
+        for index, worker in enumerate(self.workers):
+            if worker is not None:
+                if worker.is_alive():
+                    continue
+                # The snmpworker seems down ...
+                # We respawn one
+                worker.join()
+                self.previous_tasks_done[index] += worker.tasks_done
+            worker = self.worker_class(self.task_queues[index],
+                                       self.max_inflight_tasks)
+            worker.group_sizes = self.group_sizes
+            worker.host_breakers = self.host_breakers
+            if self.host_initial_limit > 0:
+                worker.host_limits = HostLimits(self.host_initial_limit)
+            worker.daemon = True
+            worker.start()
+            self.workers[index] = worker
+
+    def stop_workers(self):
+        """ Stop all the workers """
+        for worker in self.workers:
+            if worker is not None:
+                worker.stop_worker()
+
+    def get_stats(self):
+        """ Return the counters of each worker:
+
+        * queue_depth: tasks waiting in the worker queue
+        * inflight: requests in flight
+        * waiting: tasks waiting for their host to be under its limit
+        * tasks_done: requests finished since the pool creation
+        * throughput: requests finished per second since the last call
+        """
+        now = time.time()
+        last_time, last_tasks_done = self.last_stats
+        stats = []
+        for index, worker in enumerate(self.workers):
+            tasks_done = self.previous_tasks_done[index]
+            inflight = waiting = 0
+            if worker is not None:
+                tasks_done += worker.tasks_done
+                inflight = len(worker.inflight_tasks)
+                waiting = worker.waiting_tasks
+            stats.append({'worker': index,
+                          'queue_depth': self.task_queues[index].qsize(),
+                          'inflight': inflight,
+                          'waiting': waiting,
+                          'tasks_done': tasks_done,
+                          'throughput': ((tasks_done - last_tasks_done[index]) /
+                                         max(now - last_time, 0.001)),
+                          })
+        self.last_stats = (now, [stat['tasks_done'] for stat in stats])
+        return stats
+
+    def get_host_limits(self):
+        """ Return the learned limit of requests in flight and the response
+        time of each host: {host: {'limit': int, 'response_time': float}}
+        """
+        limits = {}
+        for worker in self.workers:
+            if worker is not None and worker.host_limits is not None:
+                limits.update(worker.host_limits.get_limits())
+        return limits
+
+    def get_host_queue_depths(self):
+        """ Return the number of tasks waiting to be sent for each host """
+        depths = {}
+        for worker in self.workers:
+            if worker is not None:
+                depths.update(worker.get_host_queue_depths())
+        return depths
+
+
+def is_no_response(error_indication):
+    """ Return True if error_indication is a request timeout or a
+    transport error
+    """
+    return (error_indication is not None and
+            str(error_indication).startswith(NO_RESPONSE_ERRORS))
+
+
+def set_mapping_finished(result):
+    """ Mark a mapping walk as finished and call its 'on_finished'
+    function, only once
+    """
+    if result['finished']:
+        return
+    result['finished'] = True
+    on_finished = result.get('on_finished')
+    if on_finished is not None:
+        on_finished()
+
+
 def handle_snmp_error(error_indication, cb_ctx, request_type):
     """ Handle SNMP errors """
     if error_indication is None:
         # No error
         return False
 
-    # Get results
-    results = cb_ctx[0]
     # Current elected service result
     service_result = cb_ctx[1]
 
@@ -173,18 +580,21 @@ def handle_snmp_error(error_indication, cb_ctx, request_type):
     logger.error("[SnmpBooster] [code 0606] [%s] SNMP Error: "
                  "%s" % (service_result['host'],
                          str(error_indication)))
-    # If is a get request
-    if request_type == "get":
-        # We set SNMP error in all oids
-        for result in results.values():
-            result['error'] = str(error_indication)
 
     return True
 
 
 def callback_get(send_request_handle, error_indication, error_status,
                  error_index, var_binds, cb_ctx):
-    """ Callback function for GET SNMP requests """
+    """ Callback function for GET SNMP requests
+
+    The values of the other requests of the poll are kept when a request
+    fails: its oids are requested again, while the check deadline allows
+    it, then only they get the error. A request whose response would be
+    too big for the device is sent again in two halves.
+    The requests held by send_get_tasks are sent once the first request
+    of the poll is answered, and fail with it otherwise
+    """
     # Get the oid list
     results = cb_ctx[0]
 
@@ -192,175 +602,541 @@ def callback_get(send_request_handle, error_indication, error_status,
     service_result = cb_ctx[1]
     # Get queue to submit result
     result_queue = cb_ctx[2]
+    # Index of the oid list, see send_get_tasks
+    oids_index = cb_ctx[3]
+    # Oids of this request and its remaining retries
+    var_names, retries = cb_ctx[4:6]
+
+    if oids_index['outstanding'] <= 0:
+        # The results were already submitted
+        return False
 
     # Handle errors
-    if handle_snmp_error(error_indication, cb_ctx, "get"):
-        # set as received
-        service_result['state'] = 'received'
-        result_queue.put(results)
+    if error_indication is not None:
+        missing = get_missing_oids(var_names, oids_index)
+        if (missing and retries > 0 and
+                time.time() + oids_index['timeout'] <= oids_index['deadline']):
+            logger.info("[SnmpBooster] [code 0615] [%s] SNMP Error: %s, "
+                        "requesting %d oids again"
+                        % (service_result['host'], str(error_indication),
+                           len(missing)))
+            oids_index['send_get'](missing, retries - 1)
+            return False
+        handle_snmp_error(error_indication, cb_ctx, "get")
+        fail_oids(missing, str(error_indication), oids_index)
+        fail_held_requests(service_result['host'], str(error_indication),
+                           oids_index)
+        if oids_index['outstanding'] <= 0:
+            submit_results(results, service_result, result_queue, oids_index)
+        return False
+    # The device answers, the other requests of the poll can be sent
+    release_held_requests(service_result['host'], oids_index)
+    if (error_status and int(error_status) == TOO_BIG_ERROR_STATUS and
+            len(var_names) > 1):
+        logger.info("[SnmpBooster] [code 0613] [%s] SNMP response too big "
+                    "for %d oids, sending them in two requests"
+                    % (service_result['host'], len(var_names)))
+        middle = len(var_names) // 2
+        oids_index['send_get'](var_names[:middle], retries)
+        oids_index['send_get'](var_names[middle:], retries)
         return False
 
     # browse reponses
+    results_by_oid = oids_index['oids']
+    check_time = time.time()
     for oid, value in var_binds:
         # for each oid, value
-        # prepare the oid
-        oid = "." + oid.prettyPrint()
+        arcs = oid.asTuple()
+        # The instance name oid of a mapping can also be a datasource
+        mapping_check = oids_index['mapping_checks'].get(arcs)
+        if mapping_check is not None:
+            # Unknown name on errors, the mapping is not questioned
+            check_instance_name(mapping_check,
+                                None if error_status else value, oids_index)
+        result = results_by_oid.get(arcs)
         # if we need this oid
-        if oid in results:
-            # Check if we have a nosuchinstance error
-            if value == noSuchInstance:
-                # Log NoSuchInstance SNMP error
-                message = "Oid not found on the device: %s" % oid
-                logger.error("[SnmpBooster] [code 0607] [%s, %s] SNMP Error: "
-                             "%s" % (results.values()[0]['key']['host'],
-                                     results[oid]['key']['service'],
-                                     message))
-                results[oid]['error'] = message
-            else:
-                # save value
-                results[oid]['value'] = value
+        if result is None:
+            continue
+        if result['value'] is None and result.get('error') is None:
+            # First value or error of this oid
+            oids_index['outstanding'] -= 1
+        if error_status:
+            # The response only holds the requested oids
+            message = "SNMP error status: %d" % int(error_status)
+            logger.error("[SnmpBooster] [code 0614] [%s, %s] SNMP Error: "
+                         "%s" % (result['key']['host'],
+                                 result['key']['service'],
+                                 message))
+            result['error'] = message
+        # Check if we have a nosuchinstance or nosuchobject error
+        elif isinstance(value, (NoSuchInstance, NoSuchObject)):
+            # Log NoSuchInstance SNMP error
+            message = "Oid not found on the device: .%s" % oid.prettyPrint()
+            logger.error("[SnmpBooster] [code 0607] [%s, %s] SNMP Error: "
+                         "%s" % (result['key']['host'],
+                                 result['key']['service'],
+                                 message))
+            result['error'] = message
+        else:
+            # save value
+            result['value'] = value
 
-            # save check time
-            results[oid]['check_time'] = time.time()
+        # save check time
+        result['check_time'] = check_time
+
+    if error_status:
+        # The response can come without the requested oids (tooBig
+        # responses have no variable bindings)
+        fail_oids(get_missing_oids(var_names, oids_index),
+                  "SNMP error status: %d" % int(error_status), oids_index)
 
     # Check if we get all values
-    result_with_value_or_error = [oid['value'] for oid in results.values()
-                                  if oid.get('value') is None
-                                  and oid.get('error') is None]
-    if len(result_with_value_or_error) == 0:
-        # Add a saving task to the saving queue
-        # (processed by the function save_results)
-        result_queue.put(results)
-
-        # Prepare datas for the current service
-        tmp_results = [r for r in results.values()
-                       if r['key']['host'] == service_result['host']
-                       and r['key']['service'] == service_result['service']]
-        for tmp_result in tmp_results:
-            key = tmp_result.get('key')
-            # ds name
-            ds_names = key.get('ds_names')
-            for ds_name in ds_names:
-                # Last value
-                last_value_key = ".".join(("ds",
-                                           ds_name,
-                                           key.get('oid_type') + "_value_last"
-                                           )
-                                          )
-                # New value
-                value_key = ".".join(("ds",
-                                      ds_name,
-                                      key.get('oid_type') + "_value"
-                                      )
-                                     )
-                # Set last value
-                service_result['db_data']['ds'][ds_name][last_value_key] = tmp_result.get('value_last')
-                # Set value
-                service_result['db_data']['ds'][ds_name][value_key] = tmp_result.get('value')
-        # Set last check time
-        service_result['db_data']['check_time_last'] = service_result['db_data'].get('check_time')
-        # Set check time
-        service_result['db_data']['check_time'] = time.time()
-        # set as received
-        service_result['state'] = 'received'
-        # Calculate execution time
-        service_result['execution_time'] = time.time() - service_result['start_time']
-
-    else:
-        pass
+    if oids_index['outstanding'] > 0:
         # Not all data are received, we need to wait an other query
+        return False
+
+    submit_results(results, service_result, result_queue, oids_index)
+    return False
+
+
+def submit_results(results, service_result, result_queue, oids_index):
+    """ Set the values of the checked service once all the values of the
+    GET and table requests are received, and submit the results
+    """
+    # Forget the values of the services whose mapping changed
+    invalidate_mappings(oids_index, results)
+
+    # Prepare datas for the current service
+    for tmp_result in oids_index['service_results']:
+        key = tmp_result.get('key')
+        # ds name
+        ds_names = key.get('ds_names')
+        for ds_name in ds_names:
+            # Last value
+            last_value_key = ".".join(("ds",
+                                       ds_name,
+                                       key.get('oid_type') + "_value_last"
+                                       )
+                                      )
+            # New value
+            value_key = ".".join(("ds",
+                                  ds_name,
+                                  key.get('oid_type') + "_value"
+                                  )
+                                 )
+            # Set last value
+            service_result['db_data']['ds'][ds_name][last_value_key] = tmp_result.get('value_last')
+            # Set value
+            service_result['db_data']['ds'][ds_name][value_key] = tmp_result.get('value')
+    # Set last check time
+    service_result['db_data']['check_time_last'] = service_result['db_data'].get('check_time')
+    # Set check time
+    service_result['db_data']['check_time'] = time.time()
+    # set as received
+    service_result['state'] = 'received'
+    # Calculate execution time
+    service_result['execution_time'] = time.time() - service_result['start_time']
+    # Add a saving task to the saving queue
+    # (processed by the function save_results)
+    # This is done last: it wakes up the poller main loop
+    result_queue.put(results)
+
+
+def get_missing_oids(var_names, oids_index):
+    """ Return the oids of var_names without value nor error yet """
+    missing = []
+    for var_name in var_names:
+        oid = oid_to_tuple(var_name)
+        result = oids_index['oids'].get(oid)
+        mapping_check = oids_index['mapping_checks'].get(oid)
+        if ((result is not None and result['value'] is None and
+             result.get('error') is None) or
+                (mapping_check is not None and not mapping_check['checked'])):
+            missing.append(var_name)
+    return missing
+
+
+def fail_oids(var_names, message, oids_index):
+    """ Set the error of the results of var_names without value nor
+    error. Their instance names are unknown, the mapping is kept
+    """
+    for var_name in var_names:
+        oid = oid_to_tuple(var_name)
+        mapping_check = oids_index['mapping_checks'].get(oid)
+        if mapping_check is not None:
+            check_instance_name(mapping_check, None, oids_index)
+        result = oids_index['oids'].get(oid)
+        if (result is not None and result['value'] is None and
+                result.get('error') is None):
+            result['error'] = message
+            oids_index['outstanding'] -= 1
+
+
+def release_held_requests(host, oids_index):
+    """ Send the requests of a poll held until its first GET request is
+    answered. The requests which can not be sent fail
+    """
+    held_requests = oids_index.pop('held_requests', [])
+    for index, (send_request, _) in enumerate(held_requests):
+        try:
+            send_request()
+        except Exception as exp:
+            logger.error("[SnmpBooster] [code 0618] [%s] Can not send the "
+                         "held SNMP requests: %s" % (host, str(exp)))
+            oids_index['held_requests'] = held_requests[index:]
+            fail_held_requests(host, str(exp), oids_index)
+            return
+
+
+def fail_held_requests(host, message, oids_index):
+    """ Set the error of the oids of the requests of a poll held until
+    its first GET request is answered, without sending them
+    """
+    held_requests = oids_index.pop('held_requests', [])
+    if not held_requests:
+        return
+    logger.info("[SnmpBooster] [code 0617] [%s] First SNMP request of the "
+                "poll failed, %d other requests not sent"
+                % (host, len(held_requests)))
+    for _, var_names in held_requests:
+        fail_oids(var_names, message, oids_index)
+
+
+def get_state_value(value):
+    """ Return the int value of a device state oid, or None if the device
+    does not have it
+    """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        # noSuchObject, noSuchInstance...
+        return None
+
+
+def mapping_cache_is_valid(cache, state, mapping_oid):
+    """ Return True if the mapping cache of the table mapping_oid (tuple)
+    was saved since the last change of the device
+
+    The device changed if its uptime (in hundredths of a second) is lower
+    than the uptime it would have without restart since the cache was
+    saved or, for the IF-MIB tables, if ifTableLastChange changed.
+    The instance names of the other tables are only checked by the GET
+    requests of the services. A device without uptime is always walked
+    """
+    if cache is None or state is None:
+        return False
+    if (state['uptime'] is None or cache.get('uptime') is None or
+            cache.get('check_time') is None):
+        return False
+    expected_uptime = (cache['uptime'] +
+                       (time.time() - cache['check_time'] - UPTIME_TOLERANCE) * 100)
+    if state['uptime'] < max(cache['uptime'], expected_uptime):
+        # The device restarted
+        return False
+    if not any(mapping_oid[:len(table_oid)] == table_oid
+               for table_oid in IF_MIB_TABLE_TUPLES):
+        return True
+    return state['last_change'] == cache.get('last_change')
+
+
+def callback_mapping_state(send_request_handle, error_indication,
+                           error_status, error_index, var_binds, cb_ctx):
+    """ Callback function of the GET SNMP request of the device state sent
+    before a mapping
+
+    Tables whose names are all in a valid mapping cache are mapped from
+    it, the others are walked
+    """
+    # Retrive context
+    results = cb_ctx[0]
+    send_walks = cb_ctx[2]
+
+    # Handle errors
+    if handle_snmp_error(error_indication, cb_ctx, "state"):
+        # The device does not answer, a walk would fail too
+        for result in results:
+            set_mapping_finished(result)
+        return False
+
+    values = dict([(oid.asTuple(), get_state_value(value))
+                   for oid, value in var_binds])
+    state = {'uptime': values.get(SYSUPTIME_TUPLE),
+             'last_change': values.get(IFTABLELASTCHANGE_TUPLE),
+             }
+    walked = []
+    for result in results:
+        result['state'] = state
+        cache = result['cache']
+        if (mapping_cache_is_valid(cache, state, result['mapping_oid']) and
+                all(name in cache['instances'] for name in result['data'])):
+            for name in result['data']:
+                result['data'][name] = cache['instances'][name]
+            result['remaining'] = 0
+            result['from_cache'] = True
+            set_mapping_finished(result)
+        else:
+            walked.append(result)
+    if walked:
+        try:
+            send_walks(walked)
+        except Exception as exp:
+            logger.error("[SnmpBooster] [code 0619] [%s] Can not send the "
+                         "mapping walks: %s" % (cb_ctx[1]['host'], str(exp)))
+            # Release the check like when the device does not answer
+            for result in walked:
+                set_mapping_finished(result)
+    return False
+
+
+def callback_probe(send_request_handle, error_indication, error_status,
+                   error_index, var_binds, cb_ctx):
+    """ Callback function for the probe GET request of a host with its
+    circuit breaker open. The worker closes the breaker when the probe is
+    answered
+    """
+    if error_indication is None:
+        logger.info("[SnmpBooster] [code 0616] [%s] Probe answered"
+                    % cb_ctx[0]['host'])
+    return False
+
+
+def check_instance_name(mapping_check, value, oids_index):
+    """ Compare the instance name returned by the device with the names
+    of the services of a mapping check, once. A None value keeps the
+    mapping
+    """
+    if mapping_check['checked']:
+        return
+    mapping_check['checked'] = True
+    if value is not None:
+        mapping_check['changed'] = [name for name in mapping_check['names']
+                                    if not instance_name_matches(name, value)]
+    oids_index['outstanding'] -= 1
+
+
+def finish_column(column, oids_index):
+    """ Mark a collected table column as finished: its wanted oids which
+    were not walked are not on the device
+    """
+    column['finished'] = True
+    for oid, oid_tuple in column['oids']:
+        mapping_check = oids_index['mapping_checks'].get(oid_tuple)
+        if mapping_check is not None:
+            check_instance_name(mapping_check, noSuchInstance, oids_index)
+        result = oids_index['oids'].get(oid_tuple)
+        if result is None:
+            continue
+        if result['value'] is None and result.get('error') is None:
+            oids_index['outstanding'] -= 1
+            message = "Oid not found on the device: %s" % oid
+            logger.error("[SnmpBooster] [code 0607] [%s, %s] SNMP Error: "
+                         "%s" % (result['key']['host'],
+                                 result['key']['service'],
+                                 message))
+            result['error'] = message
+
+
+def callback_table(send_request_handle, error_indication, error_status,
+                   error_index, var_binds, cb_ctx):
+    """ Callback function for the GETBULK SNMP requests of a table
+    collection
+
+    Each column of the walk is a table column, the values of the wanted
+    instances are saved like the GET values. A column is finished at the
+    end of the column or after its last wanted instance
+    """
+    # Get the oid list
+    results = cb_ctx[0]
+    # Current elected service result
+    service_result = cb_ctx[1]
+    # Get queue to submit result
+    result_queue = cb_ctx[2]
+    # Index of the oid list, see send_get_tasks
+    oids_index = cb_ctx[3]
+    # Walked columns
+    columns = cb_ctx[4]
+
+    if oids_index['outstanding'] <= 0:
+        # The results were already submitted
+        return False
+
+    # Handle errors
+    if handle_snmp_error(error_indication, cb_ctx, "bulk"):
+        # The values already walked are kept
+        for column in columns:
+            if not column['finished']:
+                column['finished'] = True
+                fail_oids([oid for oid, _ in column['oids']],
+                          str(error_indication), oids_index)
+        if oids_index['outstanding'] <= 0:
+            submit_results(results, service_result, result_queue, oids_index)
+        return False
+
+    results_by_oid = oids_index['oids']
+    check_time = time.time()
+    for table_row in var_binds:
+        for (oid, value), column in zip(table_row, columns):
+            if column['finished']:
+                continue
+            arcs = oid.asTuple()
+            # Test if we reached the end of the MIB or of the column
+            if (isinstance(value, EndOfMibView) or
+                    arcs[:column['length']] != column['oid']):
+                finish_column(column, oids_index)
+                continue
+            mapping_check = oids_index['mapping_checks'].get(arcs)
+            if mapping_check is not None:
+                check_instance_name(mapping_check, value, oids_index)
+            result = results_by_oid.get(arcs)
+            if (result is not None and result['value'] is None and
+                    result.get('error') is None):
+                result['value'] = value
+                result['check_time'] = check_time
+                oids_index['outstanding'] -= 1
+            if arcs >= column['last']:
+                # Other instances are not needed
+                finish_column(column, oids_index)
+    walking = not all(column['finished'] for column in columns)
+
+    # Check if we get all values
+    if oids_index['outstanding'] > 0:
+        # Not all data are received, wait for the next rows or for the
+        # GET requests
+        return walking
+
+    submit_results(results, service_result, result_queue, oids_index)
+    return False
+
+
+def instance_name_matches(instance_name, value):
+    """ Return True if value is the instance name of a mapped service """
+    if isinstance(value, (NoSuchInstance, NoSuchObject)):
+        # The instance was removed
+        return False
+    name = str(value)
+    return (name == instance_name or
+            name.translate(CLEAN_NAME_TABLE) == instance_name)
+
+
+def invalidate_mappings(oids_index, results):
+    """ Clear the instance of the services whose instance name changed on
+    the device, and remove the name from the mapping cache: the next check
+    maps them again. Their values are from another instance, they are
+    replaced by an error
+    """
+    changed = [mapping_check
+               for mapping_check in oids_index['mapping_checks'].values()
+               if mapping_check['changed']]
+    if not changed:
+        return
+    db_client = oids_index['db_client']
+    changed_services = set()
+    for mapping_check in changed:
+        host = mapping_check['host']
+        cache = db_client.get_mapping(host, mapping_check['mapping'])
+        for instance_name in mapping_check['changed']:
+            services = mapping_check['names'][instance_name]
+            logger.warning("[SnmpBooster] [code 0612] [%s, %s] Instance "
+                           "mapping changed on the device, it will be mapped "
+                           "again: %s" % (host,
+                                          ", ".join(services),
+                                          instance_name))
+            for service in services:
+                changed_services.add((host, service))
+                db_client.update_service(host, service, {"instance": None})
+            if cache is not None:
+                cache['instances'].pop(instance_name, None)
+        if cache is not None:
+            db_client.update_mapping(host, mapping_check['mapping'], cache)
+    for result in results.values():
+        if (result['key']['host'], result['key']['service']) in changed_services:
+            result['value'] = None
+            result['error'] = "Instance mapping changed"
+
+
+def map_column(var_bind_table, column, result):
+    """ Save the instance of each wanted name found in a column of the
+    rows of a mapping walk
+
+    The table is finished at the end of the MIB, at the end of the
+    mapping table or when all the names are found
+    """
+    data = result['data']
+    mapping_oid = result['mapping_oid']
+    mapping_length = len(mapping_oid)
+    name_lengths = result['name_lengths']
+    for table_row in var_bind_table:
+        oid, instance_name = table_row[column]
+        # Test if we reached the end of the MIB
+        if isinstance(instance_name, EndOfMibView):
+            set_mapping_finished(result)
+            return
+        arcs = oid.asTuple()
+        # Test if we are not in the mapping oid
+        if arcs[:mapping_length] != mapping_oid:
+            # We are not in the mapping oid
+            set_mapping_finished(result)
+            return
+        name = str(instance_name)
+        # Handling illegal characters does not change the length
+        # of the name
+        if len(name) in name_lengths:
+            if name not in data:
+                # If we need this 'cleaned' instance we store it
+                name = name.translate(CLEAN_NAME_TABLE)
+            if name in data:
+                if data[name] is None:
+                    result['remaining'] -= 1
+                data[name] = ".".join([str(arc) for arc
+                                       in arcs[mapping_length:]])
+        # Check if mapping is finished
+        if result['remaining'] <= 0:
+            set_mapping_finished(result)
+            return
+
+
+def map_instances(var_bind_table, results):
+    """ Save the instances found in the rows of a mapping walk
+
+    Each column of the walk is a mapping table, with its result in
+    results. Columns of finished tables are skipped.
+    Return False when all the tables are finished
+    """
+    for column, result in enumerate(results):
+        if not result['finished']:
+            map_column(var_bind_table, column, result)
+    return not all(result['finished'] for result in results)
 
 
 def callback_mapping_next(send_request_handle, error_indication,
                           error_status, error_index, var_binds, cb_ctx):
     """ Callback function for GENEXT SNMP requests """
 
-    # Retrive context
-    mapping_oid = cb_ctx[0]
-    result = cb_ctx[2]
+    # Retrive context: the results of the walked tables
+    results = cb_ctx[2]
 
     # Handle errors
     if handle_snmp_error(error_indication, cb_ctx, "next"):
-        result['finished'] = True
+        for result in results:
+            set_mapping_finished(result)
         return False
 
     # Parse snmp results
-    for table_row in var_binds:
-        for oid, instance_name in table_row:
-            oid = "." + oid.prettyPrint()
-            # Test if we are not in the mapping oid
-            if not oid.startswith(mapping_oid):
-                # We are not in the mapping oid
-                result['finished'] = True
-                return False
-            instance = oid.replace(mapping_oid + ".", "")
-
-            # DEBUGGING
-            # print "OID", oid
-            # print "MAPPING", mapping_oid
-            # print "VAL", instance_name.prettyPrint()
-            # END DEBUGGING
-
-            # Handle illegal characters
-            cleaned_instance_name = re.sub("[,:/ ]", "_", str(instance_name))
-            # If we need this instance we store it
-            if instance_name in result['data']:
-                result['data'][instance_name] = instance
-            # If we need this 'cleaned' instance we store it
-            elif cleaned_instance_name in result['data']:
-                result['data'][cleaned_instance_name] = instance
-
-            # Check if mapping is finished
-            if all(result['data'].values()):
-                result['finished'] = True
-                return False
-
-    return True
+    return map_instances(var_binds, results)
 
 
 def callback_mapping_bulk(send_request_handle, error_indication,
                           error_status, error_index, var_binds, cb_ctx):
     """ Callback function for BULK SNMP requests """
 
-    # Retrive context
-    mapping_oid = cb_ctx[0]
-    result = cb_ctx[2]
+    # Retrive context: the results of the walked tables
+    results = cb_ctx[2]
 
     # Handle errors
     if handle_snmp_error(error_indication, cb_ctx, "bulk"):
-        result['finished'] = True
+        for result in results:
+            set_mapping_finished(result)
         return False
 
     # Parse snmp results
-    for table_row in var_binds:
-        for oid, instance_name in table_row:
-            oid = "." + oid.prettyPrint()
-            # Test if we are not in the mapping oid
-            if not oid.startswith(mapping_oid):
-                # We are not in the mapping oid
-                result['finished'] = True
-                return False
-            # Get instance
-            instance = oid.replace(mapping_oid + ".", "")
-
-            # DEBUGGING
-            # print "OID", oid
-            # print "MAPPING", mapping_oid
-            # print "VAL", instance_name.prettyPrint()
-            # END DEBUGGING
-
-            # Handle illegal characters
-            cleaned_instance_name = re.sub("[,:/ ]", "_", str(instance_name))
-            # If we need this instance we store it
-            if instance_name in result['data']:
-                result['data'][instance_name] = instance
-            # If we need this 'cleaned' instance we store it
-            elif cleaned_instance_name in result['data']:
-                result['data'][cleaned_instance_name] = instance
-
-            # Check if mapping is finished
-            if all(result['data'].values()):
-                result['finished'] = True
-                return False
-
-    return True
+    return map_instances(var_binds, results)
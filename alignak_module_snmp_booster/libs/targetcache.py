@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2012-2014:
+#    Thibault Cohen, thibault.cohen@savoirfairelinux.com
+#
+# This file is part of SNMP Booster Shinken Module.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with SNMP Booster Shinken Module.
+# If not, see <http://www.gnu.org/licenses/>.
+
+
+""" This module contains the cache of the SNMP targets used by the poller """
+
+
+import time
+from collections import OrderedDict
+from threading import Lock
+import logging
+
+logger = logging.getLogger(__name__)  # pylint: disable=C0103
+
+try:
+    from pysnmp.entity.rfc3413.oneliner import cmdgen
+except ImportError as exp:
+    logger.error("[SnmpBooster] [code 1401] Import error. Pysnmp is missing")
+    raise ImportError(exp)
+
+
+# Delay (in seconds) after which a target is built again, so changes of
+# the host name resolution are taken into account
+TARGET_TTL = 3600
+# pysnmp protocols of the SNMP v3 command line options
+AUTH_PROTOCOLS = {'MD5': cmdgen.usmHMACMD5AuthProtocol,
+                  'SHA': cmdgen.usmHMACSHAAuthProtocol,
+                  None: cmdgen.usmNoAuthProtocol,
+                  }
+PRIV_PROTOCOLS = {'DES': cmdgen.usmDESPrivProtocol,
+                  'AES': cmdgen.usmAesCfb128Protocol,
+                  None: cmdgen.usmNoPrivProtocol,
+                  }
+
+
+class TargetCache(object):
+    """ Bounded LRU cache of the SNMP authentication and transport objects
+    of the targets
+
+    Building a UdpTransportTarget resolves the host name, and the SNMP
+    engine registers each new object. Hosts are polled at each check
+    interval, so the objects are built once and reused.
+    The cache is used from the poller main loop and from the SNMP
+    workers (when the mapping is done)
+    """
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self.targets = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.targets)
+
+    def get_target(self, address, port, community, version, timeout,
+                   usm_user=None):
+        """ Return the (authData, transportTarget) of a target
+
+        usm_user is the SNMP v3 user of the target, see
+        utils.get_usm_user()
+        """
+        key = (address, port, community, version, timeout, usm_user)
+        now = time.time()
+        with self.lock:
+            target = self.targets.pop(key, None)
+            if target is None or target[0] < now - TARGET_TTL:
+                self.misses += 1
+                if version == '3':
+                    (security_name, auth_protocol, auth_key,
+                     priv_protocol, priv_key) = usm_user
+                    auth_data = cmdgen.UsmUserData(security_name, auth_key,
+                                                   priv_key,
+                                                   authProtocol=AUTH_PROTOCOLS[auth_protocol],
+                                                   privProtocol=PRIV_PROTOCOLS[priv_protocol])
+                else:
+                    # SNMP v1 or v2c
+                    auth_data = cmdgen.CommunityData(community,
+                                                     mpModel=0 if version == '1' else 1)
+                transport_target = cmdgen.UdpTransportTarget((address, port),
+                                                             timeout=timeout,
+                                                             retries=0,
+                                                             )
+                target = (now, auth_data, transport_target)
+            else:
+                self.hits += 1
+            # Most recently used targets are at the end
+            self.targets[key] = target
+            while len(self.targets) > self.max_size:
+                # Forget the least recently used target
+                self.targets.popitem(last=False)
+        return target[1:]
+
+    def get_stats(self):
+        """ Return cache statistics """
+        return {'size': len(self.targets),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                }
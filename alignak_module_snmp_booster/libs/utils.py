@@ -34,6 +34,13 @@ import logging
 
 logger = logging.getLogger(__name__)  # pylint: disable=C0103
 
+# SNMP v3 protocols of the command line
+AUTH_PROTOCOLS = ('MD5', 'SHA')
+PRIV_PROTOCOLS = ('DES', 'AES')
+# SNMP v3 keys of the command line, not saved with the services: the
+# poller reads them from the check arguments
+SECRET_ARGS = ('auth_key', 'priv_key')
+
 
 def flatten_dict(tree_dict):
     """ Convert unlimited tree dictionnary to a flat dictionnary
@@ -57,6 +64,15 @@ def flatten_dict(tree_dict):
     return flat_dict
 
 
+def oid_to_tuple(oid):
+    """ Convert a dotted OID to the tuple of its arcs
+
+    >>> oid_to_tuple('.1.3.6.1.2.1.1.3.0')
+    (1, 3, 6, 1, 2, 1, 1, 3, 0)
+    """
+    return tuple([int(arc) for arc in oid.strip('.').split('.')])
+
+
 def merge_dicts(old_dict, new_dict):
     """ Convert unlimited tree dictionnary to a flat dictionnary
 
@@ -81,7 +97,7 @@ def merge_dicts(old_dict, new_dict):
 
     for t_key, t_value in new_dict.items():
         if isinstance(t_value, dict):
-            ret = merge_dicts(old_dict[t_key], t_value)
+            ret = merge_dicts(old_dict.get(t_key), t_value)
             old_dict[t_key] = ret
         else:
             old_dict[t_key] = t_value
@@ -262,6 +278,12 @@ def parse_args(cmd_args):
             "version": '2c',
             "port": 161,
             "timeout": 5,
+            # SNMP v3 options
+            "security_name": None,
+            "auth_protocol": 'MD5',
+            "auth_key": None,
+            "priv_protocol": 'DES',
+            "priv_key": None,
             # Datasource options
             "dstemplate": None,
             "instance": None,
@@ -284,10 +306,13 @@ def parse_args(cmd_args):
     # Handle options
     try:
         options, _ = getopt.getopt(cmd_args,
-                                   'H:A:S:C:V:P:s:t:i:n:m:N:T:b:M:R:g:c:d:v:r',
+                                   'H:A:S:C:V:P:s:u:a:k:x:X:t:i:n:m:N:T:b:M:R:g:c:d:v:r',
                                    ['host-name=', 'host-address=', 'service=',
                                     'community=', 'snmp-version=', 'port=',
                                     'timeout=',
+                                    'security-name=', 'auth-protocol=',
+                                    'auth-key=', 'priv-protocol=',
+                                    'priv-key=',
                                     'dstemplate=', 'instance=',
                                     'instance-name=',
                                     'mapping=', 'mapping-name=',
@@ -318,6 +343,25 @@ def parse_args(cmd_args):
             args['port'] = value
         elif option_name in ("-s", "--timeout"):
             args['timeout'] = int(value)
+        # SNMP v3 options
+        elif option_name in ("-u", "--security-name"):
+            args['security_name'] = value
+        elif option_name in ("-a", "--auth-protocol"):
+            if value.upper() in AUTH_PROTOCOLS:
+                args['auth_protocol'] = value.upper()
+            else:
+                logger.warning('[SnmpBooster] [code 0805] Bad auth_protocol: '
+                               'setting to MD5')
+        elif option_name in ("-k", "--auth-key"):
+            args['auth_key'] = value
+        elif option_name in ("-x", "--priv-protocol"):
+            if value.upper() in PRIV_PROTOCOLS:
+                args['priv_protocol'] = value.upper()
+            else:
+                logger.warning('[SnmpBooster] [code 0806] Bad priv_protocol: '
+                               'setting to DES')
+        elif option_name in ("-X", "--priv-key"):
+            args['priv_key'] = value
         # Datasource options
         elif option_name in ("-t", "--dstemplate"):
             args['dstemplate'] = value
@@ -396,6 +440,11 @@ def parse_args(cmd_args):
                              "line" % arg_name)
             raise Exception(error_message)
 
+    if args['version'] == '3' and args['security_name'] is None:
+        error_message = ("Argument security-name is missing in the command "
+                         "line, it is needed by SNMP v3")
+        raise Exception(error_message)
+
     # Check if we have all arguments to map instance
     if args['instance_name'] != '' and args['instance_name'] is not None and (
                     args['mapping'] is None and args['mapping_name'] is None):
@@ -418,6 +467,27 @@ REGEX_OID = re.compile('\.\d+(\.\d+)*')
 REGEX_DS_ATTRIBUTE = re.compile('ds_*')
 
 
+def get_usm_user(args):
+    """ Return the SNMP v3 user of a service (or of command line arguments)
+    as (security_name, auth_protocol, auth_key, priv_protocol, priv_key)
+
+    The security level is given by the keys: authPriv with a privacy key,
+    authNoPriv with only an authentication key. Return None for SNMP v1
+    and v2c
+    """
+    if args.get('version') != '3':
+        return None
+    auth_key = args.get('auth_key')
+    if not auth_key:
+        return (args.get('security_name'), None, None, None, None)
+    priv_key = args.get('priv_key')
+    if not priv_key:
+        return (args.get('security_name'), args.get('auth_protocol', 'MD5'),
+                auth_key, None, None)
+    return (args.get('security_name'), args.get('auth_protocol', 'MD5'),
+            auth_key, args.get('priv_protocol', 'DES'), priv_key)
+
+
 def dict_serialize(serv, mac_resol, datasource):
     """ Get serv, datasource
         And return the service serialized
@@ -445,6 +515,8 @@ def dict_serialize(serv, mac_resol, datasource):
 
     # Prepare dict
     tmp_dict.update(command_args)
+    for secret_arg in SECRET_ARGS:
+        del tmp_dict[secret_arg]
     # hostname
     tmp_dict['host'] = serv.host.get_name()
     # address
@@ -485,6 +557,15 @@ def dict_serialize(serv, mac_resol, datasource):
     if tmp_dict.get('instance_name') is not None and tmp_dict.get('mapping') is not None:
         del tmp_dict['instance']
 
+    # Collect the datasources of the instances by walking their table
+    # columns with GETBULK requests instead of GET requests
+    try:
+        tmp_dict['table_collect'] = bool(int(ds_list.get('table_collect', 0)))
+        tmp_dict['max_rep_table'] = int(ds_list.get('max_rep_table', 100))
+    except ValueError:
+        raise Exception("Bad format: table_collect and max_rep_table values "
+                        "in DSTEMPLATE %s (must be int)" % tmp_dict['dstemplate'])
+
     # Get DSs in the dstemplate
     ds_list = ds_list.get('ds')
     # The 2 following must be useless, but I will let it
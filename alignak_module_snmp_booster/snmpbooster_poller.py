@@ -51,7 +51,7 @@ of SNMP Booster loaded in the Poller
 import sys
 import signal
 import time
-import shlex
+from threading import Event, Thread
 
 import logging
 
@@ -63,14 +63,28 @@ from alignak.util import to_int
 from pyasn1.type.univ import OctetString
 
 from snmpbooster import SnmpBooster
-from libs.utils import parse_args, compute_value
+from libs.utils import compute_value, merge_dicts
 from libs.result import set_output_and_status
 from libs.checks import check_snmp, check_cache
-from libs.snmpworker import SNMPWorker
+from libs.checkregistry import CheckRegistry
+from libs.commandcache import CommandCache
+from libs.targetcache import TargetCache
+from libs.snmpworker import SNMPWorker, SNMPWorkerPool
+from libs.groupsizes import GroupSizes
+from libs.hostbreakers import HostBreakers
 
 logger = logging.getLogger('alignak.module')  # pylint: disable=C0103
 
 
+# Interval (in seconds) between two wake ups of the main loop
+# while checks are running, to look for timed out checks
+HOUSEKEEPING_INTERVAL = 1.0
+# Interval (in seconds) between two saves of the learned group sizes
+GROUP_SIZES_SAVE_INTERVAL = 300
+# Interval (in seconds) between two saves of the host circuit breakers
+BREAKERS_SAVE_INTERVAL = 10
+
+
 properties = {
     'daemons': ['poller'],
     'type': 'snmp_booster',
@@ -112,6 +126,17 @@ def get_instance(mod_conf):
     return instance
 
 
+class WakeUpQueue(Queue):
+    """ Queue which wakes up the poller main loop when an item is put """
+    def __init__(self, wakeup):
+        Queue.__init__(self)
+        self.wakeup = wakeup
+
+    def put(self, item, block=True, timeout=None):
+        Queue.put(self, item, block, timeout)
+        self.wakeup.set()
+
+
 class SnmpBoosterPoller(SnmpBooster):
     """ SNMP Poller module class
         Improve SNMP checks
@@ -136,82 +161,164 @@ class SnmpBoosterPoller(SnmpBooster):
         logger.debug("received configuration: %s", mod_conf.__dict__)
         logger.debug("loaded into: %s", self.loaded_into)
 
-        self.max_prepared_tasks = to_int(getattr(mod_conf, 'max_prepared_tasks', 50))
+        # Max number of SNMP requests in flight at the same time
+        # (max_prepared_tasks is the old name of this parameter)
+        self.max_inflight_tasks = to_int(getattr(mod_conf, 'max_inflight_tasks',
+                                                 getattr(mod_conf, 'max_prepared_tasks', 50)))
+        # Number of SNMP workers, each one with its own SNMP engine
+        self.snmp_workers = to_int(getattr(mod_conf, 'snmp_workers', 1))
+        # SNMP backend of the workers: 'cmdgen', 'asyncio' or 'fast'
+        self.snmp_backend = getattr(mod_conf, 'snmp_backend', 'cmdgen')
+        # Max number of parsed command lines kept in cache
+        self.command_cache_size = to_int(getattr(mod_conf, 'command_cache_size', 10000))
+        # Max number of SNMP targets kept in cache
+        self.target_cache_size = to_int(getattr(mod_conf, 'target_cache_size', 10000))
+        # Learn the number of oids of the GET requests of each host
+        self.auto_group_size = bool(to_int(getattr(mod_conf, 'auto_group_size', 1)))
+        self.group_sizes = None
+        self.group_sizes_saved = 0
+        # Number of SNMP requests without answer in a row which suspend
+        # the polling of a host, 0 to disable
+        self.breaker_timeouts = to_int(getattr(mod_conf, 'breaker_timeouts', 5))
+        self.host_breakers = None
+        self.host_breakers_saved = 0
+        # Min number of requests of a poll for its first GET request to
+        # be sent alone, before the others, 0 to send them all at once
+        self.preflight_requests = to_int(getattr(mod_conf, 'preflight_requests', 0))
+        # Number of requests in flight a host starts with, then adapted to
+        # its response times, 0 to not limit the hosts
+        self.host_initial_limit = to_int(getattr(mod_conf, 'host_initial_limit', 0))
         self.checks_done = 0
-        self.task_queue = Queue()
-        self.result_queue = Queue()
+        # Set each time the main loop has something to do
+        self.wakeup = Event()
+        self.result_queue = WakeUpQueue(self.wakeup)
+        # Messages forwarded from the daemon queues
+        self.new_checks = WakeUpQueue(self.wakeup)
+        self.control_messages = WakeUpQueue(self.wakeup)
         self.last_checks_counted = 0
 
+    def forward_queue(self, source, destination, stop_when_dying=False):
+        """ Forward messages from a daemon queue to a local queue
+        Run in a thread, so the main loop only waits for its wake up event
+
+        With stop_when_dying, the forwarding stops when the module is
+        dying: the main loop does not take new checks any more, they are
+        left in the daemon queue
+        """
+        while not (stop_when_dying and self.i_am_dying):
+            try:
+                msg = source.get(timeout=HOUSEKEEPING_INTERVAL)
+            except Empty:
+                continue
+            except (IOError, EOFError) as exp:
+                # IOError: [Errno 104] Connection reset by peer
+                logger.error("[SnmpBooster] [code 1008] Daemon queue "
+                             "closed: %s" % str(exp))
+                break
+            if msg is None:
+                continue
+            if stop_when_dying and self.i_am_dying:
+                # Taken while the module started dying
+                source.put(msg)
+                break
+            destination.put(msg)
+
+    @staticmethod
+    def start_thread(target, args=()):
+        """ Start a daemon thread running the target """
+        thread = Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def wake_up_periodically(self):
+        """ Wake up the main loop while checks are running, so timed out
+        checks are handled even when no result comes
+        Run in a thread
+        """
+        while True:
+            time.sleep(HOUSEKEEPING_INTERVAL)
+            if self.checks:
+                self.wakeup.set()
+
+    def get_worker_class(self):
+        """ Return the SNMP worker class of the configured backend """
+        if self.snmp_backend == 'asyncio':
+            try:
+                from libs.snmpasyncio import AsyncioSNMPWorker
+                return AsyncioSNMPWorker
+            except ImportError as exp:
+                logger.error("[SnmpBooster] [code 1009] asyncio SNMP backend "
+                             "not available, using cmdgen: %s" % str(exp))
+        elif self.snmp_backend == 'fast':
+            from libs.snmpfast import FastSNMPWorker
+            return FastSNMPWorker
+        elif self.snmp_backend != 'cmdgen':
+            logger.error("[SnmpBooster] [code 1010] Unknown SNMP backend "
+                         "'%s', using cmdgen" % self.snmp_backend)
+        return SNMPWorker
+
     def get_new_checks(self):
-        """ Get new checks if less than nb_checks_max
-            If no new checks got and no check in queue,
-            sleep for 1 sec
+        """ Get new checks forwarded from the master queue
             REF: doc/shinken-action-queues.png (3)
         """
-        try:
-            while True:
-                try:
-                    msg = self.master_slave_queue.get(block=False)
-                except IOError:
-                    # IOError: [Errno 104] Connection reset by peer
-                    msg = None
-                if msg is not None:
-                    self.checks.append(msg.get_data())
-        except Empty:
-            if len(self.checks) == 0:
-                time.sleep(1)
+        while True:
+            try:
+                msg = self.new_checks.get(block=False)
+            except Empty:
+                break
+            self.checks.add(msg.get_data())
 
     def launch_new_checks(self):
         """ Launch checks that are in status
             REF: doc/shinken-action-queues.png (4)
         """
-        for chk in self.checks:
+        for chk in self.checks.pop_queued():
             now = time.time()
-            if chk.status == 'queue':
-                # Ok we launch it
-                chk.status = 'launched'
-                chk.check_time = now
-
-                # Want the args of the commands so we parse it like a shell
-                # shlex want str only
-                clean_command = shlex.split(chk.command.encode('utf8',
-                                                               'ignore'))
-                # If the command seems good
-                if len(clean_command) > 1:
-                    # we do not want the first member, check_snmp thing
-                    try:
-                        args = parse_args(clean_command[1:])
-                    except Exception as exp:
-                        # if we get a parsing error
-                        error_message = ("[SnmpBooster] [code 1001]"
-                                         "Command line { %s } parsing error: "
-                                         "%s" % (chk.command.encode('utf8',
-                                                                    'ignore'),
-                                                 str(exp)))
-                        logger.error(error_message)
-                        # Check is now marked as done
-                        chk.status = 'done'
-                        # Get exit code
-                        chk.exit_status = 3
-                        chk.get_outputs("Command line parsing error: `%s' - "
-                                        "Please verify your check "
-                                        "command" % str(exp),
-                                        8012)
-                        # Get execution time
-                        chk.execution_time = 0
+            # Ok we launch it
+            chk.status = 'launched'
+            chk.check_time = now
+            self.checks.set_launched(chk)
 
-                        continue
+            # Want the args of the commands so we parse it like a shell,
+            # only the first time we see the command line
+            try:
+                args = self.command_cache.get_args(chk.command)
+            except Exception as exp:
+                # if we get a parsing error
+                error_message = ("[SnmpBooster] [code 1001]"
+                                 "Command line { %s } parsing error: "
+                                 "%s" % (chk.command.encode('utf8',
+                                                            'ignore'),
+                                         str(exp)))
+                logger.error(error_message)
+                # Check is now marked as done
+                chk.status = 'done'
+                # Get exit code
+                chk.exit_status = 3
+                chk.get_outputs("Command line parsing error: `%s' - "
+                                "Please verify your check "
+                                "command" % str(exp),
+                                8012)
+                # Get execution time
+                chk.execution_time = 0
+                self.checks.set_done(chk)
 
-                # Ok we are good, we go on
-                if args.get('real_check', False):
-                    # Make a SNMP check
-                    check_snmp(chk, args, self.db_client,
-                               self.task_queue, self.result_queue)
-                    #logger.debug("CHECK SNMP %(host)s:%(service)s" % args)
-                else:
-                    # Make fake check (get datas from DB)
-                    check_cache(chk, args, self.db_client)
-                    #logger.debug("CHECK cache %(host)s:%(service)s" % args)
+                continue
+
+            # Ok we are good, we go on
+            if args.get('real_check', False):
+                # Make a SNMP check
+                check_snmp(chk, args, self.db_client,
+                           self.snmpworkers, self.result_queue,
+                           self.checks.done, self.target_cache,
+                           self.group_sizes, self.host_breakers,
+                           self.preflight_requests)
+                #logger.debug("CHECK SNMP %(host)s:%(service)s" % args)
+            else:
+                # Make fake check (get datas from DB)
+                check_cache(chk, args, self.db_client, self.checks.done)
+                #logger.debug("CHECK cache %(host)s:%(service)s" % args)
 
     # Check the status of checks
     # if done, return message finished :)
@@ -220,36 +327,50 @@ class SnmpBoosterPoller(SnmpBooster):
         """ This function handles finished check
         It gets output and exit_code and
         Add check to the return queue
+        Only the checks pushed on the completion queue or timed out
+        are looked at
         """
-        to_del = []
-
         now = time.time()
         prev_log = self.last_checks_counted
         if now > prev_log + 5:
             logger.info("%s checks ongoing.." % len(self.checks))
+            logger.debug("Command cache: %(size)d/%(max_size)d command lines, "
+                         "%(hits)d hits, %(misses)d misses"
+                         % self.command_cache.get_stats())
+            logger.debug("Target cache: %(size)d/%(max_size)d targets, "
+                         "%(hits)d hits, %(misses)d misses"
+                         % self.target_cache.get_stats())
+            for stats in self.snmpworkers.get_stats():
+                logger.debug("SNMP worker %(worker)d: %(queue_depth)d tasks "
+                             "queued, %(inflight)d requests in flight, "
+                             "%(waiting)d waiting for their host, "
+                             "%(throughput).1f requests/s" % stats)
+            for host, limit in self.snmpworkers.get_host_limits().items():
+                if limit['limit'] < self.host_initial_limit:
+                    logger.debug("SNMP host %s backed off: %d requests in "
+                                 "flight, %.3f s response time"
+                                 % (host, limit['limit'],
+                                    limit['response_time']))
+            depths = self.snmpworkers.get_host_queue_depths()
+            for host in sorted(depths, key=depths.get, reverse=True)[:5]:
+                logger.debug("SNMP host %s: %d tasks waiting"
+                             % (host, depths[host]))
             self.last_checks_counted = now
         # First look for checks in timeout
-        for chk in self.checks:
-            if now > chk.check_time + 3600:
-                logger.warning("check timeout: %s" % chk.command)
-                chk.get_outputs("check timedout", 8012)
-                chk.status = "done"
-                chk.exit_status = 3
-                chk.execution_time = now - chk.check_time
-            if not hasattr(chk, "result"):
-                continue
-            if chk.status == 'launched' and chk.result.get('state') != 'received':
-                pass
-                # TODO compore check.result['execution_time'] > timeout
-                # chk.con.look_for_timeout()
+        for chk in self.checks.pop_timed_out(now, 3600):
+            logger.warning("check timeout: %s" % chk.command)
+            chk.get_outputs("check timedout", 8012)
+            chk.status = "done"
+            chk.exit_status = 3
+            chk.execution_time = now - chk.check_time
+            self.checks.set_done(chk)
 
         # Now we look for finished checks
-        for chk in self.checks:
+        for chk in self.checks.pop_done():
             # First manage check in error, bad formed
             if chk.status == 'done':
                 if hasattr(chk, "result"):
                     del chk.result
-                to_del.append(chk)
                 try:
                     self.returns_queue.put(chk)
                 except IOError, exp:
@@ -257,50 +378,53 @@ class SnmpBoosterPoller(SnmpBooster):
                                  "[%d] Exiting: %s" % (str(self), exp))
                     # NOTE Do we really want to exit ???
                     sys.exit(2)
+                # Count checks done
+                self.checks_done += 1
                 continue
             # Then we check for good checks
-            if not hasattr(chk, "result"):
+            if not hasattr(chk, "result") or chk.result['state'] != 'received':
+                # Not finished yet
+                self.checks.keep_launched(chk)
                 continue
-            if chk.status == 'launched' and chk.result['state'] == 'received':
-                result = chk.result
-                # Format result
-                # Launch trigger
-                set_output_and_status(result)
-                # Set status
-                chk.status = 'done'
-                # Get exit code
-                chk.exit_status = result.get('exit_code', 3)
-                chk.get_outputs(str(result.get('output',
-                                               'Output is missing')),
-                                8012)
-                # Get execution time
-                chk.execution_time = result.get('execution_time', 0.0)
-
-                # unlink our object from the original check
-                if hasattr(chk, 'result'):
-                    del chk.result
-
-                # and set this check for deleting
-                # and try to send it
-                to_del.append(chk)
-                try:
-                    self.returns_queue.put(chk)
-                except IOError, exp:
-                    logger.error("[SnmpBooster] [code 1003]"
-                                 "FIX-ME-ID Exiting: %s" % exp)
-                    # NOTE Do we really want to exit ???
-                    sys.exit(2)
-
-        # And delete finished checks
-        for chk in to_del:
-            self.checks.remove(chk)
+            result = chk.result
+            # Format result
+            # Launch trigger
+            set_output_and_status(result)
+            # Set status
+            chk.status = 'done'
+            # Get exit code
+            chk.exit_status = result.get('exit_code', 3)
+            chk.get_outputs(str(result.get('output',
+                                           'Output is missing')),
+                            8012)
+            # Get execution time
+            chk.execution_time = result.get('execution_time', 0.0)
+
+            # unlink our object from the original check
+            if hasattr(chk, 'result'):
+                del chk.result
+
+            # and try to send it
+            try:
+                self.returns_queue.put(chk)
+            except IOError, exp:
+                logger.error("[SnmpBooster] [code 1003]"
+                             "FIX-ME-ID Exiting: %s" % exp)
+                # NOTE Do we really want to exit ???
+                sys.exit(2)
             # Count checks done
             self.checks_done += 1
 
     def save_results(self):
-        """ Save results to database """
+        """ Save results to database
+
+        The results of a request are merged per service, then all the
+        services are written at once
+        """
         while not self.result_queue.empty():
             results = self.result_queue.get()
+            # New data of each service: {(host, service): data}
+            services = {}
             for result in results.values():
                 # Check error
                 snmp_error = result.get('error')
@@ -368,10 +492,36 @@ class SnmpBoosterPoller(SnmpBooster):
                 new_data["check_time"] = result.get('check_time')
                 new_data["check_time_last"] = result.get('check_time_last')
 
-                self.db_client.update_service(key.get('host'), key.get('service'), new_data)
+                service_key = (key.get('host'), key.get('service'))
+                services[service_key] = merge_dicts(services.get(service_key), new_data)
+            self.db_client.update_services(services)
             # Remove task from queue
             self.result_queue.task_done()
 
+    def save_group_sizes(self, force=False):
+        """ Save the group sizes learned since the previous save in the
+        database, every GROUP_SIZES_SAVE_INTERVAL seconds
+        """
+        if self.group_sizes is None:
+            return
+        now = time.time()
+        if not force and now < self.group_sizes_saved + GROUP_SIZES_SAVE_INTERVAL:
+            return
+        self.group_sizes_saved = now
+        self.db_client.update_group_sizes(self.group_sizes.pop_changed_sizes())
+
+    def save_host_breakers(self, force=False):
+        """ Save the host circuit breakers changed since the previous save
+        in the database, for sbcm, every BREAKERS_SAVE_INTERVAL seconds
+        """
+        if self.host_breakers is None:
+            return
+        now = time.time()
+        if not force and now < self.host_breakers_saved + BREAKERS_SAVE_INTERVAL:
+            return
+        self.host_breakers_saved = now
+        self.db_client.update_host_breakers(self.host_breakers.pop_changed_states())
+
     # id = id of the worker
     # master_slave_queue = Global Queue Master->Slave
     # m = Queue Slave->Master
@@ -382,33 +532,51 @@ class SnmpBoosterPoller(SnmpBooster):
         logger.info("[SnmpBooster] [code 1006] Module SNMP Booster started!")
         # restore default signal handler for the workers:
         signal.signal(signal.SIGTERM, signal.SIG_DFL)
-        timeout = 1.0
-        self.checks = []
+        self.checks = CheckRegistry(WakeUpQueue(self.wakeup))
+        self.command_cache = CommandCache(self.command_cache_size)
+        self.target_cache = TargetCache(self.target_cache_size)
 
         self.returns_queue = returns_queue
         self.master_slave_queue = master_slave_queue
         self.t_each_loop = time.time()
-        self.snmpworker = SNMPWorker(self.task_queue, self.max_prepared_tasks)
-        self.snmpworker.start()
+        if self.auto_group_size:
+            # Start from the sizes learned before the restart
+            self.group_sizes = GroupSizes()
+            self.group_sizes.set_sizes(self.db_client.get_group_sizes())
+            self.group_sizes_saved = time.time()
+        if self.breaker_timeouts > 0:
+            self.host_breakers = HostBreakers(self.breaker_timeouts)
+        # SNMP tasks are sent to the workers through the pool
+        self.snmpworkers = SNMPWorkerPool(self.snmp_workers,
+                                          self.max_inflight_tasks,
+                                          self.get_worker_class(),
+                                          self.group_sizes,
+                                          self.host_breakers,
+                                          self.host_initial_limit)
+        self.snmpworkers.start_workers()
+
+        # Everything the main loop waits for wakes it up
+        self.start_thread(self.forward_queue,
+                          (master_slave_queue, self.new_checks, True))
+        self.start_thread(self.forward_queue,
+                          (control_queue, self.control_messages))
+        self.start_thread(self.wake_up_periodically)
 
         dt_start = datetime.now()
         dt_mid = dt_start.replace(hour=12, minute=0, second=0, microsecond=0)
         if dt_mid < dt_start:
             dt_mid = dt_mid + timedelta(days=1)
         while True:
+            # Anything happening from now will wake us up at the end of
+            # this iteration
+            self.wakeup.clear()
             now = datetime.now()
             if 0 and now > dt_mid:
                 logger.info('worker leaving..')
                 break
             cmsg = None
-            # Check snmp worker status
-            if not self.snmpworker.is_alive():
-                # The snmpworker seems down ...
-                # We respawn one
-                self.snmpworker.join()
-                self.snmpworker = SNMPWorker(self.task_queue, self.max_prepared_tasks)
-                # and start it
-                self.snmpworker.start()
+            # Check snmp workers status, respawn dead ones
+            self.snmpworkers.start_workers()
 
             # If we are diyin (big problem!) we do not
             # take new jobs, we just finished the current one
@@ -421,19 +589,26 @@ class SnmpBoosterPoller(SnmpBooster):
             self.save_results()
             # Prepare checks output
             self.manage_finished_checks()
+            # Save the learned group sizes
+            self.save_group_sizes()
+            # Save the host circuit breakers
+            self.save_host_breakers()
 
             # Now get order from master
             try:
-                cmsg = control_queue.get(block=False)
+                cmsg = self.control_messages.get(block=False)
                 if cmsg.get_type() == 'Die':
                     # TODO : What is self.id undefined variable
                     # logger.info("[SnmpBooster] [%d]
                     # Dad say we are dying..." % self.id)
                     logger.info("[SnmpBooster] [code 1007] FIX-ME-ID Parent "
                                 "requests termination.")
+                    self.snmpworkers.stop_workers()
+                    self.save_group_sizes(force=True)
+                    self.save_host_breakers(force=True)
                     break
             except Empty:
                 pass
 
-            # TODO : better time management
-            time.sleep(.1)
+            # Sleep until new checks, results or orders come
+            self.wakeup.wait()
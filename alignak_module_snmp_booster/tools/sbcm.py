@@ -65,6 +65,9 @@ def clear(db_client, host=None, service=None):
                                      result['service'],
                                      result,
                                      force=True)
+            # Else the next mapping would come from the cache
+            if result.get('mapping') is not None:
+                db_client.delete_mapping(result['host'], result['mapping'])
             print "Instance cleared for '%s' and service '%s'" % (result['host'], result['service'])
         else:
             print "Nothing to do for host '%s' and service '%s'" % (result['host'], result['service'])
@@ -100,6 +103,31 @@ def delete(db_client, host=None, service=None):
     print "%d key(s) deleted in database" % nb_del
 
 
+def breakers(db_client, host=None):
+    """ Show host circuit breakers, by host address """
+    results = db_client.get_host_breakers()
+    if host is not None:
+        results = dict([(name, breaker) for name, breaker in results.items()
+                        if name == host])
+    if not results:
+        print "No circuit breaker found in DB!"
+        return
+
+    print "%-30s %-6s %8s %6s %6s %8s  %s" % ("Host", "State", "Timeouts",
+                                             "Trips", "Probes", "Skipped",
+                                             "Opened")
+    for name, breaker in sorted(results.items()):
+        opened = breaker.get('opened')
+        if opened is not None:
+            opened = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(opened))
+        print "%-30s %-6s %8d %6d %6d %8d  %s" % (name, breaker['state'],
+                                                 breaker['timeouts'],
+                                                 breaker['trips'],
+                                                 breaker['probes'],
+                                                 breaker['skipped'],
+                                                 opened or "")
+
+
 def main():
 
     # Argument parsing
@@ -142,6 +170,12 @@ def main():
     delservice_parser.add_argument('-S', '--service-name', type=str, required=True,
                                    help='Service name')
     delservice_parser.set_defaults(command='delete-service')
+    # Breakers
+    breakers_parser = subparsers.add_parser('breakers',
+                                            help='Show host circuit breakers')
+    breakers_parser.add_argument('-H', '--host-name', type=str,
+                                 help='Host address')
+    breakers_parser.set_defaults(command='breakers')
     # Clear
     clear_parser = subparsers.add_parser('clear', help='clear help')
     clear_subparsers = clear_parser.add_subparsers(help='clear sub-command help')
@@ -181,6 +215,9 @@ def main():
         if args.command == 'search':
             search(db_client, args.host_name, args.service_name,
                    args.show_datasource, args.show_triggers)
+        # Host circuit breakers
+        elif args.command == 'breakers':
+            breakers(db_client, args.host_name)
         # Drop database
         elif args.command == "clear-cache":
             db_client.clear_cache()
@@ -0,0 +1,697 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2016: Alignak team, see AUTHORS.txt file for contributors
+#
+# This file is part of Alignak.
+#
+# Alignak is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Alignak is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Alignak.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Benchmarks of the SNMP Booster poller
+
+They are not run with the tests. Run them from the test directory, on two
+revisions of the module to compare them::
+
+    python bench_snmpbooster.py loop-latency --checks 500
+    python bench_snmpbooster.py parse-commands --checks 100000
+    python bench_snmpbooster.py soak --addresses 127.0.0.1 --port 161
+    python bench_snmpbooster.py backends --addresses 127.0.0.1 --port 161
+    python bench_snmpbooster.py codec --varbinds 64
+    python bench_snmpbooster.py mapping --rows 50000
+    python bench_snmpbooster.py snmpv3 --priv-user authpriv --auth-key authkey123 \
+        --priv-key privkey123 --addresses 127.0.0.1 --port 161
+"""
+
+import argparse
+import logging
+import threading
+import time
+from Queue import Queue
+
+
+def print_latencies(name, latencies):
+    """ Print statistics about a list of latencies (in seconds) """
+    latencies = sorted(latencies)
+    print "%s: %d samples" % (name, len(latencies))
+    print "  mean: %8.2f ms" % (sum(latencies) * 1000 / len(latencies))
+    for pct in (50, 90, 99):
+        index = min(len(latencies) - 1, len(latencies) * pct / 100)
+        print "  p%d:  %8.2f ms" % (pct, latencies[index] * 1000)
+    print "  max:  %8.2f ms" % (latencies[-1] * 1000)
+
+
+class BenchCheck(object):
+    """ Check with the attributes used by the poller module """
+    def __init__(self, command):
+        self.command = command
+        self.status = 'queue'
+        self.check_time = 0
+        self.exit_status = None
+        self.execution_time = 0
+        self.output = None
+
+    def get_outputs(self, out, max_plugins_output_length):
+        """ Save the check output """
+        self.output = out[:max_plugins_output_length]
+
+
+class BenchMessage(object):
+    """ Message exchanged between the poller and its workers """
+    def __init__(self, msg_type, data=None):
+        self.msg_type = msg_type
+        self.data = data
+
+    def get_type(self):
+        """ Get message type """
+        return self.msg_type
+
+    def get_data(self):
+        """ Get message data """
+        return self.data
+
+
+def get_poller_module():
+    """ Get a SnmpBoosterPoller instance """
+    from alignak.objects.module import Module
+    from alignak_module_snmp_booster.snmpbooster_poller import get_instance, properties
+
+    mod = Module({
+        'module_alias': 'SnmpBoosterPoller',
+        'module_types': 'checks',
+        'python_name': 'alignak_module_snmp_booster.snmpbooster_poller',
+        'loaded_by': 'poller',
+        'datasource': './cfg/genDevConfig/example.ini',
+        'db_host': 'localhost',
+        'db_port': 6379
+    })
+    mod.properties = properties
+    return get_instance(mod)
+
+
+def bench_loop_latency(args):
+    """ Measure the time between a check sent to the poller module and its
+    return, for checks which do not need any SNMP or database request
+    (their command line is rejected), so only the main loop is measured
+    """
+    poller = get_poller_module()
+    master_slave_queue = Queue()
+    returns_queue = Queue()
+    control_queue = Queue()
+    latencies = []
+
+    def send_checks():
+        """ Send checks one by one and wait for their return """
+        # Let the worker start
+        time.sleep(1)
+        for _ in range(args.checks):
+            check = BenchCheck("check_snmp_booster --bad-option")
+            start = time.time()
+            master_slave_queue.put(BenchMessage('Do', check))
+            returns_queue.get()
+            latencies.append(time.time() - start)
+            # Checks come one at a time, like on a lightly loaded poller
+            time.sleep(args.interval)
+        control_queue.put(BenchMessage('Die'))
+
+    sender = threading.Thread(target=send_checks)
+    sender.daemon = True
+    sender.start()
+    # work() sets a signal handler, so it must run in the main thread
+    poller.work(master_slave_queue, returns_queue, control_queue)
+    print_latencies("End to end check latency", latencies)
+
+
+def bench_parse_commands(args):
+    """ Measure the CPU time used to get the arguments of the check
+    command lines, with and without the parsed command cache
+    """
+    import shlex
+    from alignak_module_snmp_booster.libs.utils import parse_args
+    from alignak_module_snmp_booster.libs.commandcache import CommandCache
+
+    commands = []
+    for index in range(args.commands):
+        command = (u"check_snmp_booster -H host%d -A 10.0.%d.%d "
+                   "-S 'Interface eth%d' -C public -V 2c -t standard-interface "
+                   "-i None -n eth%d -N interface -T interface -b 1 -M 64 -g 64"
+                   % (index / 10, index / 2560, index % 256, index % 10,
+                      index % 10))
+        # Real checks have the -r flag added by the scheduler
+        commands.append(command + u" -r")
+    checks = [commands[index % len(commands)] for index in range(args.checks)]
+
+    def parse(command):
+        """ Parse a command like the poller did before the cache """
+        clean_command = shlex.split(command.encode('utf8', 'ignore'))
+        return parse_args(clean_command[1:])
+
+    start = time.clock()
+    for command in checks:
+        parse(command)
+    no_cache = time.clock() - start
+
+    cache = CommandCache(args.cache_size)
+    start = time.clock()
+    for command in checks:
+        cache.get_args(command)
+    with_cache = time.clock() - start
+
+    print "%d checks, %d distinct command lines" % (args.checks, args.commands)
+    print "  without cache: %8.3f s CPU" % no_cache
+    print "  with cache:    %8.3f s CPU" % with_cache
+    print "  saved per 100k checks: %.3f s CPU" % ((no_cache - with_cache) *
+                                                 100000 / args.checks)
+    print "  cache stats: %s" % cache.get_stats()
+
+
+def get_rss():
+    """ Return the resident memory of the process, in kB """
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def bench_soak(args):
+    """ Send batches of GET requests to SNMP agents through an SNMP worker
+    for a while, and print the memory used and the batch durations
+    """
+    from pysnmp.entity.rfc3413.oneliner import cmdgen
+    from alignak_module_snmp_booster.libs.snmpworker import SNMPWorker
+
+    addresses = args.addresses.split(',')
+    task_queue = Queue()
+    worker = SNMPWorker(task_queue, args.inflight)
+    worker.daemon = True
+    worker.start()
+    batch_done = threading.Event()
+    state = {'pending': 0, 'errors': 0}
+
+    def callback(send_request_handle, error_indication, error_status,
+                 error_index, var_binds, cb_ctx):
+        """ Count the answers of the batch """
+        if error_indication:
+            state['errors'] += 1
+        state['pending'] -= 1
+        if state['pending'] == 0:
+            batch_done.set()
+        return False
+
+    rss_start = get_rss()
+    durations = []
+    end = time.time() + args.duration
+    batch = 0
+    while time.time() < end:
+        batch_done.clear()
+        state['pending'] = args.requests
+        start = time.time()
+        for index in range(args.requests):
+            address = addresses[index % len(addresses)]
+            task_queue.put({'type': 'get',
+                            'host': address,
+                            'no_concurrency': False,
+                            'timeout': 2,
+                            'data': {'authData': cmdgen.CommunityData(args.community),
+                                     'transportTarget': cmdgen.UdpTransportTarget((address, args.port),
+                                                                                  timeout=2,
+                                                                                  retries=0),
+                                     'varNames': ['1.3.6.1.2.1.1.3.0'],
+                                     'cbInfo': (callback, None),
+                                     },
+                            })
+        batch_done.wait(10)
+        durations.append(time.time() - start)
+        if batch % 10 == 0:
+            print "batch %5d: RSS %7d kB, %d errors" % (batch, get_rss(),
+                                                        state['errors'])
+        batch += 1
+        # Let the worker go idle between two batches, like between two
+        # check intervals
+        time.sleep(args.interval)
+    worker.stop_worker()
+    print "RSS: %d kB at start, %d kB at end" % (rss_start, get_rss())
+    print_latencies("Batch duration (%d requests)" % args.requests, durations)
+
+
+def bench_backends(args):
+    """ Compare the SNMP workers of each backend: GET requests per second
+    and request latency (from the task queued to its callback)
+    """
+    from pysnmp.entity.rfc3413.oneliner import cmdgen
+    from alignak_module_snmp_booster.libs.snmpworker import SNMPWorker
+    from alignak_module_snmp_booster.libs.snmpasyncio import AsyncioSNMPWorker
+    from alignak_module_snmp_booster.libs.snmpfast import FastSNMPWorker
+
+    addresses = args.addresses.split(',')
+    targets = [(cmdgen.CommunityData(args.community),
+                cmdgen.UdpTransportTarget((address, args.port),
+                                          timeout=2, retries=0))
+               for address in addresses]
+    for name, worker_class in (('cmdgen', SNMPWorker),
+                               ('asyncio', AsyncioSNMPWorker),
+                               ('fast', FastSNMPWorker)):
+        task_queue = Queue()
+        worker = worker_class(task_queue, args.inflight)
+        worker.daemon = True
+        worker.start()
+        all_done = threading.Event()
+        latencies = []
+        state = {'errors': 0}
+
+        def callback(send_request_handle, error_indication, error_status,
+                     error_index, var_binds, cb_ctx):
+            """ Save the latency of the request """
+            if error_indication:
+                state['errors'] += 1
+            latencies.append(time.time() - cb_ctx)
+            if len(latencies) == args.requests:
+                all_done.set()
+            return False
+
+        start = time.time()
+        for index in range(args.requests):
+            auth_data, transport_target = targets[index % len(targets)]
+            task_queue.put({'type': 'get',
+                            'host': transport_target.transportAddr[0],
+                            'no_concurrency': False,
+                            'timeout': 2,
+                            'version': '2c',
+                            'data': {'authData': auth_data,
+                                     'transportTarget': transport_target,
+                                     'varNames': ['1.3.6.1.2.1.1.3.0'],
+                                     'cbInfo': (callback, time.time()),
+                                     },
+                            })
+        all_done.wait(args.requests)
+        duration = time.time() - start
+        worker.stop_worker()
+        worker.join()
+        print "%s backend: %d requests in %.2f s, %.1f requests/s, %d errors" % (
+            name, len(latencies), duration, len(latencies) / duration,
+            state['errors'])
+        print_latencies("%s request latency" % name, latencies)
+
+
+def bench_codec(args):
+    """ Compare the CPU time spent per variable binding by the SNMP codec
+    and by pysnmp to encode GET requests and decode their responses
+    """
+    from pyasn1.codec.ber import encoder, decoder
+    from pysnmp.proto import api
+    from pysnmp.proto.rfc1902 import Counter64, OctetString
+    from alignak_module_snmp_booster.libs.snmpcodec import (encode_request,
+                                                            encode_request_template,
+                                                            fill_request_template,
+                                                            decode_response,
+                                                            GET_REQUEST,
+                                                            REQUEST_ID_MIN)
+
+    v2c = api.protoModules[api.protoVersion2c]
+    oids = ['1.3.6.1.2.1.31.1.1.1.%d.%d' % (6 + index % 2, 1 + index // 2)
+            for index in range(args.varbinds)]
+    # Interface counters and names
+    values = [Counter64(123456789012 * index) if index % 4 else
+              OctetString('GigabitEthernet0/%d' % index)
+              for index in range(args.varbinds)]
+    pdu = v2c.GetResponsePDU()
+    v2c.apiPDU.setDefaults(pdu)
+    v2c.apiPDU.setVarBinds(pdu, zip(oids, values))
+    message = v2c.Message()
+    v2c.apiMessage.setDefaults(message)
+    v2c.apiMessage.setCommunity(message, 'public')
+    v2c.apiMessage.setPDU(message, pdu)
+    response = encoder.encode(message)
+    template = encode_request_template(GET_REQUEST, 'public', oids)
+
+    def pysnmp_encode():
+        """ Encode a GET request with pysnmp """
+        request_pdu = v2c.GetRequestPDU()
+        v2c.apiPDU.setDefaults(request_pdu)
+        v2c.apiPDU.setVarBinds(request_pdu, [(oid, v2c.Null('')) for oid in oids])
+        request = v2c.Message()
+        v2c.apiMessage.setDefaults(request)
+        v2c.apiMessage.setCommunity(request, 'public')
+        v2c.apiMessage.setPDU(request, request_pdu)
+        return encoder.encode(request)
+
+    def pysnmp_decode():
+        """ Decode a response with pysnmp """
+        decoded, _ = decoder.decode(response, asn1Spec=v2c.Message())
+        return v2c.apiPDU.getVarBinds(v2c.apiMessage.getPDU(decoded))
+
+    for name, function in (('pysnmp encode', pysnmp_encode),
+                           ('codec encode', lambda: encode_request(GET_REQUEST, 1,
+                                                                   'public',
+                                                                   oids)),
+                           ('codec template', lambda: fill_request_template(template,
+                                                                            REQUEST_ID_MIN)),
+                           ('pysnmp decode', pysnmp_decode),
+                           ('codec decode', lambda: decode_response(response))):
+        start = time.clock()
+        for _ in range(args.messages):
+            function()
+        cpu_time = time.clock() - start
+        print "%s: %.2f us per varbind (%d messages of %d varbinds)" % (
+            name, cpu_time * 1000000 / (args.messages * args.varbinds),
+            args.messages, args.varbinds)
+
+
+def bench_mapping(args):
+    """ CPU time of the mapping callbacks walking a large table, with the
+    wanted names spread over the table (the last one is the last row)
+    """
+    from pysnmp.proto.rfc1902 import ObjectName, OctetString
+    from alignak_module_snmp_booster.libs.checks import (send_mapping_tasks,
+                                                         send_mapping_walks)
+
+    mapping_oid = '.1.3.6.1.2.1.2.2.1.2'
+    step = max(1, args.rows // args.names)
+    wanted = range(args.rows, 0, -step)[:args.names]
+    services = [{'host': 'bench', 'address': '127.0.0.1', 'port': 161,
+                 'community': 'public', 'version': '2c', 'timeout': 5,
+                 'service': 'if%d' % index, 'mapping': mapping_oid,
+                 'use_getbulk': True, 'max_rep_map': args.repetitions,
+                 # Names are configured with their illegal characters cleaned
+                 'instance_name': 'GigabitEthernet1_0_%d' % index,
+                 }
+                for index in wanted]
+    rows = [(ObjectName('%s.%d' % (mapping_oid[1:], index)),
+             OctetString('GigabitEthernet1/0/%d' % index))
+            for index in range(1, args.rows + 1)]
+    # Responses of the walk
+    var_bind_tables = [[[var_bind] for var_bind in rows[start:start + args.repetitions]]
+                       for start in range(0, len(rows), args.repetitions)]
+
+    class BenchTargetCache(object):
+        """ Target cache returning no target """
+        @staticmethod
+        def get_target(*args):
+            """ No target is needed, no request is sent """
+            return None, None
+
+    class BenchDBClient(object):
+        """ Database without mapping cache """
+        @staticmethod
+        def get_mapping(*args):
+            """ The table is always walked """
+            return None
+
+    durations = []
+    for _ in range(args.walks):
+        task_queue = Queue()
+        mapping = {'services': services, 'tables': [], 'check_result': {},
+                   'arguments': {'host': 'bench'},
+                   'db_client': BenchDBClient(),
+                   'task_queue': task_queue,
+                   'target_cache': BenchTargetCache()}
+        send_mapping_tasks(mapping)
+        # The device state request is sent first
+        task_queue.get()
+        send_mapping_walks(mapping, mapping['tables'])
+        mapping_task = task_queue.get()
+        callback, cb_ctx = mapping_task['data']['cbInfo']
+        result = cb_ctx[2][0]
+        # The walk ends the table
+        result['on_finished'] = None
+        start = time.clock()
+        for var_bind_table in var_bind_tables:
+            if not callback(None, None, 0, 0, var_bind_table, cb_ctx):
+                break
+        durations.append(time.clock() - start)
+        found = len([instance for instance in result['data'].values()
+                     if instance is not None])
+    print "%d rows, %d/%d names found" % (args.rows, found, len(services))
+    print_latencies("Walk CPU time", durations)
+    print "  %.2f us per row" % (min(durations) * 1000000 / args.rows)
+
+
+def bench_snmpv3(args):
+    """ Compare the SNMP v3 requests of the fast SNMP worker to the v2c
+    ones: first request (engine discovery and key localization) and warm
+    requests per second and latency against the agents, then the CPU time
+    of a request and its response once warm, and the CPU time the key
+    localization would cost to each request without its cache
+    """
+    from hashlib import md5, sha1
+    from pysnmp.entity.rfc3413.oneliner import cmdgen
+    from alignak_module_snmp_booster.libs.snmpcodec import (encode_pdu,
+                                                            encode_request,
+                                                            fill_request_template,
+                                                            decode_response,
+                                                            RESPONSE,
+                                                            REQUEST_ID_MIN)
+    from alignak_module_snmp_booster.libs.snmpfast import FastSNMPWorker
+    from alignak_module_snmp_booster.libs.snmpusm import (password_to_key,
+                                                          localize_key)
+    from alignak_module_snmp_booster.libs.targetcache import (AUTH_PROTOCOLS,
+                                                              PRIV_PROTOCOLS)
+
+    addresses = args.addresses.split(',')
+    # Interface counters
+    oids = ['1.3.6.1.2.1.31.1.1.1.%d.%d' % (6 + index % 2, 1 + index // 2)
+            for index in range(args.varbinds)]
+    security_levels = [('v2c', '2c', cmdgen.CommunityData(args.community))]
+    if args.auth_user:
+        security_levels.append(('v3 authNoPriv', '3',
+                                cmdgen.UsmUserData(args.auth_user,
+                                                   args.auth_key,
+                                                   authProtocol=AUTH_PROTOCOLS[args.auth_protocol])))
+    if args.priv_user:
+        security_levels.append(('v3 authPriv', '3',
+                                cmdgen.UsmUserData(args.priv_user,
+                                                   args.auth_key,
+                                                   args.priv_key,
+                                                   authProtocol=AUTH_PROTOCOLS[args.auth_protocol],
+                                                   privProtocol=PRIV_PROTOCOLS[args.priv_protocol])))
+    for name, version, auth_data in security_levels:
+        transport_targets = [cmdgen.UdpTransportTarget((address, args.port),
+                                                       timeout=2, retries=0)
+                             for address in addresses]
+        task_queue = Queue()
+        worker = FastSNMPWorker(task_queue, args.inflight)
+        worker.daemon = True
+        worker.start()
+        all_done = threading.Event()
+        latencies = []
+        state = {'errors': 0, 'expected': len(transport_targets)}
+
+        def callback(send_request_handle, error_indication, error_status,
+                     error_index, var_binds, cb_ctx):
+            """ Save the latency of the request """
+            if error_indication or error_status:
+                state['errors'] += 1
+            latencies.append(time.time() - cb_ctx)
+            if len(latencies) == state['expected']:
+                all_done.set()
+            return False
+
+        def send_requests(count):
+            """ Queue GET requests of sysUpTime to the targets """
+            for index in range(count):
+                transport_target = transport_targets[index % len(transport_targets)]
+                task_queue.put({'type': 'get',
+                                'host': transport_target.transportAddr[0],
+                                'no_concurrency': False,
+                                'timeout': 2,
+                                'version': version,
+                                'data': {'authData': auth_data,
+                                         'transportTarget': transport_target,
+                                         'varNames': ['1.3.6.1.2.1.1.3.0'],
+                                         'cbInfo': (callback, time.time()),
+                                         },
+                                })
+
+        # Warm-up: one request to each target
+        send_requests(len(transport_targets))
+        all_done.wait(10)
+        print_latencies("%s first request latency" % name, latencies)
+        del latencies[:]
+        all_done.clear()
+        state['expected'] = args.requests
+        start = time.time()
+        send_requests(args.requests)
+        all_done.wait(args.requests)
+        duration = time.time() - start
+        worker.stop_worker()
+        worker.join()
+        print "%s: %d requests in %.2f s, %.1f requests/s, %d errors" % (
+            name, len(latencies), duration, len(latencies) / duration,
+            state['errors'])
+        print_latencies("%s request latency" % name, latencies)
+
+        # CPU time of the messages, without network and agent
+        template = worker.get_request_template({'type': 'get',
+                                                'data': {'authData': auth_data,
+                                                         'varNames': oids}})
+        engine_id = '\x80\x00\x00\x00\x01\x02\x03\x04'
+        worker.usm_engines.set_engine(('bench', 161), engine_id, 1, 1000)
+        response_pdu = encode_pdu(RESPONSE, REQUEST_ID_MIN, oids)
+        if version == '2c':
+            response = encode_request(RESPONSE, REQUEST_ID_MIN,
+                                      args.community, oids)
+        else:
+            response = worker.secure_pdu(REQUEST_ID_MIN, engine_id, auth_data,
+                                         response_pdu)
+        task = {'host': 'bench', 'type': 'get',
+                'data': {'authData': auth_data,
+                         'cbInfo': (lambda *args: False, None)}}
+        start = time.clock()
+        for _ in range(args.requests):
+            request = fill_request_template(template, REQUEST_ID_MIN)
+            if version == '2c':
+                decode_response(response)
+            else:
+                worker.secure_pdu(REQUEST_ID_MIN, engine_id, auth_data, request)
+                worker.pending_requests[REQUEST_ID_MIN] = [task, oids, 0, 0,
+                                                           None, None, False]
+                worker.receive_v3_message(response)
+        print "  %.1f us CPU per request and response of %d oids" % (
+            (time.clock() - start) * 1000000 / args.requests, len(oids))
+
+    hash_function = {'MD5': md5, 'SHA': sha1}[args.auth_protocol]
+    start = time.clock()
+    for _ in range(5):
+        localize_key(password_to_key(args.auth_key, hash_function),
+                     '\x80\x00\x00\x00\x01\x02\x03\x04', hash_function)
+    print "Key localization without cache: %.2f ms CPU per key, %d keys " \
+        "per authPriv request" % ((time.clock() - start) * 1000 / 5, 2)
+
+
+def main():
+    """ Run the requested benchmark """
+    parser = argparse.ArgumentParser(description='SNMP Booster benchmarks')
+    subparsers = parser.add_subparsers(help='benchmarks')
+
+    latency_parser = subparsers.add_parser('loop-latency',
+                                           help='poller main loop latency')
+    latency_parser.add_argument('-n', '--checks', type=int, default=500,
+                                help='Number of checks. Default=500')
+    latency_parser.add_argument('-i', '--interval', type=float, default=0.01,
+                                help='Delay between two checks. Default=0.01')
+    latency_parser.set_defaults(func=bench_loop_latency)
+
+    parse_parser = subparsers.add_parser('parse-commands',
+                                         help='check command line parsing')
+    parse_parser.add_argument('-n', '--checks', type=int, default=100000,
+                              help='Number of checks. Default=100000')
+    parse_parser.add_argument('-c', '--commands', type=int, default=5000,
+                              help='Number of distinct command lines. '
+                                   'Default=5000')
+    parse_parser.add_argument('-s', '--cache-size', type=int, default=10000,
+                              help='Command cache size. Default=10000')
+    parse_parser.set_defaults(func=bench_parse_commands)
+
+    soak_parser = subparsers.add_parser('soak',
+                                        help='SNMP worker memory and batch '
+                                             'duration over time')
+    soak_parser.add_argument('-a', '--addresses', default='127.0.0.1',
+                             help='Comma separated agent addresses. '
+                                  'Default=127.0.0.1')
+    soak_parser.add_argument('-p', '--port', type=int, default=161,
+                             help='Agent port. Default=161')
+    soak_parser.add_argument('-C', '--community', default='public',
+                             help='Community. Default=public')
+    soak_parser.add_argument('-d', '--duration', type=float, default=60,
+                             help='Duration (in seconds). Default=60')
+    soak_parser.add_argument('-r', '--requests', type=int, default=100,
+                             help='Requests per batch. Default=100')
+    soak_parser.add_argument('-i', '--interval', type=float, default=0.2,
+                             help='Delay between two batches. Default=0.2')
+    soak_parser.add_argument('--inflight', type=int, default=50,
+                             help='Max requests in flight. Default=50')
+    soak_parser.set_defaults(func=bench_soak)
+
+    backends_parser = subparsers.add_parser('backends',
+                                            help='cmdgen, asyncio and fast '
+                                                 'SNMP workers')
+    backends_parser.add_argument('-a', '--addresses', default='127.0.0.1',
+                                 help='Comma separated agent addresses. '
+                                      'Default=127.0.0.1')
+    backends_parser.add_argument('-p', '--port', type=int, default=161,
+                                 help='Agent port. Default=161')
+    backends_parser.add_argument('-C', '--community', default='public',
+                                 help='Community. Default=public')
+    backends_parser.add_argument('-r', '--requests', type=int, default=5000,
+                                 help='Number of requests. Default=5000')
+    backends_parser.add_argument('--inflight', type=int, default=50,
+                                 help='Max requests in flight. Default=50')
+    backends_parser.set_defaults(func=bench_backends)
+
+    codec_parser = subparsers.add_parser('codec',
+                                         help='SNMP v2c codec CPU time')
+    codec_parser.add_argument('-v', '--varbinds', type=int, default=64,
+                              help='Variable bindings per message. Default=64')
+    codec_parser.add_argument('-m', '--messages', type=int, default=1000,
+                              help='Number of messages. Default=1000')
+    codec_parser.set_defaults(func=bench_codec)
+
+    mapping_parser = subparsers.add_parser('mapping',
+                                           help='mapping callbacks CPU time')
+    mapping_parser.add_argument('-r', '--rows', type=int, default=50000,
+                                help='Rows of the mapping table. Default=50000')
+    mapping_parser.add_argument('-n', '--names', type=int, default=100,
+                                help='Wanted instance names. Default=100')
+    mapping_parser.add_argument('-R', '--repetitions', type=int, default=64,
+                                help='Rows per GETBULK response. Default=64')
+    mapping_parser.add_argument('-w', '--walks', type=int, default=5,
+                                help='Number of walks. Default=5')
+    mapping_parser.set_defaults(func=bench_mapping)
+
+    snmpv3_parser = subparsers.add_parser('snmpv3',
+                                          help='SNMP v3 and v2c requests of '
+                                               'the fast SNMP worker')
+    snmpv3_parser.add_argument('-a', '--addresses', default='127.0.0.1',
+                               help='Comma separated agent addresses. '
+                                    'Default=127.0.0.1')
+    snmpv3_parser.add_argument('-p', '--port', type=int, default=161,
+                               help='Agent port. Default=161')
+    snmpv3_parser.add_argument('-C', '--community', default='public',
+                               help='Community. Default=public')
+    snmpv3_parser.add_argument('--auth-user', default=None,
+                               help='authNoPriv user, not benched if not set')
+    snmpv3_parser.add_argument('--priv-user', default=None,
+                               help='authPriv user, not benched if not set')
+    snmpv3_parser.add_argument('--auth-protocol', default='MD5',
+                               choices=('MD5', 'SHA'),
+                               help='Authentication protocol. Default=MD5')
+    snmpv3_parser.add_argument('-k', '--auth-key', default='authkey123',
+                               help='Authentication key. Default=authkey123')
+    snmpv3_parser.add_argument('--priv-protocol', default='DES',
+                               choices=('DES', 'AES'),
+                               help='Privacy protocol. Default=DES')
+    snmpv3_parser.add_argument('-X', '--priv-key', default='privkey123',
+                               help='Privacy key. Default=privkey123')
+    snmpv3_parser.add_argument('-r', '--requests', type=int, default=5000,
+                               help='Number of requests. Default=5000')
+    snmpv3_parser.add_argument('--inflight', type=int, default=50,
+                               help='Max requests in flight. Default=50')
+    snmpv3_parser.add_argument('-v', '--varbinds', type=int, default=64,
+                               help='Variable bindings per message of the CPU '
+                                    'time bench. Default=64')
+    snmpv3_parser.set_defaults(func=bench_snmpv3)
+
+    args = parser.parse_args()
+    # Rejected command lines are logged as errors
+    logging.getLogger('alignak').setLevel(logging.CRITICAL)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
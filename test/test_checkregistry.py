@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2016: Alignak team, see AUTHORS.txt file for contributors
+#
+# This file is part of Alignak.
+#
+# Alignak is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Alignak is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Alignak.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Test the registry of the checks handled by the poller
+"""
+
+import unittest
+
+from alignak_module_snmp_booster.libs.checkregistry import CheckRegistry
+
+
+class FakeCheck(object):
+    """ Check launched at check_time """
+    def __init__(self, check_time=0):
+        self.check_time = check_time
+
+
+class TestCheckRegistry(unittest.TestCase):
+    """
+    This class contains the tests of CheckRegistry
+    """
+
+    def test_states(self):
+        """ Checks go from queued to launched to done """
+        registry = CheckRegistry()
+        checks = [FakeCheck() for _ in range(3)]
+        for check in checks:
+            registry.add(check)
+        self.assertEqual(len(registry), 3)
+        self.assertEqual(list(registry.pop_queued()), checks)
+        self.assertEqual(len(registry), 0)
+        for check in checks:
+            registry.set_launched(check)
+        self.assertEqual(len(registry), 3)
+        self.assertTrue(registry.is_launched(checks[0]))
+        registry.set_done(checks[1])
+        self.assertEqual(list(registry.pop_done()), [checks[1]])
+        self.assertFalse(registry.is_launched(checks[1]))
+        self.assertEqual(len(registry), 2)
+
+    def test_done_once(self):
+        """ A check set done several times is only returned once """
+        registry = CheckRegistry()
+        check = FakeCheck()
+        registry.set_launched(check)
+        registry.set_done(check)
+        registry.set_done(check)
+        self.assertEqual(list(registry.pop_done()), [check])
+        self.assertEqual(list(registry.pop_done()), [])
+        # Put back by keep_launched, it can be returned again
+        registry.keep_launched(check)
+        registry.set_done(check)
+        self.assertEqual(list(registry.pop_done()), [check])
+
+    def test_timed_out(self):
+        """ Only the launched checks older than the timeout are returned,
+        oldest first
+        """
+        registry = CheckRegistry()
+        checks = [FakeCheck(check_time) for check_time in (10, 20, 30)]
+        for check in checks:
+            registry.set_launched(check)
+        # The oldest one is already returned
+        registry.set_done(checks[0])
+        list(registry.pop_done())
+        self.assertEqual(list(registry.pop_timed_out(35, 10)), [checks[1]])
+        self.assertEqual(list(registry.pop_timed_out(35, 10)), [])
+        self.assertEqual(list(registry.pop_timed_out(100, 10)), [checks[2]])
+        self.assertTrue(registry.is_launched(checks[2]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2016: Alignak team, see AUTHORS.txt file for contributors
+#
+# This file is part of Alignak.
+#
+# Alignak is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Alignak is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Alignak.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Test the cache of the parsed check command lines
+"""
+
+import unittest
+
+from alignak_module_snmp_booster.libs.commandcache import CommandCache
+
+
+def get_command(index):
+    """ Return the check command line of host index """
+    return (u"check_snmp_booster -H host%d -A 10.0.0.%d -S 'Interface eth0' "
+            "-C public -V 2c -t standard-interface" % (index, index))
+
+
+class TestCommandCache(unittest.TestCase):
+    """
+    This class contains the tests of CommandCache
+    """
+
+    def test_get_args(self):
+        """ Command lines are parsed once, the caller gets a copy """
+        cache = CommandCache()
+        args = cache.get_args(get_command(1))
+        self.assertEqual(args['host'], 'host1')
+        self.assertEqual(args['service'], 'Interface eth0')
+        args['host'] = 'other'
+        self.assertEqual(cache.get_args(get_command(1))['host'], 'host1')
+        stats = cache.get_stats()
+        self.assertEqual((stats['size'], stats['hits'], stats['misses']),
+                         (1, 1, 1))
+
+    def test_lru(self):
+        """ The least recently used command line is forgotten first """
+        cache = CommandCache(2)
+        cache.get_args(get_command(1))
+        cache.get_args(get_command(2))
+        cache.get_args(get_command(1))
+        cache.get_args(get_command(3))
+        self.assertEqual(len(cache), 2)
+        cache.get_args(get_command(1))
+        self.assertEqual(cache.get_stats()['hits'], 2)
+        cache.get_args(get_command(2))
+        self.assertEqual(cache.get_stats()['misses'], 4)
+
+    def test_bad_command(self):
+        """ Command lines which can not be parsed are not cached """
+        cache = CommandCache()
+        for _ in range(2):
+            self.assertRaises(Exception, cache.get_args,
+                              u"check_snmp_booster --bad-option")
+        self.assertEqual(len(cache), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
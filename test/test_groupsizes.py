@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2016: Alignak team, see AUTHORS.txt file for contributors
+#
+# This file is part of Alignak.
+#
+# Alignak is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Alignak is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Alignak.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Test the adaptive number of oids of the GET requests of the hosts
+"""
+
+import time
+import unittest
+
+from alignak_module_snmp_booster.libs.groupsizes import GroupSizes
+
+
+class TestGroupSizes(unittest.TestCase):
+    """
+    This class contains the tests of GroupSizes
+    """
+
+    def test_increase(self):
+        """ Full requests answered quickly increase the size """
+        sizes = GroupSizes()
+        self.assertEqual(sizes.get_group_size('10.0.0.1', 64), 64)
+        now = time.time()
+        sizes.request_done('10.0.0.1', 64, 64, now, 0.1, 5, False, False)
+        self.assertEqual(sizes.get_group_size('10.0.0.1', 64), 68)
+        # Not a full request
+        sizes.request_done('10.0.0.1', 10, 68, now, 0.1, 5, False, False)
+        self.assertEqual(sizes.get_group_size('10.0.0.1', 64), 68)
+
+    def test_too_big(self):
+        """ tooBig responses halve the size, which then stays below the
+        size of the request
+        """
+        sizes = GroupSizes()
+        now = time.time()
+        sizes.request_done('10.0.0.1', 64, 64, now, 0.1, 5, False, True)
+        self.assertEqual(sizes.get_group_size('10.0.0.1', 64), 32)
+        for _ in range(20):
+            sizes.request_done('10.0.0.1', 64, 64, now, 0.1, 5, False, False)
+        self.assertEqual(sizes.get_sizes()['10.0.0.1'],
+                         {'size': 63, 'ceiling': 63})
+
+    def test_failures(self):
+        """ A timeout only decreases the size when the host answered a
+        request sent after it, slow responses decrease it
+        """
+        sizes = GroupSizes()
+        now = time.time()
+        sizes.request_done('10.0.0.1', 64, 64, now, 5, 5, True, False)
+        self.assertEqual(sizes.get_group_size('10.0.0.1', 64), 64)
+        sizes.request_done('10.0.0.1', 8, 64, now + 1, 0.1, 5, False, False)
+        sizes.request_done('10.0.0.1', 64, 64, now, 5, 5, True, False)
+        self.assertEqual(sizes.get_group_size('10.0.0.1', 64), 32)
+        sizes.request_done('10.0.0.2', 64, 64, now, 2, 5, False, False)
+        self.assertEqual(sizes.get_group_size('10.0.0.2', 64), 48)
+
+    def test_changed_sizes(self):
+        """ Only the hosts changed since the previous call are returned """
+        sizes = GroupSizes()
+        sizes.set_sizes({'10.0.0.1': {'size': 64, 'ceiling': 200}})
+        self.assertEqual(sizes.pop_changed_sizes(), {})
+        now = time.time()
+        sizes.request_done('10.0.0.1', 64, 64, now, 0.1, 5, False, False)
+        sizes.request_done('10.0.0.2', 8, 64, now, 0.1, 5, False, False)
+        self.assertEqual(sizes.pop_changed_sizes(),
+                         {'10.0.0.1': {'size': 68, 'ceiling': 200},
+                          '10.0.0.2': {'size': 64, 'ceiling': 200}})
+        # Not a full request, the size does not change
+        sizes.request_done('10.0.0.2', 8, 64, now, 0.1, 5, False, False)
+        self.assertEqual(sizes.pop_changed_sizes(), {})
+
+    def test_set_sizes(self):
+        """ Saved sizes are restored within the bounds """
+        sizes = GroupSizes()
+        sizes.set_sizes({'10.0.0.1': {'size': '80', 'ceiling': '60'},
+                         '10.0.0.2': {'size': 1, 'ceiling': 1000}})
+        self.assertEqual(sizes.get_sizes(),
+                         {'10.0.0.1': {'size': 60, 'ceiling': 60},
+                          '10.0.0.2': {'size': 4, 'ceiling': 200}})
+
+
+if __name__ == '__main__':
+    unittest.main()
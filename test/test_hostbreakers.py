@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2016: Alignak team, see AUTHORS.txt file for contributors
+#
+# This file is part of Alignak.
+#
+# Alignak is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Alignak is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Alignak.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Test the circuit breakers of the hosts
+"""
+
+import threading
+import unittest
+
+from alignak_module_snmp_booster.libs.hostbreakers import HostBreakers
+
+
+class TestHostBreakers(unittest.TestCase):
+    """
+    This class contains the tests of HostBreakers
+    """
+
+    def test_open_close(self):
+        """ The breaker opens after max_timeouts failures in a row and
+        closes with the first answer
+        """
+        breakers = HostBreakers(3)
+        for _ in range(2):
+            breakers.request_done('10.0.0.1', True)
+        breakers.request_done('10.0.0.1', False)
+        breakers.request_done('10.0.0.1', True)
+        self.assertFalse(breakers.is_open('10.0.0.1'))
+        for _ in range(2):
+            breakers.request_done('10.0.0.1', True)
+        self.assertTrue(breakers.is_open('10.0.0.1'))
+        self.assertFalse(breakers.is_open('10.0.0.2'))
+        breakers.request_done('10.0.0.1', False)
+        self.assertFalse(breakers.is_open('10.0.0.1'))
+        self.assertEqual(breakers.get_states()['10.0.0.1']['trips'], 1)
+
+    def test_probes(self):
+        """ Only one probe at a time while the breaker is open """
+        breakers = HostBreakers(1)
+        breakers.request_done('10.0.0.1', True)
+        self.assertTrue(breakers.start_probe('10.0.0.1', 5))
+        self.assertFalse(breakers.start_probe('10.0.0.1', 5))
+        # The probe is lost after two timeouts
+        breakers.hosts['10.0.0.1']['probe_time'] -= 10
+        self.assertTrue(breakers.start_probe('10.0.0.1', 5))
+        state = breakers.get_states()['10.0.0.1']
+        self.assertEqual(state['probes'], 2)
+        self.assertEqual(state['skipped'], 3)
+
+    def test_changed_states(self):
+        """ Only the breakers changed since the previous call are
+        returned
+        """
+        breakers = HostBreakers(3)
+        breakers.request_done('10.0.0.1', False)
+        self.assertEqual(breakers.pop_changed_states(), {})
+        breakers.request_done('10.0.0.1', True)
+        breakers.request_done('10.0.0.2', True)
+        self.assertEqual(sorted(breakers.pop_changed_states()),
+                         ['10.0.0.1', '10.0.0.2'])
+        self.assertEqual(breakers.pop_changed_states(), {})
+        breakers.request_done('10.0.0.2', False)
+        states = breakers.pop_changed_states()
+        self.assertEqual(states.keys(), ['10.0.0.2'])
+        self.assertEqual(states['10.0.0.2']['timeouts'], 0)
+
+    def test_threads(self):
+        """ Updates of the workers are not lost while the states are read """
+        breakers = HostBreakers(1000000)
+
+        def fail_requests(host):
+            """ Count failed requests of many hosts """
+            for index in range(2000):
+                breakers.request_done('%s.%d' % (host, index % 500), True)
+
+        threads = [threading.Thread(target=fail_requests, args=(str(index),))
+                   for index in range(4)]
+        for thread in threads:
+            thread.start()
+        while any([thread.is_alive() for thread in threads]):
+            breakers.get_states()
+        states = breakers.get_states()
+        self.assertEqual(len(states), 2000)
+        self.assertEqual(sum([state['timeouts'] for state in states.values()]),
+                         8000)
+
+
+if __name__ == '__main__':
+    unittest.main()
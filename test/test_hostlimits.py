@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2016: Alignak team, see AUTHORS.txt file for contributors
+#
+# This file is part of Alignak.
+#
+# Alignak is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Alignak is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Alignak.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Test the adaptive limits of SNMP requests in flight of the hosts
+"""
+
+import time
+import unittest
+
+from alignak_module_snmp_booster.libs.hostlimits import HostLimits
+
+
+class TestHostLimits(unittest.TestCase):
+    """
+    This class contains the tests of HostLimits
+    """
+
+    def test_initial_limit(self):
+        """ Unknown hosts start with the initial limit """
+        limits = HostLimits(4)
+        self.assertEqual(limits.get_limit('10.0.0.1'), 4)
+        self.assertEqual(limits.get_limit('10.0.0.1', True), 1)
+        self.assertEqual(limits.get_limits(), {})
+
+    def test_increase(self):
+        """ Each fast answer adds 1/limit, up to the max limit """
+        limits = HostLimits(4)
+        for _ in range(5):
+            limits.request_done('10.0.0.1', time.time(), 5, False)
+        self.assertEqual(limits.get_limit('10.0.0.1'), 5)
+        for _ in range(2000):
+            limits.request_done('10.0.0.1', time.time(), 5, False)
+        self.assertEqual(limits.get_limit('10.0.0.1'), 32)
+        # A higher initial limit raises the max limit
+        limits = HostLimits(64)
+        limits.request_done('10.0.0.1', time.time(), 5, False)
+        self.assertEqual(limits.get_limit('10.0.0.1'), 64)
+
+    def test_decrease(self):
+        """ Timeouts and slow answers halve the limit, once for the
+        requests sent before the previous decrease
+        """
+        limits = HostLimits(8)
+        sent_time = time.time() - 1
+        limits.request_done('10.0.0.1', sent_time, 5, True)
+        self.assertEqual(limits.get_limit('10.0.0.1'), 4)
+        limits.request_done('10.0.0.1', sent_time, 5, True)
+        self.assertEqual(limits.get_limit('10.0.0.1'), 4)
+        for _ in range(3):
+            limits.request_done('10.0.0.1', time.time() + 1, 5, True)
+        self.assertEqual(limits.get_limit('10.0.0.1'), 1)
+        # Slow answer: more than half the timeout
+        limits.request_done('10.0.0.2', time.time() - 3, 5, False)
+        self.assertEqual(limits.get_limit('10.0.0.2'), 4)
+
+    def test_forget_idle_hosts(self):
+        """ Idle hosts start again from the initial limit """
+        limits = HostLimits(8)
+        limits.request_done('10.0.0.1', time.time(), 5, True)
+        self.assertEqual(limits.get_limit('10.0.0.1'), 4)
+        limits.forget_idle_hosts(time.time() + 1)
+        self.assertEqual(limits.get_limit('10.0.0.1'), 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2016: Alignak team, see AUTHORS.txt file for contributors
+#
+# This file is part of Alignak.
+#
+# Alignak is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Alignak is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Alignak.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Test the SNMP v2c and v3 codec against the pysnmp encoder and decoder
+"""
+
+import unittest
+
+from pyasn1.codec.ber import encoder, decoder
+from pyasn1.type import univ
+from pysnmp.proto import api
+from pysnmp.proto.mpmod.rfc3412 import SNMPv3Message
+from pysnmp.proto.secmod.rfc3414.service import UsmSecurityParameters
+from pysnmp.proto.rfc1902 import (Integer, OctetString, ObjectIdentifier,
+                                  IpAddress, Counter32, Gauge32, TimeTicks,
+                                  Opaque, Counter64, Null)
+from pysnmp.proto.rfc1905 import EndOfMibView
+from pysnmp.smi.exval import noSuchObject, noSuchInstance, endOfMibView
+
+from alignak_module_snmp_booster.libs.snmpcodec import (encode_request,
+                                                        encode_request_template,
+                                                        fill_request_template,
+                                                        decode_response,
+                                                        encode_pdu,
+                                                        encode_scoped_pdu,
+                                                        encode_v3_message,
+                                                        decode_version,
+                                                        decode_v3_message,
+                                                        decode_scoped_pdu,
+                                                        SNMPCodecError,
+                                                        FLAG_AUTH,
+                                                        FLAG_PRIV,
+                                                        FLAG_REPORTABLE,
+                                                        GET_REQUEST,
+                                                        GETNEXT_REQUEST,
+                                                        GETBULK_REQUEST,
+                                                        REQUEST_ID_MIN,
+                                                        REQUEST_ID_MAX)
+
+
+V2C = api.protoModules[api.protoVersion2c]
+
+
+def pysnmp_response(var_binds, request_id=1234, community='public',
+                    error_status=0, error_index=0):
+    """ Return a response message encoded by pysnmp """
+    pdu = V2C.GetResponsePDU()
+    V2C.apiPDU.setDefaults(pdu)
+    V2C.apiPDU.setRequestID(pdu, request_id)
+    V2C.apiPDU.setErrorStatus(pdu, error_status)
+    V2C.apiPDU.setErrorIndex(pdu, error_index)
+    V2C.apiPDU.setVarBinds(pdu, var_binds)
+    message = V2C.Message()
+    V2C.apiMessage.setDefaults(message)
+    V2C.apiMessage.setCommunity(message, community)
+    V2C.apiMessage.setPDU(message, pdu)
+    return encoder.encode(message)
+
+
+def pysnmp_request(data):
+    """ Return the message and the PDU decoded by pysnmp """
+    message, rest = decoder.decode(data, asn1Spec=V2C.Message())
+    return message, V2C.apiMessage.getPDU(message), rest
+
+
+class TestSnmpCodec(unittest.TestCase):
+    """
+    This class contains the parity tests of the SNMP codec
+    """
+
+    def check_request(self, pdu_type, pdu_class, oids, **kwargs):
+        """ Encode a request and check pysnmp decodes the same one """
+        data = encode_request(pdu_type, 987654, 'private', oids, **kwargs)
+        message, pdu, rest = pysnmp_request(data)
+        self.assertEqual(rest, '')
+        self.assertEqual(V2C.apiMessage.getVersion(message), 1)
+        self.assertEqual(str(V2C.apiMessage.getCommunity(message)), 'private')
+        self.assertTrue(pdu.isSameTypeWith(pdu_class()))
+        self.assertEqual(V2C.apiPDU.getRequestID(pdu), 987654)
+        var_binds = V2C.apiPDU.getVarBinds(pdu)
+        self.assertEqual([oid.prettyPrint() for oid, _ in var_binds],
+                         [oid.lstrip('.') for oid in oids])
+        for _, value in var_binds:
+            self.assertTrue(value.isSameTypeWith(Null('')))
+        # Same bytes as pysnmp
+        self.assertEqual(data, encoder.encode(message))
+        return pdu
+
+    def test_encode_get(self):
+        """ GET requests """
+        self.check_request(GET_REQUEST, V2C.GetRequestPDU,
+                           ['1.3.6.1.2.1.1.3.0', '.1.3.6.1.2.1.2.2.1.10.2'])
+
+    def test_encode_next(self):
+        """ GETNEXT requests """
+        self.check_request(GETNEXT_REQUEST, V2C.GetNextRequestPDU,
+                           ['1.3.6.1.2.1.2.2.1.2'])
+
+    def test_encode_bulk(self):
+        """ GETBULK requests """
+        pdu = self.check_request(GETBULK_REQUEST, V2C.GetBulkRequestPDU,
+                                 ['1.3.6.1.2.1.2.2.1.2'], max_repetitions=64)
+        self.assertEqual(V2C.apiBulkPDU.getNonRepeaters(pdu), 0)
+        self.assertEqual(V2C.apiBulkPDU.getMaxRepetitions(pdu), 64)
+
+    def test_encode_large(self):
+        """ Long form lengths, large arcs and request ids """
+        oids = ['1.3.6.1.4.1.2021.%d.4294967295.%d' % (index, index * 300)
+                for index in range(64)]
+        for request_id in (0, 127, 128, 255, 256, 0x7fffffff):
+            data = encode_request(GET_REQUEST, request_id, 'public', oids)
+            _, pdu, _ = pysnmp_request(data)
+            self.assertEqual(V2C.apiPDU.getRequestID(pdu), request_id)
+            self.assertEqual([oid.prettyPrint() for oid, _
+                              in V2C.apiPDU.getVarBinds(pdu)], oids)
+
+    def test_encode_template(self):
+        """ Filled templates are the encoded requests """
+        for oids in (['1.3.6.1.2.1.1.3.0'],
+                     ['1.3.6.1.2.1.31.1.1.1.6.%d' % index for index in range(64)]):
+            for pdu_type, max_repetitions in ((GET_REQUEST, 0),
+                                              (GETBULK_REQUEST, 32)):
+                template = encode_request_template(pdu_type, 'public', oids,
+                                                   0, max_repetitions)
+                for request_id in (REQUEST_ID_MIN, 0xffffff, 0x1000000,
+                                   REQUEST_ID_MAX):
+                    self.assertEqual(fill_request_template(template, request_id),
+                                     encode_request(pdu_type, request_id,
+                                                    'public', oids, 0,
+                                                    max_repetitions))
+
+    def test_decode_values(self):
+        """ Each value type decoded like the callbacks see pysnmp ones """
+        values = [Integer(-1), Integer(0), Integer(127), Integer(128),
+                  Integer(-2147483648), Integer(2147483647),
+                  OctetString('eth0'), OctetString(''),
+                  OctetString('\x00\xff' * 200),
+                  ObjectIdentifier('1.3.6.1.4.1.8072.3.2.10'),
+                  IpAddress('192.168.1.254'),
+                  Counter32(0), Counter32(4294967295), Gauge32(2147483648),
+                  TimeTicks(123456), Opaque('\x9f\x78\x04'),
+                  Counter64(18446744073709551615),
+                  ]
+        var_binds = [('1.3.6.1.2.1.1.%d.0' % index, value)
+                     for index, value in enumerate(values)]
+        data = pysnmp_response(var_binds)
+        _, _, _, _, decoded = decode_response(data)
+        self.assertEqual(len(decoded), len(values))
+        # Same bytes decoded by pysnmp
+        _, pdu, _ = pysnmp_request(data)
+        pysnmp_var_binds = V2C.apiPDU.getVarBinds(pdu)
+        for (oid, value), (expected_oid, expected) in zip(decoded, pysnmp_var_binds):
+            self.assertEqual(oid.prettyPrint(), expected_oid.prettyPrint())
+            self.assertEqual(oid.asTuple(), expected_oid.asTuple())
+            # What save_results and the mapping callbacks use
+            self.assertEqual(str(value), str(expected))
+            if isinstance(expected, univ.Integer):
+                self.assertEqual(float(value), float(expected))
+
+    def test_decode_exceptions(self):
+        """ Exception values are the pysnmp objects """
+        var_binds = [('1.3.6.1.2.1.1.1.0', noSuchObject),
+                     ('1.3.6.1.2.1.1.2.0', noSuchInstance),
+                     ('1.3.6.1.2.1.1.3.0', endOfMibView),
+                     ]
+        _, _, _, _, decoded = decode_response(pysnmp_response(var_binds))
+        self.assertTrue(decoded[0][1] is noSuchObject)
+        self.assertTrue(decoded[1][1] == noSuchInstance)
+        self.assertTrue(isinstance(decoded[2][1], EndOfMibView))
+
+    def test_decode_header(self):
+        """ Community, request id and errors """
+        data = pysnmp_response([('1.3.6.1.2.1.1.3.0', Null(''))],
+                               request_id=0x7fffffff, community='c0mmunity',
+                               error_status=2, error_index=1)
+        community, request_id, error_status, error_index, var_binds = decode_response(data)
+        self.assertEqual(community, 'c0mmunity')
+        self.assertEqual(request_id, 0x7fffffff)
+        self.assertEqual(error_status, 2)
+        self.assertEqual(error_index, 1)
+        self.assertEqual(var_binds[0][1], Null(''))
+
+    def test_decode_errors(self):
+        """ Truncated or unexpected messages are rejected """
+        data = pysnmp_response([('1.3.6.1.2.1.1.5.0', OctetString('host'))])
+        for size in range(len(data)):
+            self.assertRaises(SNMPCodecError, decode_response, data[:size])
+        # A request is not a response
+        request = encode_request(GET_REQUEST, 1, 'public', ['1.3.6.1.2.1.1.5.0'])
+        self.assertRaises(SNMPCodecError, decode_response, request)
+        # SNMP v1
+        message = api.protoModules[api.protoVersion1].Message()
+        api.protoModules[api.protoVersion1].apiMessage.setDefaults(message)
+        pdu = api.protoModules[api.protoVersion1].GetResponsePDU()
+        api.protoModules[api.protoVersion1].apiPDU.setDefaults(pdu)
+        api.protoModules[api.protoVersion1].apiMessage.setPDU(message, pdu)
+        self.assertRaises(SNMPCodecError, decode_response, encoder.encode(message))
+
+    def test_v3_message(self):
+        """ v3 messages decoded like pysnmp and read back """
+        oids = ['1.3.6.1.2.1.2.2.1.10.%d' % index for index in range(1, 9)]
+        pdu = encode_pdu(GET_REQUEST, 4321, oids)
+        scoped_pdu = encode_scoped_pdu('\x80\x00\x1f\x88\x04', pdu)
+        data, auth_offset = encode_v3_message(4321, FLAG_AUTH | FLAG_REPORTABLE,
+                                              '\x80\x00\x1f\x88\x04', 3,
+                                              86400, 'admin', '', scoped_pdu)
+        self.assertEqual(decode_version(data), 3)
+        self.assertEqual(data[auth_offset:auth_offset + 12], '\x00' * 12)
+        message, rest = decoder.decode(data, asn1Spec=SNMPv3Message())
+        self.assertEqual(rest, '')
+        self.assertEqual(int(message['msgGlobalData']['msgID']), 4321)
+        self.assertEqual(int(message['msgGlobalData']['msgSecurityModel']), 3)
+        security_parameters, _ = decoder.decode(message['msgSecurityParameters'],
+                                                asn1Spec=UsmSecurityParameters())
+        self.assertEqual(str(security_parameters['msgUserName']), 'admin')
+        self.assertEqual(int(security_parameters['msgAuthoritativeEngineTime']),
+                         86400)
+        # Same bytes as pysnmp
+        self.assertEqual(data, encoder.encode(message))
+        header = decode_v3_message(data)
+        self.assertEqual(header['msg_id'], 4321)
+        self.assertEqual(header['flags'], FLAG_AUTH | FLAG_REPORTABLE)
+        self.assertEqual(header['engine_id'], '\x80\x00\x1f\x88\x04')
+        self.assertEqual(header['engine_boots'], 3)
+        self.assertEqual(header['auth_offset'], auth_offset)
+        self.assertEqual(header['msg_data'], scoped_pdu)
+        # Decrypted scoped PDUs end with padding
+        (context_engine_id, pdu_type, request_id,
+         _, _, var_binds) = decode_scoped_pdu(scoped_pdu + '\x00' * 7)
+        self.assertEqual(context_engine_id, '\x80\x00\x1f\x88\x04')
+        self.assertEqual(pdu_type, GET_REQUEST)
+        self.assertEqual(request_id, 4321)
+        self.assertEqual([oid.prettyPrint() for oid, _ in var_binds], oids)
+        # Encrypted scoped PDU
+        data, _ = encode_v3_message(1, FLAG_AUTH | FLAG_PRIV, 'engine', 1, 1,
+                                    'admin', '\x00' * 8,
+                                    encoder.encode(univ.OctetString('x' * 24)))
+        self.assertEqual(decode_v3_message(data)['msg_data'], 'x' * 24)
+        self.assertRaises(SNMPCodecError, decode_v3_message, pysnmp_response([]))
+
+
+if __name__ == '__main__':
+    unittest.main()
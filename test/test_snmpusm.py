@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2016: Alignak team, see AUTHORS.txt file for contributors
+#
+# This file is part of Alignak.
+#
+# Alignak is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Alignak is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Alignak.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Test the SNMP v3 keys, digests and encryption against RFC 3414 and pysnmp
+"""
+
+import unittest
+from hashlib import md5, sha1
+
+from pyasn1.type import univ
+from pysnmp.entity.rfc3413.oneliner import cmdgen
+from pysnmp.proto.secmod.rfc3414.auth import hmacmd5, hmacsha
+from pysnmp.proto.secmod.rfc3414.priv import des
+from pysnmp.proto.secmod.rfc3826.priv import aes
+
+from alignak_module_snmp_booster.libs.snmpusm import (password_to_key,
+                                                      localize_key,
+                                                      UsmKeys,
+                                                      UsmEngineCache)
+from alignak_module_snmp_booster.libs.targetcache import (AUTH_PROTOCOLS,
+                                                          PRIV_PROTOCOLS)
+
+
+# RFC 3414 A.3
+ENGINE_ID = '\x00' * 11 + '\x02'
+
+
+class TestSnmpUsm(unittest.TestCase):
+    """
+    This class contains the tests of the SNMP v3 User-based Security Model
+    """
+
+    def test_localize_key(self):
+        """ Keys of RFC 3414 A.3 """
+        self.assertEqual(localize_key(password_to_key('maplesyrup', md5),
+                                      ENGINE_ID, md5).encode('hex'),
+                         '526f5eed9fcce26f8964c2930787d82b')
+        self.assertEqual(localize_key(password_to_key('maplesyrup', sha1),
+                                      ENGINE_ID, sha1).encode('hex'),
+                         '6695febc9288e36282235fc7151f128497b38f3f')
+
+    def test_sign(self):
+        """ Digests computed like pysnmp and verified """
+        message = '0\x2a' + '\x01' * 20 + '\x00' * 12 + '\x02' * 10
+        for hash_function, auth in ((md5, hmacmd5.HmacMd5()),
+                                    (sha1, hmacsha.HmacSha())):
+            auth_key = localize_key(password_to_key('maplesyrup', hash_function),
+                                    ENGINE_ID, hash_function)
+            keys = UsmKeys(hash_function, auth_key, None, None)
+            signed = keys.sign(message, 22)
+            self.assertEqual(signed, auth.authenticateOutgoingMsg(
+                univ.OctetString(auth_key), message))
+            self.assertTrue(keys.verify(signed, 22, signed[22:34]))
+            self.assertFalse(keys.verify(signed[:-1] + '\x03', 22,
+                                         signed[22:34]))
+
+    def test_encrypt(self):
+        """ Scoped PDUs encrypted like pysnmp decrypts them """
+        data = '0\x1f' + 'scoped PDU of 33 octets' + '\x00' * 8
+        for priv_protocol, priv in (('DES', des.Des()), ('AES', aes.Aes())):
+            priv_key = localize_key(password_to_key('maplesyrup', md5),
+                                    ENGINE_ID, md5)
+            keys = UsmKeys(md5, priv_key, PRIV_PROTOCOLS[priv_protocol],
+                           priv_key)
+            encrypted, salt = keys.encrypt(data, 7, 12345)
+            decrypted = priv.decryptData(univ.OctetString(priv_key),
+                                         (7, 12345, univ.OctetString(salt)),
+                                         univ.OctetString(encrypted))
+            self.assertEqual(str(decrypted)[:len(data)], data)
+            self.assertEqual(keys.decrypt(encrypted, salt, 7, 12345)[:len(data)],
+                             data)
+            # Each message gets its own salt
+            self.assertNotEqual(keys.encrypt(data, 7, 12345)[1], salt)
+
+    def test_engine_cache(self):
+        """ Engines and keys are cached """
+        cache = UsmEngineCache(max_size=2)
+        self.assertEqual(cache.get_engine_id(('10.0.0.1', 161)), None)
+        cache.set_engine(('10.0.0.1', 161), ENGINE_ID, 3, 1000)
+        self.assertEqual(cache.get_engine_id(('10.0.0.1', 161)), ENGINE_ID)
+        engine_boots, engine_time = cache.get_engine_time(ENGINE_ID)
+        self.assertEqual(engine_boots, 3)
+        self.assertTrue(1000 <= engine_time <= 1001)
+        auth_data = cmdgen.UsmUserData('admin', 'maplesyrup', 'maplesyrup',
+                                       authProtocol=AUTH_PROTOCOLS['SHA'],
+                                       privProtocol=PRIV_PROTOCOLS['AES'])
+        keys = cache.get_keys(ENGINE_ID, auth_data)
+        self.assertTrue(cache.get_keys(ENGINE_ID, auth_data) is keys)
+        self.assertEqual(keys.priv_key.encode('hex'),
+                         '6695febc9288e36282235fc7151f128497b38f3f')
+        # Least recently used engines are forgotten
+        cache.set_engine(('10.0.0.2', 161), 'engine2', 1, 1)
+        cache.set_engine(('10.0.0.3', 161), 'engine3', 1, 1)
+        self.assertEqual(cache.get_engine_id(('10.0.0.1', 161)), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
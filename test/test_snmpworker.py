@@ -0,0 +1,379 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2016: Alignak team, see AUTHORS.txt file for contributors
+#
+# This file is part of Alignak.
+#
+# Alignak is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Alignak is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Alignak.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Test the callbacks of the SNMP requests of the workers
+"""
+
+import time
+import unittest
+from Queue import Queue
+
+from pysnmp.proto import errind
+from pysnmp.proto.rfc1902 import ObjectName, Counter32, OctetString
+from pysnmp.smi.exval import noSuchObject, noSuchInstance, endOfMibView
+
+from alignak_module_snmp_booster.libs.snmpworker import (SNMPWorker,
+                                                          callback_get,
+                                                          callback_mapping_state,
+                                                          map_column,
+                                                          mapping_cache_is_valid,
+                                                          is_no_response)
+from alignak_module_snmp_booster.libs.utils import oid_to_tuple
+
+
+OIDS = ['.1.3.6.1.2.1.2.2.1.10.%d' % index for index in range(1, 5)]
+
+
+def get_poll(oids=OIDS, retries=0):
+    """ Return the callback context of the GET requests of a poll of
+    oids, and the list of the requests sent again
+    """
+    results = dict([(oid, {'key': {'host': 'host', 'service': 'service',
+                                   'ds_names': [], 'oid_type': 'ds_oid'},
+                           'value': None, 'value_last': None})
+                    for oid in oids])
+    service_result = {'host': 'host', 'db_data': {'ds': {}},
+                      'start_time': time.time()}
+    sent = []
+    oids_index = {'oids': dict([(oid_to_tuple(oid), result)
+                                for oid, result in results.items()]),
+                  'outstanding': len(oids),
+                  'service_results': [],
+                  'mapping_checks': {},
+                  'db_client': None,
+                  'timeout': 1,
+                  'deadline': time.time() + 10,
+                  'send_get': lambda var_names, retries: sent.append(var_names),
+                  }
+    cb_ctx = (results, service_result, Queue(), oids_index,
+              [oid[1:] for oid in oids], retries)
+    return cb_ctx, sent
+
+
+class TestCallbackGet(unittest.TestCase):
+    """
+    This class contains the tests of callback_get
+    """
+
+    def test_values(self):
+        """ Values are saved and the results submitted """
+        cb_ctx, _ = get_poll()
+        callback_get(None, None, 0, 0,
+                     [(ObjectName(oid[1:]), Counter32(index))
+                      for index, oid in enumerate(OIDS)], cb_ctx)
+        self.assertEqual(cb_ctx[3]['outstanding'], 0)
+        self.assertEqual(cb_ctx[0][OIDS[2]]['value'], 2)
+        self.assertFalse(cb_ctx[2].empty())
+
+    def test_no_such_object(self):
+        """ noSuchObject and noSuchInstance values are errors """
+        cb_ctx, _ = get_poll(OIDS[:2])
+        callback_get(None, None, 0, 0,
+                     [(ObjectName(OIDS[0][1:]), noSuchObject),
+                      (ObjectName(OIDS[1][1:]), noSuchInstance)], cb_ctx)
+        for oid in OIDS[:2]:
+            self.assertEqual(cb_ctx[0][oid]['value'], None)
+            self.assertEqual(cb_ctx[0][oid]['error'],
+                             "Oid not found on the device: %s" % oid)
+        self.assertFalse(cb_ctx[2].empty())
+
+    def test_too_big(self):
+        """ A request too big for the device is sent again in two halves,
+        a single oid gets the error
+        """
+        cb_ctx, sent = get_poll()
+        callback_get(None, None, 1, 0, [], cb_ctx)
+        self.assertEqual(sent, [[oid[1:] for oid in OIDS[:2]],
+                                [oid[1:] for oid in OIDS[2:]]])
+        self.assertEqual(cb_ctx[3]['outstanding'], 4)
+        cb_ctx, sent = get_poll(OIDS[:1])
+        callback_get(None, None, 1, 0, [], cb_ctx)
+        self.assertEqual(sent, [])
+        self.assertEqual(cb_ctx[0][OIDS[0]]['error'], "SNMP error status: 1")
+        self.assertEqual(cb_ctx[3]['outstanding'], 0)
+        self.assertFalse(cb_ctx[2].empty())
+
+    def test_error_status(self):
+        """ Error responses without variable bindings fail their oids """
+        cb_ctx, _ = get_poll()
+        callback_get(None, None, 5, 1, [], cb_ctx)
+        for oid in OIDS:
+            self.assertEqual(cb_ctx[0][oid]['error'], "SNMP error status: 5")
+        self.assertFalse(cb_ctx[2].empty())
+
+    def test_retries(self):
+        """ The oids still missing after a failure are requested again
+        while the deadline allows it, then only they get the error
+        """
+        cb_ctx, sent = get_poll(retries=1)
+        cb_ctx[0][OIDS[0]]['value'] = 1
+        cb_ctx[3]['outstanding'] -= 1
+        callback_get(None, "No SNMP response", 0, 0, [], cb_ctx)
+        self.assertEqual(sent, [[oid[1:] for oid in OIDS[1:]]])
+        self.assertTrue(cb_ctx[2].empty())
+
+        cb_ctx[3]['deadline'] = time.time()
+        callback_get(None, "No SNMP response", 0, 0, [], cb_ctx)
+        self.assertEqual(len(sent), 1)
+        self.assertEqual(cb_ctx[0][OIDS[0]]['value'], 1)
+        self.assertEqual(cb_ctx[0][OIDS[0]].get('error'), None)
+        for oid in OIDS[1:]:
+            self.assertEqual(cb_ctx[0][oid]['error'], "No SNMP response")
+        self.assertFalse(cb_ctx[2].empty())
+
+    def test_mapping_datasource(self):
+        """ The instance name of a mapping polled by a datasource is
+        checked too, and the results are submitted
+        """
+        oid = '.1.3.6.1.2.1.2.2.1.2.2'
+        cb_ctx, _ = get_poll([oid])
+        mapping_check = {'host': 'host', 'mapping': '.1.3.6.1.2.1.2.2.1.2',
+                         'names': {'eth0': ['service']}, 'checked': False,
+                         'changed': [], 'table_collect': False}
+        cb_ctx[3]['mapping_checks'][oid_to_tuple(oid)] = mapping_check
+        cb_ctx[3]['outstanding'] += 1
+        callback_get(None, None, 0, 0,
+                     [(ObjectName(oid[1:]), OctetString('eth0'))], cb_ctx)
+        self.assertTrue(mapping_check['checked'])
+        self.assertEqual(mapping_check['changed'], [])
+        self.assertEqual(cb_ctx[0][oid]['value'], OctetString('eth0'))
+        self.assertEqual(cb_ctx[3]['outstanding'], 0)
+        self.assertFalse(cb_ctx[2].empty())
+
+    def test_held_requests(self):
+        """ The requests held until the first one of the poll is answered
+        are sent with its answer, and fail with it
+        """
+        cb_ctx, sent = get_poll()
+        cb_ctx = cb_ctx[:4] + ([oid[1:] for oid in OIDS[:2]], 0)
+        cb_ctx[3]['held_requests'] = [(lambda: sent.append('held'),
+                                       [oid[1:] for oid in OIDS[2:]])]
+        callback_get(None, None, 0, 0,
+                     [(ObjectName(oid[1:]), Counter32(1))
+                      for oid in OIDS[:2]], cb_ctx)
+        self.assertEqual(sent, ['held'])
+        self.assertEqual(cb_ctx[3]['outstanding'], 2)
+        self.assertTrue(cb_ctx[2].empty())
+
+        cb_ctx, sent = get_poll()
+        cb_ctx = cb_ctx[:4] + ([oid[1:] for oid in OIDS[:2]], 0)
+        cb_ctx[3]['held_requests'] = [(lambda: sent.append('held'),
+                                       [oid[1:] for oid in OIDS[2:]])]
+        callback_get(None, "No SNMP response", 0, 0, [], cb_ctx)
+        self.assertEqual(sent, [])
+        for oid in OIDS:
+            self.assertEqual(cb_ctx[0][oid]['error'], "No SNMP response")
+        self.assertFalse(cb_ctx[2].empty())
+
+
+MAPPING_OID = '.1.3.6.1.2.1.2.2.1.2'
+
+
+def get_mapping(names):
+    """ Return the result of the walk of the mapping table of names, and
+    the list of its finished walks
+    """
+    finished = []
+    result = {'data': dict([(name, None) for name in names]),
+              'finished': False,
+              'remaining': len(names),
+              'name_lengths': frozenset([len(name) for name in names]),
+              'mapping_oid': oid_to_tuple(MAPPING_OID),
+              'on_finished': lambda: finished.append(True),
+              }
+    return result, finished
+
+
+def get_rows(*rows):
+    """ Return the rows of a walk of the mapping table, one column """
+    return [[(ObjectName(oid[1:]), value)] for oid, value in rows]
+
+
+class TestMapColumn(unittest.TestCase):
+    """
+    This class contains the tests of map_column
+    """
+
+    def test_names(self):
+        """ The instances of the wanted names are saved, with the
+        illegal characters of the names cleaned
+        """
+        result, finished = get_mapping(['eth0', 'Gi0_1'])
+        map_column(get_rows((MAPPING_OID + '.1', OctetString('lo')),
+                            (MAPPING_OID + '.2', OctetString('eth0'))),
+                   0, result)
+        self.assertEqual(result['data'], {'eth0': '2', 'Gi0_1': None})
+        self.assertEqual(finished, [])
+        map_column(get_rows((MAPPING_OID + '.3', OctetString('Gi0/1'))),
+                   0, result)
+        self.assertEqual(result['data'], {'eth0': '2', 'Gi0_1': '3'})
+        self.assertEqual(result['remaining'], 0)
+        self.assertEqual(finished, [True])
+
+    def test_end_of_table(self):
+        """ The walk is finished at the end of the mapping table or of
+        the MIB
+        """
+        result, finished = get_mapping(['eth0'])
+        map_column(get_rows(('.1.3.6.1.2.1.2.2.1.3.1', OctetString('eth0'))),
+                   0, result)
+        self.assertEqual(result['data'], {'eth0': None})
+        self.assertEqual(finished, [True])
+        result, finished = get_mapping(['eth0'])
+        map_column(get_rows((MAPPING_OID + '.1', endOfMibView)), 0, result)
+        self.assertEqual(finished, [True])
+
+
+class TestMappingCache(unittest.TestCase):
+    """
+    This class contains the tests of mapping_cache_is_valid
+    """
+
+    def test_restart(self):
+        """ The cache is not valid after a restart of the device or
+        without uptime
+        """
+        cache = {'instances': {}, 'uptime': 1000, 'last_change': 10,
+                 'check_time': time.time()}
+        mapping_oid = oid_to_tuple(MAPPING_OID)
+        self.assertTrue(mapping_cache_is_valid(
+            cache, {'uptime': 2000, 'last_change': 10}, mapping_oid))
+        self.assertFalse(mapping_cache_is_valid(
+            cache, {'uptime': 500, 'last_change': 10}, mapping_oid))
+        self.assertFalse(mapping_cache_is_valid(
+            cache, {'uptime': None, 'last_change': 10}, mapping_oid))
+        self.assertFalse(mapping_cache_is_valid(
+            None, {'uptime': 2000, 'last_change': 10}, mapping_oid))
+
+    def test_restart_since_saved(self):
+        """ A device which restarted after the cache was saved is found
+        even when its uptime grew past the cached one
+        """
+        cache = {'instances': {}, 'uptime': 1000, 'last_change': 10,
+                 'check_time': time.time() - 3600}
+        mapping_oid = oid_to_tuple('.1.3.6.1.2.1.25.2.3.1.3')
+        self.assertFalse(mapping_cache_is_valid(
+            cache, {'uptime': 100000, 'last_change': 10}, mapping_oid))
+        self.assertTrue(mapping_cache_is_valid(
+            cache, {'uptime': 1000 + 3590 * 100, 'last_change': 10},
+            mapping_oid))
+        del cache['check_time']
+        self.assertFalse(mapping_cache_is_valid(
+            cache, {'uptime': 1000 + 3600 * 100, 'last_change': 10},
+            mapping_oid))
+
+    def test_last_change(self):
+        """ ifTableLastChange only invalidates the IF-MIB tables """
+        cache = {'instances': {}, 'uptime': 1000, 'last_change': 10,
+                 'check_time': time.time()}
+        state = {'uptime': 2000, 'last_change': 1500}
+        self.assertFalse(mapping_cache_is_valid(
+            cache, state, oid_to_tuple(MAPPING_OID)))
+        self.assertFalse(mapping_cache_is_valid(
+            cache, state, oid_to_tuple('.1.3.6.1.2.1.31.1.1.1.1')))
+        # hrStorageDescr
+        self.assertTrue(mapping_cache_is_valid(
+            cache, state, oid_to_tuple('.1.3.6.1.2.1.25.2.3.1.3')))
+        self.assertTrue(mapping_cache_is_valid(
+            cache, {'uptime': 2000, 'last_change': None},
+            oid_to_tuple('.1.3.6.1.2.1.25.2.3.1.3')))
+
+
+class TestNoResponse(unittest.TestCase):
+    """
+    This class contains the tests of is_no_response
+    """
+
+    def test_errors(self):
+        """ Only timeouts and transport errors are requests without
+        answer
+        """
+        self.assertFalse(is_no_response(None))
+        self.assertTrue(is_no_response(errind.requestTimedOut))
+        self.assertTrue(is_no_response("No SNMP response received before "
+                                       "timeout"))
+        self.assertTrue(is_no_response("Can not send SNMP request: "
+                                       "[Errno 101] Network is unreachable"))
+        self.assertFalse(is_no_response(errind.unknownUserName))
+        self.assertFalse(is_no_response(errind.wrongDigest))
+        self.assertFalse(is_no_response("OID not increasing"))
+        self.assertFalse(is_no_response("SNMP v3 report: usmStatsWrongDigests"))
+
+
+class FakeTarget(object):
+    """ Transport target of a request """
+    transportAddr = ('127.0.0.1', 161)
+
+
+class TestSendErrors(unittest.TestCase):
+    """
+    This class contains the tests of the requests which can not be sent
+    """
+
+    def test_callback(self):
+        """ The task callback gets the error of a request which can not
+        be sent, and the request is not in flight
+        """
+        worker = SNMPWorker(Queue(), 10)
+        calls = []
+        snmp_task = {'host': '127.0.0.1', 'type': 'get',
+                     'data': {'transportTarget': FakeTarget(),
+                              'cbInfo': (lambda *args: calls.append(args[1]),
+                                         None)}}
+        # The worker has no SNMP engine, the request can not be sent
+        worker.append_task_to_dispatcher(snmp_task)
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(calls[0].startswith("Can not send SNMP request: "))
+        self.assertEqual(worker.inflight_tasks, {})
+        self.assertEqual(worker.inflight_hosts.get('127.0.0.1', 0), 0)
+
+    def test_held_requests(self):
+        """ The held requests which can not be sent fail """
+        cb_ctx, sent = get_poll()
+        cb_ctx = cb_ctx[:4] + ([oid[1:] for oid in OIDS[:2]], 0)
+
+        def send_error():
+            """ Send a request on a broken network """
+            raise IOError("Network is unreachable")
+        cb_ctx[3]['held_requests'] = [(send_error,
+                                       [oid[1:] for oid in OIDS[2:]])]
+        callback_get(None, None, 0, 0,
+                     [(ObjectName(oid[1:]), Counter32(1))
+                      for oid in OIDS[:2]], cb_ctx)
+        for oid in OIDS[2:]:
+            self.assertEqual(cb_ctx[0][oid]['error'], "Network is unreachable")
+        self.assertFalse(cb_ctx[2].empty())
+
+    def test_mapping_walks(self):
+        """ The mapping is finished when its walks can not be sent """
+        result, finished = get_mapping(['eth0'])
+        result['cache'] = None
+
+        def send_walks(results):
+            """ Send the walks of an unknown host """
+            raise IOError("Name or service not known")
+        callback_mapping_state(None, None, 0, 0, [],
+                               ([result], {'host': 'host'}, send_walks))
+        self.assertEqual(finished, [True])
+
+
+if __name__ == '__main__':
+    unittest.main()